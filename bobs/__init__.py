@@ -0,0 +1 @@
+#BOBS Pancreas modules. the control loop is bobs/pancreas.py, started by bobs-pancreas.py
@@ -0,0 +1,160 @@
+#per-pump timing profile for the remote.
+#
+#after a suspend or resume from the remote, SuspendPump() used to sleep a flat 15 seconds ("the pump seems somewhat
+#knocked out") before talking to the pump again. how long the pump really needs differs from pump to pump and is
+#usually much shorter. Calibrate() measures it: it toggles suspend/resume a few times and times how long it takes until
+#get-session and the status read work again. the results are kept per pump serial number in a small JSON file, and
+#Settle() turns them into a delay: the slowest measurement, plus a margin, never more than the hand-tuned default.
+#
+#calibration only suspends and resumes. it never boluses. it checks that every toggle really changed the pump's state,
+#stops at the first one which did not, and whatever happens it toggles the pump back to how it found it.
+
+import os
+import json
+from bobs import clock
+
+TimingFile="./settings/remote_timing.json"
+Samples=10           #int (measurements kept per action)
+MarginFactor=1.5     #float (the slowest measurement is multiplied by this...)
+MarginSeconds=2.0    #float (...and this is added)
+MinimumSettle=3.0    #float (never wait less than this, whatever was measured)
+PollInterval=1.0     #float (seconds between attempts while measuring)
+PollTimeout=90.0     #float (give up measuring after this long)
+FirstPoll=5.0        #float (seconds after a suspend/resume before the first readiness check, for a pump which has not been calibrated)
+RestoreAttempts=3    #int (toggles Calibrate() makes at most to leave the pump suspended or running as it found it)
+
+class NotReady(IOError):
+#Poll() gave up. Attempts and Seconds say how hard it tried.
+
+    def __init__(self, message, attempts, seconds):
+        IOError.__init__(self, message)
+        self.Attempts = attempts
+        self.Seconds = seconds
+
+class Mismatch(IOError):
+#the pump is not suspended/running as it should be after a toggle
+    pass
+
+class TimingProfile(object):
+
+    def __init__(self, pump="default", file=TimingFile):
+        self.Pump = pump
+        self.File = file
+        try:
+            with open(file) as timingfile:
+                self.All = json.load(timingfile)
+        except:
+            self.All = {}
+        self.Profile = self.All.setdefault(pump, {"samples": {}, "widened": {}})
+        self.Profile.setdefault("observed", {})
+
+    def Samples(self, action):
+        return self.Profile["samples"].get(action, [])
+
+    def Record(self, action, seconds):
+        self.Profile["samples"][action] = (self.Samples(action) + [round(seconds, 2)])[-Samples:]
+        self.Profile["calibrated"] = clock.Strftime("%Y-%m-%dT%H:%M:%S")
+
+    def Widen(self, action):
+    #the pump was not ready after the profile's delay. doubles the margin for that action until the next calibration.
+
+        self.Profile["widened"][action] = self.Profile["widened"].get(action, 1) * 2
+        self.Save()
+
+    def Observe(self, action, attempts, seconds):
+    #keeps how many checks and how long the pump took to be ready after a real suspend/resume. not used for Settle().
+
+        self.Profile["observed"][action] = (self.Profile["observed"].get(action, []) + [[attempts, round(seconds, 2)]])[-Samples:]
+        self.Save()
+
+    def FirstPoll(self, action, default=FirstPoll):
+    #when to first check whether the pump is back: the quickest it has ever been, or default if never measured
+
+        samples = self.Samples(action)
+        if not samples:
+            return default
+        return max(1.0, min(samples))
+
+    def Settle(self, action, default):
+    #seconds to wait after the action before talking to the pump again
+
+        samples = self.Samples(action)
+        if not samples:
+            return default
+        widened = self.Profile["widened"].get(action, 1)
+        delay = max(samples) * MarginFactor + MarginSeconds * widened
+        return min(default, max(MinimumSettle, delay))
+
+    def Save(self):
+        temp = self.File + ".tmp"
+        with open(temp, "w") as timingfile:
+            json.dump(self.All, timingfile, indent=2, sort_keys=True)
+        os.rename(temp, self.File)
+
+def Poll(ready, interval=PollInterval, timeout=PollTimeout, first=0, backoff=1, maxinterval=None):
+#waits first seconds, then calls ready() until it returns without raising, waiting interval seconds between attempts.
+#the interval is multiplied by backoff after each attempt, up to maxinterval, and the last wait is cut short at the timeout.
+#returns (what ready() returned, attempts, seconds since the call). raises NotReady once timeout seconds have passed.
+
+    start = clock.Monotonic()
+    attempts = 0
+    clock.Sleep(first)
+    while True:
+        attempts += 1
+        try:
+            result = ready()
+        except Exception as e:
+            elapsed = clock.Monotonic() - start
+            if elapsed >= timeout:
+                raise NotReady("Pump not ready after %i attempts in %.1f seconds: %s" % (attempts, elapsed, e), attempts, elapsed)
+            clock.Sleep(min(interval, timeout - elapsed))
+            interval = interval * backoff
+            if maxinterval is not None:
+                interval = min(interval, maxinterval)
+        else:
+            return (result, attempts, clock.Monotonic() - start)
+
+def StateName(suspended):
+    return "suspended" if suspended else "running"
+
+def Restore(toggle, ready, suspended, wanted, log=None):
+#toggles until suspended() says wanted. raises Mismatch if it still does not after RestoreAttempts toggles.
+
+    for attempt in range(0, RestoreAttempts + 1):
+        state = Poll(suspended)[0]
+        if state == wanted:
+            return
+        if attempt == RestoreAttempts:
+            break
+        if log is not None:
+            log("Pump is %s, should be %s. Toggling it back." % (StateName(state), StateName(wanted)))
+        toggle()
+        Poll(ready)
+    raise Mismatch("Could not put the pump back: still %s after %i toggles." % (StateName(state), RestoreAttempts))
+
+def Calibrate(profile, toggle, ready, suspended, rounds=3, log=None):
+#measures how long the pump needs after a suspend and after a resume.
+#toggle() plays the suspend/resume sequence, ready() raises until the pump answers, suspended() returns its state.
+#raises Mismatch as soon as a toggle does not change the state. leaves the pump as it found it, or raises Mismatch
+#if it cannot. returns {action: [seconds, ...]}.
+
+    initial = suspended()
+    measured = {}
+    try:
+        for attempt in range(0, rounds):
+            for step in (0, 1):
+                before = suspended()
+                action = "resume" if before else "suspend"
+                toggle()
+                (result, attempts, seconds) = Poll(ready)
+                if suspended() == before:
+                    raise Mismatch("%s did not take: the pump is still %s." % (action, StateName(before)))
+                profile.Record(action, seconds)
+                measured.setdefault(action, []).append(seconds)
+                if log is not None:
+                    log("%s: pump answered after %.1f s." % (action, seconds))
+    finally:
+        Restore(toggle, ready, suspended, initial, log)
+    profile.Profile["widened"] = {}
+    profile.Save()
+    return measured
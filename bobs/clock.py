@@ -0,0 +1,96 @@
+#one clock for every sleep and timestamp in the control loop.
+#
+#the loop and the bobs modules call clock.Time(), clock.Sleep() and clock.Strftime() instead of the time module.
+#normally these are the real clock. a replay or an end-to-end test switches to a SimulatedClock with clock.Use(),
+#and then sleeping just moves simulated time forward: a whole day of loops, with WaitAWhile()'s 15 minute waits and the
+#15 second settle delays after a suspend, runs in seconds.
+
+import os
+import time
+
+def MonotonicSource():
+#clock_gettime(CLOCK_MONOTONIC) through ctypes: python 2 has no time.monotonic(). falls back to os.times(),
+#which is monotonic too but only counts in 10 ms steps - too coarse to time the remote's button presses.
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        library = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno=True)
+        gettime = library.clock_gettime
+        gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def Monotonic():
+            t = timespec()
+            if gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        Monotonic()
+        return Monotonic
+    except:
+        return lambda: os.times()[4]
+
+class RealClock(object):
+
+    MonotonicNow = staticmethod(MonotonicSource())
+
+    def Time(self):
+        return time.time()
+
+    def Sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def Monotonic(self):
+    #seconds from an arbitrary start which never jump when the system clock is set
+        return self.MonotonicNow()
+
+class SimulatedClock(object):
+
+    def __init__(self, start=None):
+        self.Now = float(time.time() if start is None else start)
+        self.Slept = 0.0      #total simulated seconds spent sleeping
+
+    def Time(self):
+        return self.Now
+
+    def Sleep(self, seconds):
+        if seconds > 0:
+            self.Now += seconds
+            self.Slept += seconds
+
+    def Monotonic(self):
+        return self.Now
+
+    def AdvanceTo(self, t):
+    #moves time forward to t. never moves it backwards.
+        self.Now = max(self.Now, float(t))
+
+Current=RealClock()
+
+def Use(clock):
+#switches every caller to the given clock. returns the previous one so it can be put back.
+
+    global Current
+    previous = Current
+    Current = clock
+    return previous
+
+def Time():
+    return Current.Time()
+
+def Sleep(seconds):
+    Current.Sleep(seconds)
+
+def Monotonic():
+    return Current.Monotonic()
+
+def Strftime(format, t=None):
+#like time.strftime, but "now" is the current clock's now
+
+    return time.strftime(format, time.localtime(Current.Time() if t is None else t))
@@ -0,0 +1,222 @@
+#structured decision log: one JSON record per AppendLog() line, written next to the text log as <name>.jsonl,
+#with a small sidecar index (<name>.jsonl.idx) of byte offsets by code and by day.
+#queries read the index and seek straight to the matching records instead of scanning the whole file.
+#
+#a record looks like:
+#  {"t": 1454187797.0, "day": "2016-01-30", "loop": 12, "code": 7000, "function": "CalculateBolus()",
+#   "text": "Information:", "message": "Gluc=156 TgtGluc=110 ...", "fields": {"Gluc": 156, "TgtGluc": 110, ...}}
+
+import os
+import re
+import glob
+import json
+import time
+from bobs import clock
+
+IndexSaveInterval=50   #int (records written between index saves, and on close. an fsync only syncs the records: LoadIndex() picks up any written after the last save.)
+
+FieldPattern=re.compile(r"([A-Za-z_][A-Za-z0-9_]*)=(\S+)")
+
+def ParseValue(text):
+#"156" -> 156, "1.30" -> 1.3, "True" -> True, anything else stays a string
+
+    text = text.rstrip(".,;")
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    if text in ("True", "False"):
+        return text == "True"
+    return text
+
+def ParseFields(message):
+#pulls the key=value pairs out of a free text log message, e.g. the CalculateBolus() 7000 line
+
+    fields = {}
+    for (key, value) in FieldPattern.findall(message or ""):
+        fields[key] = ParseValue(value)
+    return fields
+
+def MakeRecord(function, code, text, message, loop, now=None):
+    if now is None:
+        now = clock.Time()
+    try:
+        code = int(code)
+    except:
+        pass
+    return {"t": now,
+            "day": time.strftime("%Y-%m-%d", time.localtime(now)),
+            "loop": loop,
+            "code": code,
+            "function": function,
+            "text": text,
+            "message": message.strip() if message else "",
+            "fields": ParseFields(message)}
+
+def IndexFile(filename):
+    return filename + ".idx"
+
+def EmptyIndex():
+    return {"version": 1, "size": 0, "codes": {}, "days": {}}
+
+def AddToIndex(index, record, offset):
+    index["codes"].setdefault(str(record["code"]), []).append(offset)
+    index["days"].setdefault(record["day"], []).append(offset)
+
+def LoadIndex(filename):
+#returns the index for a .jsonl file, re-reading any records written after the index was last saved (e.g. after a power cut)
+
+    try:
+        with open(IndexFile(filename)) as indexfile:
+            index = json.load(indexfile)
+    except:
+        index = EmptyIndex()
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return EmptyIndex()
+    if index.get("size", 0) > size:
+        index = EmptyIndex()   #file was replaced. start over.
+
+    if index["size"] < size:
+        with open(filename, "rb") as logfile:
+            logfile.seek(index["size"])
+            while True:
+                offset = logfile.tell()
+                line = logfile.readline()
+                if not line.endswith(b"\n"):
+                    break      #half-written last line. leave it for next time.
+                try:
+                    AddToIndex(index, json.loads(line.decode("utf-8")), offset)
+                except ValueError:
+                    pass
+                index["size"] = logfile.tell()
+    return index
+
+def Truncate(filename, size):
+#cuts off a half-written last line (left by a crash), so that the records appended after it start where the index says
+
+    try:
+        if os.path.getsize(filename) > size:
+            with open(filename, "r+b") as logfile:
+                logfile.truncate(size)
+    except (IOError, OSError):
+        pass
+
+def SaveIndex(filename, index):
+#write-then-rename so a reader never sees half an index
+
+    temp = IndexFile(filename) + ".tmp"
+    with open(temp, "w") as indexfile:
+        json.dump(index, indexfile, separators=(",", ":"))
+    os.rename(temp, IndexFile(filename))
+
+class StructuredLog(object):
+
+    def __init__(self, filename):
+        self.FileName = filename
+        self.Index = LoadIndex(filename)
+        Truncate(filename, self.Index["size"])
+        self.File = open(filename, "ab")
+        self.Unsaved = 0
+
+    def Write(self, record):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        offset = self.Index["size"]
+        self.File.write(line)
+        AddToIndex(self.Index, record, offset)
+        self.Index["size"] = offset + len(line)
+        self.Unsaved += 1
+
+    def Flush(self, sync=False):
+    #the index is rewritten whole, so it is only saved every IndexSaveInterval records, not on every sync
+
+        self.File.flush()
+        if sync:
+            os.fsync(self.File.fileno())
+        if self.Unsaved >= IndexSaveInterval:
+            self.SaveIndex()
+
+    def SaveIndex(self):
+        SaveIndex(self.FileName, self.Index)
+        self.Unsaved = 0
+
+    def Close(self):
+        self.Flush(True)
+        self.SaveIndex()
+        self.File.close()
+
+def ReadAt(logfile, offsets):
+    for offset in offsets:
+        logfile.seek(offset)
+        yield json.loads(logfile.readline().decode("utf-8"))
+
+def Query(filename, code=None, day=None, since=None, until=None, loop=None, function=None):
+#returns the records of one .jsonl file matching all of the given filters.
+#code and day may be single values or lists. since/until are epoch seconds.
+
+    index = LoadIndex(filename)
+
+    offsets = None
+    if code is not None:
+        codes = code if isinstance(code, (list, tuple, set)) else [code]
+        offsets = set()
+        for c in codes:
+            offsets.update(index["codes"].get(str(c), []))
+    if day is not None:
+        days = day if isinstance(day, (list, tuple, set)) else [day]
+        dayoffsets = set()
+        for d in days:
+            dayoffsets.update(index["days"].get(d, []))
+        offsets = dayoffsets if offsets is None else offsets & dayoffsets
+    if offsets is None or since is not None or until is not None:
+        first = time.strftime("%Y-%m-%d", time.localtime(since)) if since is not None else ""
+        last = time.strftime("%Y-%m-%d", time.localtime(until)) if until is not None else "9999"
+        windowoffsets = set()
+        for (d, dayoffsets) in index["days"].items():
+            if first <= d <= last:      #whole days outside the window are skipped using the index alone
+                windowoffsets.update(dayoffsets)
+        offsets = windowoffsets if offsets is None else offsets & windowoffsets
+
+    results = []
+    with open(filename, "rb") as logfile:
+        for record in ReadAt(logfile, sorted(offsets)):
+            if since is not None and record["t"] < since:
+                continue
+            if until is not None and record["t"] >= until:
+                continue
+            if loop is not None and record["loop"] != loop:
+                continue
+            if function is not None and record["function"] != function:
+                continue
+            record["file"] = filename
+            results.append(record)
+    return results
+
+def QueryDir(logdir="./logs", **filters):
+#runs Query() over every structured log in the directory, oldest first.
+
+    results = []
+    for filename in sorted(glob.glob(os.path.join(logdir, "*.jsonl"))):
+        results.extend(Query(filename, **filters))
+    return results
+
+def WithInputs(records, code=7000, function="CalculateBolus()"):
+#pairs each record returned by Query()/QueryDir() (e.g. every 6002 bolus) with the records of the given code
+#logged by the same loop of the same run, e.g. the CalculateBolus() 7000 inputs behind it.
+#returns a list of (record, [related records]).
+
+    byfile = {}
+    for r in records:
+        byfile.setdefault(r["file"], []).append(r)
+
+    pairs = []
+    for filename in sorted(byfile):
+        related = {}
+        for r in Query(filename, code=code, function=function):
+            related.setdefault(r["loop"], []).append(r)
+        for r in byfile[filename]:
+            pairs.append((r, related.get(r["loop"], [])))
+    return pairs
@@ -0,0 +1,124 @@
+#the dosing decision of CalculateBolus(), as arithmetic on arrays.
+#
+#CalculateBolus() mixes the decision with the pump, the log, the loop state and module globals, so it can only make
+#one live decision at a time. the math is here instead, with no I/O and no globals: every input is a number or an
+#array (one value per decision point, broadcast against each other), and every output is an array. CalculateBolus()
+#calls it with single values, and an analysis of what the logic would have done at 100k recorded points is one call.
+#
+#the decision comes in two parts, the same as in CalculateBolus():
+# - Correction(): the gain scheduled correction factor, the prediction correction and the units needed.
+# - Decide(): what to do with them - the units to bolus, whether to suspend or resume the pump, and why (a code
+#   from error-codes.json).
+#Evaluate() runs both, with the sensor checks worked out from a window of readings.
+
+import numpy as np
+
+Hold=0               #intent: leave the pump as it is
+Suspend=1            #intent: suspend the pump
+Resume=2             #intent: resume the pump
+FallingRate=-2.0     #float (mg/dl per minute. a trend over the last 15 minutes falling faster than this holds a bolus, even when the newest reading is not lower than the one before)
+
+Settings={"UseGainScheduling": True,
+          "AggressionFactorBase": 1.3,
+          "AggressionFactorWidth": 275,
+          "UsePrediction": True,
+          "MealDetectReponseFactor": 1.0,
+          "LoopsPerHour": 12,
+          "ExerciseFactor": 1}
+
+def Correction(glucose, iob, target, sensitivity, dia, lg4p=0, lcf4p=0, lpc4p=0, settings=Settings):
+#returns a dict of arrays:
+# correction - glucose - target
+# aggression - the AggressionFactor (1 without gain scheduling)
+# adjusted   - the correction factor after aggression and exercise, always positive
+# prediction - the PredictionCorrection: positive if glucose is dropping too slowly (or rising) for the insulin on
+#              board, negative if it is dropping too quickly. 0 without prediction or without a previous loop.
+# needed     - correction + prediction, in mg/dl
+# unitsneeded - needed / adjusted
+# units      - unitsneeded - iob
+#lg4p, lcf4p and lpc4p are the prediction state left by the previous decision (see the loop state).
+#the state to keep for the next decision is (glucose, adjusted, prediction).
+
+    settings = dict(Settings, **settings)
+    (glucose, iob, target, sensitivity, dia, lg4p, lcf4p, lpc4p) = [np.asarray(x, dtype=float) for x in (glucose, iob, target, sensitivity, dia, lg4p, lcf4p, lpc4p)]
+
+    correction = glucose - target
+    width = float(settings["AggressionFactorWidth"])
+    if settings["UseGainScheduling"] and width != 0:
+        aggression = settings["AggressionFactorBase"] - correction / width
+    else:
+        aggression = np.ones_like(correction)
+    adjusted = np.abs(sensitivity * aggression * settings["ExerciseFactor"])
+
+    if settings["UsePrediction"]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            current = (glucose - (lg4p - (iob * lcf4p / (dia * settings["LoopsPerHour"])))) * settings["MealDetectReponseFactor"]
+        averaged = np.where((current > 0) & (lpc4p > 0), (current + lpc4p) / 2, current)   #after the initial upward "jolt" in glucose, pull up the following corrections
+        prediction = np.where((lg4p > 0) & (lcf4p > 0), averaged, 0.0)
+    else:
+        prediction = np.zeros_like(correction)
+
+    needed = correction + prediction
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unitsneeded = needed / adjusted
+    return {"correction": correction, "aggression": aggression, "adjusted": adjusted, "prediction": prediction,
+            "needed": needed, "unitsneeded": unitsneeded, "units": unitsneeded - iob}
+
+def Erratic(history):
+#true where the three newest readings change direction by more than 10 mg/dl - a sign of a faulty sensor.
+#history is (..., 3) newest first. a gap between the readings does not excuse them.
+
+    history = np.asarray(history, dtype=float)
+    (c, b, a) = (history[..., 0], history[..., 1], history[..., 2])
+    return (np.abs(c - b) > 10) & (((c < b) & (b > a)) | ((c > b) & (b < a)))
+
+def Descending(history, consecutive=True, rate=None, fallingrate=FallingRate):
+#true where a bolus should wait because glucose is, or may be, going down: the newest reading is lower than the one
+#before (however far apart they are), the readings are not consecutive (after a gap the trend in between is unknown),
+#or rate (mg/dl per minute over the last 15 minutes, None or nan if unknown) falls faster than fallingrate.
+#history is (..., 2+) newest first. the reading times only ever add to the plain comparison, never take away from it.
+
+    history = np.asarray(history, dtype=float)
+    with np.errstate(invalid="ignore"):
+        falling = np.asarray(np.nan if rate is None else rate, dtype=float) < fallingrate
+    return (history[..., 0] < history[..., 1]) | ~np.asarray(consecutive, dtype=bool) | falling
+
+def Decide(glucose, iob, target, maxiob, correction, suspended, erratic=False, descending=False, confirm=2):
+#returns (units, intent, reason) arrays. units is what goes to Bolus() (-1 for nothing), intent is Hold, Suspend or
+#Resume, reason is the code which explains the units. correction is what Correction() returned.
+#confirm is the answer to a bolus over maxiob: 1 = go ahead, 2 = reduce to maxiob, anything else = don't bolus.
+#reason 5001 (over maxiob, not confirmed) is given only when nothing else stops the bolus, so a caller which has to ask
+#someone can decide with confirm=0 first, and ask only when the reason is 5001.
+#the pump is suspended on the way down, and then the (negative) units are returned as they are. a resume is
+#followed by the rest of the checks.
+
+    (glucose, iob, target, maxiob, confirm) = [np.asarray(x, dtype=float) for x in (glucose, iob, target, maxiob, confirm)]
+    (suspended, erratic, descending) = [np.asarray(x, dtype=bool) for x in (suspended, erratic, descending)]
+    units = correction["units"]
+    shape = np.broadcast(glucose, iob, target, maxiob, units, suspended, erratic, descending, confirm).shape
+
+    unknown = glucose < 0
+    valid = ~unknown & ~erratic
+    suspend = valid & ~suspended & (((units <= -0.5) & (correction["prediction"] <= 0)) | (correction["correction"] <= 0))
+    resume = valid & suspended & (units >= 0)
+    checked = valid & ~suspend
+    under = checked & (glucose < target)
+    falling = checked & ~under & descending
+    treat = checked & ~under & ~falling
+    within = treat & (iob + units < maxiob)
+    over = treat & ~within
+
+    intent = np.select([suspend, resume], [Suspend, Resume], Hold) * np.ones(shape, dtype=int)
+    result = np.select([suspend, within, over & (confirm == 1), over & (confirm == 2)], [units, units, units, maxiob - iob], -1.0) * np.ones(shape)
+    reason = np.select([unknown, erratic, suspend, under, falling, within, over & (confirm == 1), over & (confirm == 2)],
+                       [5005, 5012, 6003, 5011, 5016, 6001, 6000, 5002], 5001) * np.ones(shape, dtype=int)
+    return (result, intent, reason)
+
+def Evaluate(glucose, iob, history, consecutive, suspended, target, sensitivity, maxiob, dia,
+             lg4p=0, lcf4p=0, lpc4p=0, settings=Settings, confirm=2, rate=None):
+#the whole decision for many points at once. history is (n, 3) newest first, consecutive says whether the three are
+#consecutive readings, rate is the 15 minute trend (see Descending()). returns (units, intent, reason, correction).
+
+    correction = Correction(glucose, iob, target, sensitivity, dia, lg4p, lcf4p, lpc4p, settings)
+    (units, intent, reason) = Decide(glucose, iob, target, maxiob, correction, suspended, Erratic(history), Descending(history, consecutive, rate), confirm)
+    return (units, intent, reason, correction)
@@ -0,0 +1,90 @@
+#multi-step glucose forecast.
+#
+#the prediction in CalculateBolus() looks one loop ahead: last glucose minus this loop's share of the IOB. here the
+#glucose is projected over a whole horizon (3 hours at 5 minute steps by default) from two effects, each computed
+#for all steps at once as array operations:
+# - insulin: the activity curve of every bolus still on board (bobs/iob.py), times the insulin sensitivity, summed
+#   over each step. activity is in units per minute, so this is the mg/dl the insulin will still take off.
+# - deviation: how far glucose has recently moved away from what the insulin alone explains (carbs, exercise, a bad
+#   site). it is assumed to carry on at its current rate and fade out linearly over DeviationDecay minutes, like
+#   oref0's carb impact.
+#the two are added to the current glucose and accumulated, one value per step.
+
+import numpy as np
+from bobs import clock
+
+Horizon=180          #int (minutes projected)
+Step=5               #int (minutes between forecast points)
+DeviationWindow=30   #int (minutes of readings the recent deviation is measured over)
+DeviationDecay=60    #int (minutes until the deviation has faded out)
+
+class GlucoseForecast(object):
+#the projected curve. Times are epoch seconds, the arrays have one value per step, starting one step after Start.
+
+    def __init__(self, start, glucose, times, insulin, deviation):
+        self.Start = start
+        self.Glucose0 = glucose
+        self.Times = times
+        self.Insulin = insulin          #cumulative mg/dl from insulin (negative)
+        self.Deviation = deviation      #cumulative mg/dl from the deviation
+        self.Glucose = glucose + insulin + deviation
+        self.Seconds = 0.0              #how long the computation took
+
+    def __len__(self):
+        return len(self.Times)
+
+    def Eventual(self):
+        return float(self.Glucose[-1]) if len(self) else float(self.Glucose0)
+
+    def Minimum(self):
+    #(lowest glucose, epoch time of it)
+
+        if not len(self):
+            return (float(self.Glucose0), self.Start)
+        i = int(np.argmin(self.Glucose))
+        return (float(self.Glucose[i]), float(self.Times[i]))
+
+    def At(self, minutes):
+    #the forecast minutes from the start, interpolated between steps
+
+        return float(np.interp(self.Start + minutes*60.0, np.concatenate(([self.Start], self.Times)), np.concatenate(([self.Glucose0], self.Glucose))))
+
+    def Curve(self):
+    #whole mg/dl values, the current glucose first, as Nightscout's predBGs want them
+
+        return [int(round(self.Glucose0))] + [int(round(g)) for g in np.clip(self.Glucose, 39, 400)]
+
+def Deviation(engine, ring, sensitivity, now, window=DeviationWindow):
+#mg/dl per minute which the readings of the last window minutes moved, beyond what the insulin explains.
+#0 if there are fewer than two readings.
+
+    (times, values) = ring.Since(now - window*60)
+    if len(times) < 2:
+        return 0.0
+    order = np.argsort(times)
+    (times, values) = (times[order], values[order])
+    observed = np.diff(values)
+    (iob, activity) = engine.Evaluate(times)
+    expected = -sensitivity * (activity[:-1] + activity[1:]) / 2.0 * np.diff(times) / 60.0
+    return float((observed - expected).sum() / ((times[-1] - times[0]) / 60.0))
+
+def Forecast(engine, glucose, sensitivity, now, deviation=0.0, horizon=Horizon, step=Step, decay=DeviationDecay):
+#projects glucose from now over horizon minutes. engine is an IOBEngine holding the recent boluses,
+#sensitivity is mg/dl per unit, deviation is mg/dl per minute (see Deviation()). now is given by the caller, and should
+#be the time the engine's IOB was last calculated for, so that the forecast starts from that IOB.
+
+    started = clock.Monotonic()
+    minutes = np.arange(step, horizon + step, step, dtype=float)
+    times = now + minutes*60.0
+
+    #activity at the middle of each step, times the step, is the insulin absorbed during that step
+    (iob, activity) = engine.Evaluate(times - step*30.0)
+    insulin = -np.cumsum(activity * step) * sensitivity
+
+    #the deviation fades linearly to nothing at decay minutes
+    fade = np.clip(1.0 - (minutes - step/2.0) / float(decay), 0.0, None)
+    drift = np.cumsum(deviation * fade * step)
+
+    forecast = GlucoseForecast(now, float(glucose), times, insulin, drift)
+    forecast.Seconds = clock.Monotonic() - started
+    return forecast
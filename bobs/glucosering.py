@@ -0,0 +1,141 @@
+#timestamped glucose history.
+#
+#GlucoseHistory used to be a deque of the last four values, with no times, lost on every restart. SensorSanityCheck()
+#and the "descending" check in CalculateBolus() could not tell readings 5 minutes apart from readings 40 minutes apart.
+#GlucoseRing keeps a day of readings as paired arrays - epoch seconds and mg/dl - in a small memory-mapped file, so
+#an append is two array writes and the history survives a restart. at startup it is topped up from
+#monitor/glucose_history.json (the pump's own CGM history, written by openaps).
+#
+#file layout: 16 byte header (magic, capacity, index of the next slot, count), then capacity float64 times, then
+#capacity float32 values. the slot is written before the header, so a crash in between only loses that reading.
+
+import os
+import json
+import time
+import numpy as np
+
+RingFile="./monitor/glucose_ring.bin"
+GlucoseHistoryFile="./monitor/glucose_history.json"
+Capacity=288         #int (readings kept. a day at one every 5 minutes.)
+MaxReadingGap=450    #int (seconds. readings further apart than this are not consecutive - at least one is missing.)
+Magic=0x31524742     #"BGR1"
+
+class GlucoseRing(object):
+
+    def __init__(self, file=RingFile, capacity=Capacity):
+        self.File = file
+        size = 16 + capacity*12
+        if os.path.exists(file) and os.path.getsize(file) == size:
+            self.Map = np.memmap(file, dtype=np.uint8, mode="r+", shape=(size,))
+        else:
+            self.Map = np.memmap(file, dtype=np.uint8, mode="w+", shape=(size,))
+        self.Header = self.Map[0:16].view(np.uint32)
+        self.Times = self.Map[16:16+capacity*8].view(np.float64)
+        self.Values = self.Map[16+capacity*8:size].view(np.float32)
+        if self.Header[0] != Magic or self.Header[1] != capacity:
+            self.Header[:] = (Magic, capacity, 0, 0)
+        self.Capacity = capacity
+
+    def __len__(self):
+        return int(self.Header[3])
+
+    def __getitem__(self, i):
+    #mg/dl of the i-th newest reading (0 is the newest). 0 if there is no such reading, like the old deque([0,0,0,0]).
+
+        if i >= len(self):
+            return 0
+        return int(round(self.Values[(int(self.Header[2]) - 1 - i) % self.Capacity]))
+
+    def Time(self, i=0):
+    #epoch seconds of the i-th newest reading, or None
+
+        if i >= len(self):
+            return None
+        return float(self.Times[(int(self.Header[2]) - 1 - i) % self.Capacity])
+
+    def Append(self, t, mgdl):
+    #adds a reading. readings which are not newer than the newest one are ignored. returns True if added.
+
+        newest = self.Time(0)
+        if newest is not None and t <= newest:
+            return False
+        slot = int(self.Header[2])
+        self.Times[slot] = t
+        self.Values[slot] = mgdl
+        self.Header[2] = (slot + 1) % self.Capacity
+        self.Header[3] = min(self.Capacity, int(self.Header[3]) + 1)
+        return True
+
+    def Latest(self, n=None):
+    #(times, values) arrays of the n newest readings (all of them by default), newest first
+
+        count = len(self) if n is None else min(n, len(self))
+        slots = (int(self.Header[2]) - 1 - np.arange(count)) % self.Capacity
+        return (self.Times[slots].copy(), self.Values[slots].astype(float))
+
+    def Since(self, t):
+    #(times, values) of the readings at or after t, newest first
+
+        (times, values) = self.Latest()
+        keep = times >= t
+        return (times[keep], values[keep])
+
+    def Gap(self, i=0):
+    #seconds between the i-th newest reading and the one before it, or None
+
+        if i + 1 >= len(self):
+            return None
+        return self.Time(i) - self.Time(i + 1)
+
+    def Consecutive(self, n, maxgap=MaxReadingGap):
+    #true if the n newest readings exist and none is missing in between
+
+        if len(self) < n:
+            return False
+        times = self.Latest(n)[0]
+        return bool(np.all(times[:-1] - times[1:] <= maxgap))
+
+    def Age(self, now):
+    #seconds since the newest reading, or None
+
+        newest = self.Time(0)
+        return None if newest is None else now - newest
+
+    def RateOfChange(self, window=900, now=None):
+    #mg/dl per minute over the readings of the last window seconds (least squares). None if fewer than two readings.
+
+        newest = self.Time(0)
+        if newest is None:
+            return None
+        (times, values) = self.Since((newest if now is None else now) - window)
+        if len(times) < 2:
+            return None
+        minutes = (times - times[0]) / 60.0
+        return float(np.polyfit(minutes, values, 1)[0])
+
+    def WarmLoad(self, file=GlucoseHistoryFile):
+    #adds the readings from an openaps glucose history file which are newer than what the ring holds. returns how many.
+
+        try:
+            with open(file) as historyfile:
+                records = json.load(historyfile)
+        except:
+            return 0
+        readings = []
+        for record in records:
+            if record.get("name") == "GlucoseSensorData" and "sgv" in record:
+                stamp = record["date"]
+                try:
+                    t = time.mktime((int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]), int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]), 0, 0, -1))
+                except (ValueError, TypeError):
+                    continue
+                readings.append((t, record["sgv"]))
+        added = 0
+        for (t, sgv) in sorted(readings):
+            if self.Append(t, sgv):
+                added += 1
+        self.Flush()
+        return added
+
+    def Flush(self):
+        self.Map.flush()
@@ -0,0 +1,127 @@
+#incremental pump history sync with a local append-only store.
+#
+#"openaps monitor-pump" downloads and rewrites the whole pump history every time it runs, which can be several
+#times per loop and keeps the radio busy. instead, the store remembers the newest record it holds and only asks
+#the pump for the hours since then ("use pump iter_pump_hours <n>", which stops paging once it reaches older
+#records). new records are deduplicated and appended to ./monitor/pump_history.jsonl, oldest first.
+#
+#IOB (bobs/iob.py), the Nightscout upload and analytics all read from the store. for the shell scripts and openaps
+#reports which still expect it, the recent part of the store is also written to monitor/pump_history.json in the
+#usual newest-first form.
+
+import os
+import json
+import math
+from bobs import clock
+from bobs.iob import ParseTimestamp
+
+StoreFile="./monitor/pump_history.jsonl"
+ExportFile="./monitor/pump_history.json"
+ExportHours=24       #int (hours of history written to ExportFile for the shell scripts)
+FirstSyncHours=24    #int (hours fetched when the store is empty)
+OverlapHours=1       #int (extra hour fetched on every sync. records the pump wrote late, or which share the newest timestamp, are still caught.)
+
+def RecordKey(record):
+    return (record.get("_type"), record.get("timestamp"), record.get("_head"), record.get("_date"))
+
+class HistoryStore(object):
+
+    def __init__(self, file=StoreFile, exportfile=ExportFile):
+        self.FileName = file
+        self.ExportFileName = exportfile
+        self.Records = []       #oldest first
+        self.Times = []         #epoch seconds for each record, same order
+        self.Keys = set()
+        self.Newest = None      #epoch seconds of the newest record, the high-water mark for the next sync
+        self.Load()
+
+    def Load(self):
+        try:
+            storefile = open(self.FileName)
+        except IOError:
+            return
+        with storefile:
+            for line in storefile:
+                try:
+                    self._Remember(json.loads(line))
+                except (ValueError, KeyError):
+                    pass    #half-written last line after a power cut. it will be fetched again.
+        order = sorted(range(len(self.Records)), key=lambda i: self.Times[i])
+        self.Records = [self.Records[i] for i in order]
+        self.Times = [self.Times[i] for i in order]
+
+    def _Remember(self, record):
+        epoch = ParseTimestamp(record["timestamp"])
+        self.Records.append(record)
+        self.Times.append(epoch)
+        self.Keys.add(RecordKey(record))
+        if self.Newest is None or epoch > self.Newest:
+            self.Newest = epoch
+
+    def HoursToFetch(self, now=None):
+        if self.Newest is None:
+            return FirstSyncHours
+        if now is None:
+            now = clock.Time()
+        return max(1, min(FirstSyncHours, int(math.ceil((now - self.Newest) / 3600.0)) + OverlapHours))
+
+    def Append(self, records):
+    #adds the records not already in the store. returns the new ones, oldest first.
+
+        new = []
+        seen = set()
+        for record in records:
+            key = RecordKey(record)
+            if "timestamp" not in record or key in self.Keys or key in seen:
+                continue
+            try:
+                ParseTimestamp(record["timestamp"])
+            except (ValueError, TypeError):
+                continue
+            new.append(record)
+            seen.add(key)
+        if not new:
+            return new
+
+        new.sort(key=lambda r: r["timestamp"])
+        with open(self.FileName, "a") as storefile:
+            for record in new:
+                storefile.write(json.dumps(record, separators=(",", ":")) + "\n")
+            storefile.flush()
+            os.fsync(storefile.fileno())
+        for record in new:
+            self._Remember(record)
+        if self.Times != sorted(self.Times):    #a late record landed before the newest one
+            order = sorted(range(len(self.Records)), key=lambda i: self.Times[i])
+            self.Records = [self.Records[i] for i in order]
+            self.Times = [self.Times[i] for i in order]
+        return new
+
+    def Since(self, since, until=None):
+    #records with since <= time < until, oldest first
+
+        return [r for (t, r) in zip(self.Times, self.Records) if t >= since and (until is None or t < until)]
+
+    def Recent(self, seconds, now=None):
+        if now is None:
+            now = clock.Time()
+        return self.Since(now - seconds)
+
+    def Export(self, hours=ExportHours, now=None):
+    #writes the recent history newest first, in the form monitor-pump leaves it
+
+        records = list(reversed(self.Recent(hours*3600, now)))
+        temp = self.ExportFileName + ".tmp"
+        with open(temp, "w") as exportfile:
+            json.dump(records, exportfile, indent=2)
+        os.rename(temp, self.ExportFileName)
+
+    def Sync(self, run, now=None):
+    #fetches only the history since the newest stored record. run is RunOpenaps or anything with the same signature.
+    #returns the new records, oldest first.
+
+        output = run("use", "pump", "iter_pump_hours", str(self.HoursToFetch(now)))
+        new = self.Append(json.loads(output))
+        if new or not os.path.exists(self.ExportFileName):
+            self.Export(now=now)
+        return new
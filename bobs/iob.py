@@ -0,0 +1,134 @@
+#in-process insulin on board (IOB) calculation, replacing "openaps get-iob" (node + oref0 calculate-iob) in the loop.
+#
+#uses the same bilinear activity curve and IOB polynomial as oref0/lib/iob/calculate.js, which only knows DIA=3
+#with the peak at 75 minutes. here the curve is stretched to the configured DIA: the peak is at 25*DIA minutes
+#and insulin is fully absorbed at 60*DIA minutes. with DIA=3 the IOB is the same as oref0's.
+#activity is not: oref0 multiplies it by the insulin sensitivity, giving mg/dl per minute. here it stays in units
+#per minute, and whoever needs the glucose effect (bobs/forecast.py) multiplies by the sensitivity itself.
+#
+#the engine keeps the boluses of the last DIA hours in NumPy arrays. new pump history records are added as they
+#arrive and old ones are dropped, so a loop never has to recompute the whole history. IOB and activity are
+#evaluated for any number of timestamps in one vectorized pass.
+
+import os
+import time
+import json
+import numpy as np
+from bobs import clock
+
+PumpHistoryFile="./monitor/pump_history.json"
+PumpClockFile="./monitor/clock.json"
+MaxClockAge=300      #int (seconds after which PumpClockFile is too old to say what time the pump thinks it is)
+
+def ParseTimestamp(timestamp):
+#"2016-01-30T21:03:17" (pump local time) -> epoch seconds
+
+    return time.mktime((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]), int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]), 0, 0, -1))
+
+def Curve(minago, amounts, dia):
+#returns (iob, activity) arrays for boluses of the given amounts given minago minutes ago.
+#minago and amounts must broadcast against each other. activity is in units per minute.
+
+    peak = 25.0 * dia
+    end = 60.0 * dia
+    scaled = minago * 3.0 / dia          #oref0 polynomial is written for a 180 minute curve
+
+    x1 = scaled / 5 + 1
+    x2 = (scaled - 75) / 5
+    risingiob = 1 - 0.001852*x1*x1 + 0.001852*x1
+    fallingiob = 0.001323*x2*x2 - 0.054233*x2 + 0.55556
+    risingact = (2 / end / peak) * minago
+    fallingact = 2 / end - (minago - peak) * 2 / end / (end - peak)
+
+    rising = (minago >= 0) & (minago < peak)
+    falling = (minago >= peak) & (minago < end)
+    iob = amounts * np.where(rising, risingiob, np.where(falling, fallingiob, 0.0))
+    activity = amounts * np.where(rising, risingact, np.where(falling, fallingact, 0.0))
+    return (iob, activity)
+
+def Boluses(history):
+#picks the boluses out of openaps pump history records. returns a list of (epoch, units, key)
+
+    boluses = []
+    for record in history:
+        if record.get("_type") == "Bolus":
+            try:
+                boluses.append((ParseTimestamp(record["timestamp"]), float(record["amount"]), (record["timestamp"], record.get("_date"))))
+            except (KeyError, ValueError, TypeError):
+                pass
+    return boluses
+
+def PumpClock(file=PumpClockFile, maxage=MaxClockAge):
+#the pump's own clock as written by monitor-pump, or the loop's clock if that is not available or was written more
+#than maxage seconds ago. a clock file left behind from an old run would otherwise make every bolus look long gone.
+
+    try:
+        if time.time() - os.path.getmtime(file) > maxage:
+            return clock.Time()
+        with open(file) as clockfile:
+            return ParseTimestamp(json.load(clockfile))
+    except:
+        return clock.Time()
+
+class IOBEngine(object):
+
+    def __init__(self, dia):
+        self.DIA = dia
+        self.Times = np.zeros(0)
+        self.Amounts = np.zeros(0)
+        self.Keys = set()
+        self.HistoryStamp = None
+
+    def SetDIA(self, dia):
+        self.DIA = dia
+
+    def Add(self, history):
+    #adds any boluses from the history records which the engine has not seen yet. returns how many were new.
+
+        new = [b for b in Boluses(history) if b[2] not in self.Keys]
+        if new:
+            self.Times = np.concatenate((self.Times, np.array([b[0] for b in new])))
+            self.Amounts = np.concatenate((self.Amounts, np.array([b[1] for b in new])))
+            self.Keys.update(b[2] for b in new)
+        return len(new)
+
+    def Prune(self, now):
+    #forgets boluses which have been fully absorbed by now
+
+        keep = self.Times > now - self.DIA*3600
+        if not keep.all():
+            self.Times = self.Times[keep]
+            self.Amounts = self.Amounts[keep]
+        #keys are kept so that a record which reappears in the next history download is not added again.
+        #they are small, and reset with the engine on restart.
+
+    def Refresh(self, file=PumpHistoryFile):
+    #re-reads the pump history file, but only when monitor-pump has rewritten it since the last call
+
+        st = os.stat(file)
+        stamp = (st.st_mtime, st.st_size)
+        if stamp == self.HistoryStamp:
+            return 0
+        with open(file) as historyfile:
+            added = self.Add(json.load(historyfile))
+        self.HistoryStamp = stamp
+        return added
+
+    def Evaluate(self, times):
+    #returns (iob, activity) arrays, one value per timestamp in times (epoch seconds).
+    #boluses later than a timestamp do not count towards it.
+
+        times = np.asarray(times, dtype=float)
+        minago = (times[..., np.newaxis] - self.Times) / 60.0
+        (iob, activity) = Curve(minago, self.Amounts, self.DIA)
+        return (iob.sum(axis=-1), activity.sum(axis=-1))
+
+    def Current(self, now=None):
+    #{"iob": units, "activity": units per minute}. "iob" is what "openaps get-iob" returns. "activity" is not
+    #oref0's, which is in mg/dl per minute (see the top of this file).
+
+        if now is None:
+            now = PumpClock()
+        self.Prune(now)
+        (iob, activity) = self.Evaluate([now])
+        return {"iob": float(iob[0]), "activity": float(activity[0])}
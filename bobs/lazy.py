@@ -0,0 +1,57 @@
+#objects which are only created when they are first used.
+#
+#importing the control loop (bobs/pancreas.py) used to set up the GPIO pins, open the log file and the loop state
+#and load the pump history on the spot, so nothing could import it without a Pi, and the replay had to load it with a
+#fake RPi.GPIO module slipped into sys.modules. a Lazy stands in for such an object under the same global name:
+#the first attribute, item or len() asks it to call its factory, and from then on everything goes to the real
+#object. Set() puts an object in place without calling the factory (the replay's fake remote, for instance).
+
+import threading
+
+Creating=threading.RLock()   #one factory at a time, so that two threads touching a Lazy first do not both create it
+
+class Lazy(object):
+
+    def __init__(self, factory, name=""):
+        object.__setattr__(self, "_Factory", factory)
+        object.__setattr__(self, "_Name", name)
+        object.__setattr__(self, "_Object", None)
+        object.__setattr__(self, "_Created", False)
+
+    def __getattr__(self, name):
+        return getattr(Get(self), name)
+
+    def __setattr__(self, name, value):
+        setattr(Get(self), name, value)
+
+    def __getitem__(self, key):
+        return Get(self)[key]
+
+    def __len__(self):
+        return len(Get(self))
+
+    def __repr__(self):
+        if object.__getattribute__(self, "_Created"):
+            return repr(object.__getattribute__(self, "_Object"))
+        return "<not yet created: %s>" % (object.__getattribute__(self, "_Name"))
+
+def Get(lazy):
+#the real object, created now if it has not been yet. anything which is not a Lazy is returned as it is.
+
+    if not isinstance(lazy, Lazy):
+        return lazy
+    if not object.__getattribute__(lazy, "_Created"):
+        with Creating:
+            if not object.__getattribute__(lazy, "_Created"):
+                Set(lazy, object.__getattribute__(lazy, "_Factory")())
+    return object.__getattribute__(lazy, "_Object")
+
+def Set(lazy, value):
+    object.__setattr__(lazy, "_Object", value)
+    object.__setattr__(lazy, "_Created", True)
+    return value
+
+def Created(lazy):
+#true if the object exists - used to tidy up only what was actually set up
+
+    return not isinstance(lazy, Lazy) or object.__getattribute__(lazy, "_Created")
@@ -0,0 +1,145 @@
+#buffered log writer for the APS log file.
+#the code table is loaded once, the log file stays open, and lines are written by a background thread so that
+#the control loop never waits on the SD card. only safety-critical lines are forced to disk with fsync,
+#and the caller waits for those to land before carrying on (e.g. before the remote is told to bolus).
+
+import os
+import sys
+import json
+import threading
+import Queue
+from bobs import clock
+from bobs.decisionlog import MakeRecord
+
+QueueSize=1000           #int (lines waiting to be written. when full, AppendLog() waits for the writer to catch up rather than dropping lines.)
+SyncCodes=(6002,6003,6004)   #bolus sent, suspending, resuming. all 5xxx error codes are synced as well.
+SyncTimeout=10           #int (seconds AppendLog() waits for a synced line. a writer which cannot write (full SD card) must not stop the loop.)
+
+def NeedsSync(code):
+#true for codes which must be on disk before the loop continues
+
+    try:
+        code=int(code)
+    except:
+        return True
+    return (5000 <= code < 6000) or code in SyncCodes
+
+def LoadCodeText(file):
+#returns the code -> text table from error-codes.json, or an empty table if it cannot be read
+
+    try:
+        with open(file) as codetextfile:
+            return json.load(codetextfile)
+    except:
+        print("Could not open error code file.")
+        return {}
+
+class LogWriter(object):
+
+    def __init__(self, filename, codefile, queuesize=QueueSize, structured=None, echo=None):
+    #structured is an optional bobs.decisionlog.StructuredLog which receives one JSON record per line.
+    #echo is where each line is shown as well (sys.stdout if not given, the screen session of the loop).
+
+        self.FileName = filename
+        self.Structured = structured
+        self.Loop = 0      #set by the main loop so records of the same pass can be grouped
+        self.CodeText = LoadCodeText(codefile)
+        self.File = open(filename, "a")
+        if not self.CodeText:
+            self.File.write("Could not open error code file\n")
+        self.Echo = sys.stdout if echo is None else echo
+        self.Queue = Queue.Queue(maxsize=queuesize)
+        self.Lock = threading.Lock()    #held while a line is queued, so that Close() cannot slip in between the check and the put
+        self.Closed = False
+        self.Thread = threading.Thread(target=self._Run, name="LogWriter")
+        self.Thread.daemon = True
+        self.Thread.start()
+
+    def Format(self, function, code, message=" "):
+        Now = clock.Strftime("%Y-%m-%d %H:%M:%S")
+        return Now + " " + str(code) + " " + function + " " + self.CodeText.get(str(code), "") + " " + message
+
+    def Append(self, function, code, message=" "):
+    #queues one log line. blocks until the line is fsynced if the code is safety-critical.
+
+        LogLine = self.Format(function, code, message)
+        self.Echo.write(LogLine + "\n")
+        self.Echo.flush()
+        record = None
+        if self.Structured is not None:
+            record = MakeRecord(function, code, self.CodeText.get(str(code), ""), message, self.Loop)
+
+        done = threading.Event() if NeedsSync(code) else None
+        with self.Lock:
+            if self.Closed:
+                return -1
+            self.Queue.put((LogLine, record, done))
+        if done is not None:
+            done.wait(SyncTimeout)
+        return 1
+
+    def Flush(self):
+    #waits until everything queued so far is written and fsynced
+
+        done = threading.Event()
+        with self.Lock:
+            if self.Closed:
+                return
+            self.Queue.put((None, None, done))
+        done.wait(SyncTimeout)
+
+    def Close(self):
+    #flushes and stops the writer. safe to call more than once.
+
+        self.Flush()
+        with self.Lock:
+            if self.Closed:
+                return
+            self.Closed = True
+            self.Queue.put(None)    #after every line queued before it
+        self.Thread.join(SyncTimeout)
+        self.File.close()
+        if self.Structured is not None:
+            self.Structured.Close()
+
+    def _Run(self):
+        while True:
+            batch = [self.Queue.get()]
+            try:
+                while True:
+                    batch.append(self.Queue.get_nowait())   #drain whatever else is waiting so several lines share one write
+            except Queue.Empty:
+                pass
+
+            stop = False
+            waiting = []
+            try:
+                for item in batch:
+                    if item is None:
+                        stop = True
+                        continue
+                    (LogLine, record, done) = item
+                    if done is not None:
+                        waiting.append(done)
+                    if LogLine is not None:
+                        self.File.write(LogLine + "\n")
+                    if record is not None:
+                        self.Structured.Write(record)
+
+                self.File.flush()
+                if waiting:
+                    os.fsync(self.File.fileno())
+                if self.Structured is not None:
+                    self.Structured.Flush(bool(waiting))
+            except:
+                self.Echo.write("Could not write to log file " + self.FileName + "\n")
+                for item in batch:    #the lines which were not written are lost, but nobody is left waiting for them
+                    if item is None:
+                        stop = True
+                    elif item[2] is not None and item[2] not in waiting:
+                        waiting.append(item[2])
+            finally:
+                for done in waiting:
+                    done.set()
+            if stop:
+                return
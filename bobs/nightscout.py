@@ -0,0 +1,527 @@
+#native Nightscout uploads and downloads.
+#
+#UpdateNightscout() used to probe a hard-coded address, recalculate IOB and fork /home/pi/update-nightscout.sh from the
+#control loop, and whatever happened while the connection was down was never uploaded. here the loop only appends
+#records to an on-disk outbox (one JSON line per record, per collection), and the Nightscout task drains the outbox in
+#batches over one kept-alive HTTP connection. a failed upload leaves the records where they are and backs off, so
+#nothing is lost and a bad mobile link never holds up dosing. an outbox which grows past OutboxMaxBytes (weeks without
+#a connection) is cut back to its newest records.
+#
+#the pump history is uploaded too, as update-nightscout.sh did through mm-format-ns-pump-history.sh: each record the
+#history sync brings in (bobs/history.py) is queued as a "medtronic" treatment (see PumpHistoryRecord()).
+#
+#downloads used to go through the oref0 ns-get.sh script, which fetched the whole of nsglucosehistory, nspumphistory
+#and nsprofile each time. Downloader asks only for records from the newest one it already has (the high-water mark)
+#on, merges them into the same files keyed by _id (or time and type), and asks for the profile with
+#If-None-Match/If-Modified-Since so an unchanged profile costs one empty 304 reply. the queries include their
+#boundaries ($gte/$lte): a record stamped the same second as the high-water mark, or as the last record of a page,
+#is fetched twice rather than missed, and the second copy is dropped by its key. a reply which is not a list of
+#records (or, for the profile, not a profile) is refused, and the local copies are left as they were.
+#
+#the host and secret are read from ./nightscout.ini:
+#  [nightscout]
+#  host = https://mysite.herokuapp.com
+#  api_secret = <the secret, or its SHA1>
+#not from NIGHTSCOUT_HOST and API_SECRET like the oref0 ns-* scripts: the loop runs under sudo, which resets the
+#environment. there is no default site: without a host in nightscout.ini nothing is uploaded or downloaded at all
+#(a Connection raises NotConfigured).
+
+import os
+import json
+import time
+import hashlib
+import httplib
+import urlparse
+import urllib
+import calendar
+import threading
+import ConfigParser
+from bobs import clock
+from bobs.iob import ParseTimestamp
+
+NightscoutIniFile="./nightscout.ini"
+OutboxDir="./nightscout/outbox"
+OutboxMaxBytes=4000000   #int (size at which an outbox file is cut back to its newest half. a few weeks of records.)
+Collections=("entries", "treatments", "devicestatus")
+BatchSize=100        #int (records per POST)
+RequestTimeout=10    #int (seconds)
+BackoffStart=30      #int (seconds to wait after the first failed upload. doubles with each failure in a row.)
+BackoffMax=900       #int (longest wait between attempts)
+DeviceName="bobs"
+DownloadDir="./nightscout"
+DownloadState="./nightscout/download.json"    #high-water marks and profile validators
+PageSize=500         #int (records per GET. more pages are fetched if there are more new records than this.)
+CacheSize=2000       #int (newest records kept per feed)
+Feeds={"entries": ("/api/v1/entries.json", "nsglucosehistory", "date"),        #feed: (API path, file in DownloadDir, query field)
+       "treatments": ("/api/v1/treatments.json", "nspumphistory", "created_at")}
+ProfilePath="/api/v1/profile/current.json"
+ProfileFile="nsprofile"
+
+class NotConfigured(IOError):
+#there is no Nightscout site to talk to: nightscout.ini is missing or names no host
+    pass
+
+def ReadConfig(file=NightscoutIniFile):
+#returns (host, secret) from the ini file. the host is None if the file is missing or names none, the secret "" if
+#it has none.
+
+    config = ConfigParser.RawConfigParser()
+    config.read(file)
+    host = None
+    secret = ""
+    if config.has_option("nightscout", "host"):
+        host = config.get("nightscout", "host").strip() or None
+    if config.has_option("nightscout", "api_secret"):
+        secret = config.get("nightscout", "api_secret").strip()
+    return (host, secret)
+
+def HashSecret(secret):
+#Nightscout wants the SHA1 of the API secret. a secret which already looks like one is used as it is.
+
+    if len(secret) == 40 and all(c in "0123456789abcdef" for c in secret.lower()):
+        return secret.lower()
+    return hashlib.sha1(secret).hexdigest()
+
+def ISOTime(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + "Z"
+
+def ParseISOTime(text):
+#"2016-01-30T19:13:00+0100", "2016-01-30T18:13:00.000Z" or "2016-01-30T19:13+01:00" -> epoch seconds
+
+    text = text.strip()
+    offset = 0
+    if text.endswith("Z"):
+        text = text[:-1]
+    elif len(text) > 16 and text[-5] in "+-" and text[-3] != ":":
+        offset = (int(text[-4:-2])*3600 + int(text[-2:])*60) * (1 if text[-5] == "+" else -1)
+        text = text[:-5]
+    elif len(text) > 16 and text[-6] in "+-":
+        offset = (int(text[-5:-3])*3600 + int(text[-2:])*60) * (1 if text[-6] == "+" else -1)
+        text = text[:-6]
+    text = text.split(".")[0]
+    if len(text) == 16:
+        text += ":00"
+    return calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%S")) - offset
+
+def RecordTime(record):
+#epoch seconds of a Nightscout record, whichever way it says it. None if it does not.
+
+    try:
+        if isinstance(record.get("date"), (int, long, float)):
+            return record["date"] / 1000.0
+        for field in ("created_at", "dateString"):
+            if field in record:
+                return ParseISOTime(record[field])
+    except (ValueError, TypeError):
+        pass
+    return None
+
+def RecordKey(record):
+    if "_id" in record:
+        return record["_id"]
+    return (RecordTime(record), record.get("type"), record.get("eventType"), record.get("_type"), record.get("name"))
+
+def ParseRecords(body, what):
+#a feed reply as a list of records. raises IOError for anything else (an error page, a proxy's login page, a site
+#which is not Nightscout), so that it never replaces a local copy.
+
+    try:
+        records = json.loads(body)
+    except ValueError:
+        raise IOError("Nightscout sent something which is not JSON for %s." % (what))
+    if not isinstance(records, list) or not all(isinstance(r, dict) and RecordTime(r) is not None for r in records):
+        raise IOError("Nightscout sent something which is not a list of records for %s." % (what))
+    return records
+
+def Entry(sgv, t):
+#a CGM reading, as an entries record. t is epoch seconds.
+
+    return {"type": "sgv", "sgv": int(sgv), "date": int(t*1000), "dateString": ISOTime(t), "device": DeviceName}
+
+def Treatment(eventtype, t, **fields):
+#a careportal treatment, e.g. Treatment("Correction Bolus", t, insulin=0.5)
+
+    record = {"eventType": eventtype, "created_at": ISOTime(t), "enteredBy": DeviceName}
+    record.update(fields)
+    return record
+
+def PumpHistoryRecord(record):
+#a pump history record (bobs/history.py) as a treatment, the way mm-format-ns-pump-history.sh formats it
+
+    t = ParseTimestamp(record["timestamp"])
+    treatment = dict(record)
+    treatment.update({"medtronic": record.get("_type"), "type": "medtronic", "dateString": ISOTime(t), "created_at": ISOTime(t), "enteredBy": DeviceName})
+    treatment.setdefault("date", int(t*1000))
+    return treatment
+
+def DeviceStatus(t, iob=None, reservoir=None, suspended=None, uptime=None, predicted=None):
+#predicted is a list of mg/dl at 5 minute steps, starting now (see forecast.GlucoseForecast.Curve())
+
+    record = {"device": DeviceName, "created_at": ISOTime(t)}
+    if iob is not None:
+        record["openaps"] = {"iob": {"iob": iob, "timestamp": ISOTime(t)}}
+    if predicted:
+        record.setdefault("openaps", {})["suggested"] = {"bg": predicted[0], "eventualBG": predicted[-1], "predBGs": {"IOB": predicted}, "timestamp": ISOTime(t)}
+    pump = {"clock": ISOTime(t)}
+    if reservoir is not None:
+        pump["reservoir"] = reservoir
+    if suspended is not None:
+        pump["status"] = {"suspended": suspended}
+    record["pump"] = pump
+    if uptime is not None:
+        record["uploader"] = {"uptime": uptime.strip()}
+    return record
+
+class Connection(object):
+#one kept-alive HTTP(S) connection to the Nightscout site. reconnects once if the kept-alive socket has gone stale.
+
+    def __init__(self, host=None, secret=None, timeout=RequestTimeout):
+    #host and secret default to what nightscout.ini says. raises NotConfigured if there is no host either way.
+
+        if host is None or secret is None:
+            (inihost, inisecret) = ReadConfig()
+            host = inihost if host is None else host
+            secret = inisecret if secret is None else secret
+        if not host:
+            raise NotConfigured("No Nightscout host in %s." % (NightscoutIniFile))
+        if "://" not in host:
+            host = "https://" + host
+        url = urlparse.urlparse(host)
+        self.Scheme = url.scheme
+        self.NetLoc = url.netloc
+        self.Base = url.path.rstrip("/")
+        self.Secret = HashSecret(secret) if secret else None
+        self.Timeout = timeout
+        self.HTTP = None
+        self.Requests = 0
+
+    def Open(self):
+        if self.Scheme == "https":
+            self.HTTP = httplib.HTTPSConnection(self.NetLoc, timeout=self.Timeout)
+        else:
+            self.HTTP = httplib.HTTPConnection(self.NetLoc, timeout=self.Timeout)
+
+    def Close(self):
+        if self.HTTP is not None:
+            self.HTTP.close()
+            self.HTTP = None
+
+    def Request(self, method, path, body=None, headers=None):
+    #returns (status, response headers as a lower-case dict, body text). raises IOError when the site cannot be reached.
+
+        sendheaders = {"Accept": "application/json"}
+        if self.Secret:
+            sendheaders["API-SECRET"] = self.Secret
+        if body is not None:
+            body = json.dumps(body)
+            sendheaders["Content-Type"] = "application/json"
+        sendheaders.update(headers or {})
+
+        for attempt in (1, 2):
+            if self.HTTP is None:
+                self.Open()
+            try:
+                self.HTTP.request(method, self.Base + path, body, sendheaders)
+                response = self.HTTP.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, IOError) as e:
+                self.Close()
+                if attempt == 2:
+                    raise IOError("Nightscout %s %s failed: %s" % (method, path, e))
+            else:
+                self.Requests += 1
+                if response.getheader("connection", "").lower() == "close":
+                    self.Close()
+                return (response.status, dict(response.getheaders()), data)
+
+class Outbox(object):
+#records waiting to be uploaded, one file of JSON lines per collection. how far each file has been uploaded is kept in
+#sent.json as a byte offset, so a batch is read from there rather than from the top of the file, and a file is emptied
+#once all of it has gone. the loop writes and the task reads, so both take the lock.
+
+    def __init__(self, directory=OutboxDir, collections=Collections, maxbytes=OutboxMaxBytes):
+        self.Dir = directory
+        self.Collections = collections
+        self.MaxBytes = maxbytes
+        self.SentFile = os.path.join(directory, "sent.json")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            with open(self.SentFile) as sentfile:
+                self.Sent = json.load(sentfile)
+        except:
+            self.Sent = {}
+        self.Dropped = 0     #records cut from a full outbox without being uploaded
+        self.Lock = threading.Lock()
+
+    def File(self, collection):
+        return os.path.join(self.Dir, collection + ".jsonl")
+
+    def SaveSent(self):
+        temp = self.SentFile + ".tmp"
+        with open(temp, "w") as sentfile:
+            json.dump(self.Sent, sentfile)
+        os.rename(temp, self.SentFile)
+
+    def Put(self, collection, *records):
+    #never touches the network. safe to call from the loop. returns the number of old records dropped to make room.
+
+        with self.Lock:
+            with open(self.File(collection), "a") as outfile:
+                for record in records:
+                    outfile.write(json.dumps(record, sort_keys=True) + "\n")
+                size = outfile.tell()
+            if size > self.MaxBytes:
+                return self.Trim(collection)
+        return 0
+
+    def Trim(self, collection):
+    #cuts the records not yet uploaded back to the newest MaxBytes/2. call with the lock held. returns how many went.
+
+        with open(self.File(collection)) as outfile:
+            outfile.seek(self.Sent.get(collection, 0))
+            lines = outfile.readlines()
+        keep = len(lines)
+        size = 0
+        while keep > 0 and size + len(lines[keep-1]) <= self.MaxBytes // 2:
+            keep -= 1
+            size += len(lines[keep])
+        temp = self.File(collection) + ".tmp"
+        with open(temp, "w") as outfile:
+            outfile.writelines(lines[keep:])
+        self.Sent[collection] = 0
+        self.SaveSent()    #before the rename. a crash in between re-uploads the kept records rather than skipping them.
+        os.rename(temp, self.File(collection))
+        self.Dropped += keep
+        return keep
+
+    def Read(self, collection, count):
+    #(the next count lines not yet uploaded, the offset after them). call with the lock held.
+
+        offset = self.Sent.get(collection, 0)
+        lines = []
+        try:
+            with open(self.File(collection)) as outfile:
+                outfile.seek(offset)
+                while len(lines) < count:
+                    line = outfile.readline()
+                    if not line.endswith("\n"):
+                        break    #the end, or a line cut short by a crash which the next Put() will complete
+                    lines.append(line)
+                    offset += len(line)
+        except IOError:
+            pass
+        return (lines, offset)
+
+    def Peek(self, collection, count=BatchSize):
+    #the next count records not yet uploaded
+
+        with self.Lock:
+            (lines, offset) = self.Read(collection, count)
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)    #line mangled by a crash. counted, so that Ack() skips it.
+        return records
+
+    def Pending(self, collection):
+    #number of records not yet uploaded
+
+        with self.Lock:
+            return len(self.Read(collection, float("inf"))[0])
+
+    def Ack(self, collection, count):
+    #marks the next count records as uploaded
+
+        with self.Lock:
+            (lines, offset) = self.Read(collection, count)
+            try:
+                empty = offset >= os.path.getsize(self.File(collection))
+            except OSError:
+                empty = True
+            self.Sent[collection] = 0 if empty else offset
+            self.SaveSent()
+            if empty:    #only after sent.json says 0. a crash in between re-uploads a batch rather than losing the next ones.
+                open(self.File(collection), "w").close()
+
+class Uploader(object):
+#drains the outbox. meant to run on the Nightscout task, never on the loop.
+
+    def __init__(self, outbox=None, connection=None, batchsize=BatchSize):
+        self.Outbox = outbox if outbox is not None else Outbox()
+        self.Connection = connection if connection is not None else Connection()
+        self.BatchSize = batchsize
+        self.Failures = 0
+        self.NextAttempt = 0
+        self.Uploaded = 0
+        self.LastError = None
+
+    def Waiting(self, now=None):
+    #true while backing off after a failure
+
+        return (clock.Time() if now is None else now) < self.NextAttempt
+
+    def Drain(self, now=None):
+    #uploads everything in the outbox, batch by batch. returns the number of records uploaded, or -1 if an upload
+    #failed (the rest stays in the outbox and the next attempt is pushed back). does nothing while backing off.
+
+        now = clock.Time() if now is None else now
+        if now < self.NextAttempt:
+            return 0
+        uploaded = 0
+        try:
+            for collection in self.Outbox.Collections:
+                while True:
+                    batch = self.Outbox.Peek(collection, self.BatchSize)
+                    if not batch:
+                        break
+                    records = [r for r in batch if r is not None]
+                    if records:
+                        (status, headers, body) = self.Connection.Request("POST", "/api/v1/%s.json" % collection, records)
+                        if not 200 <= status < 300:
+                            raise IOError("Nightscout returned %s for %s: %s" % (status, collection, body[:200]))
+                    self.Outbox.Ack(collection, len(batch))
+                    uploaded += len(records)
+        except IOError as e:
+            self.Failures += 1
+            self.NextAttempt = now + min(BackoffMax, BackoffStart * 2**(self.Failures-1))
+            self.LastError = str(e)
+            self.Uploaded += uploaded
+            return -1
+        self.Failures = 0
+        self.NextAttempt = 0
+        self.Uploaded += uploaded
+        return uploaded
+
+class Downloader(object):
+#keeps local copies of the Nightscout feeds and profile up to date with as little transfer as possible.
+#meant to run on a background task, with its own Connection (httplib connections are not shared between threads).
+
+    def __init__(self, connection=None, directory=DownloadDir, statefile=DownloadState, feeds=Feeds):
+        self.Connection = connection if connection is not None else Connection()
+        self.Dir = directory
+        self.StateFile = statefile
+        self.Feeds = feeds
+        self.Transferred = 0    #bytes of response bodies received
+        try:
+            with open(statefile) as state:
+                self.State = json.load(state)
+        except:
+            self.State = {}
+
+    def Load(self, file):
+        try:
+            with open(os.path.join(self.Dir, file)) as cachefile:
+                return json.load(cachefile)
+        except:
+            return None
+
+    def Save(self, file, data):
+        path = os.path.join(self.Dir, file)
+        with open(path + ".tmp", "w") as cachefile:
+            json.dump(data, cachefile, indent=2)
+        os.rename(path + ".tmp", path)
+
+    def SaveState(self):
+        with open(self.StateFile + ".tmp", "w") as state:
+            json.dump(self.State, state)
+        os.rename(self.StateFile + ".tmp", self.StateFile)
+
+    def Get(self, path, query=None, headers=None):
+        if query:
+            path = path + "?" + urllib.urlencode(sorted(query.items()))
+        (status, responseheaders, body) = self.Connection.Request("GET", path, headers=headers)
+        self.Transferred += len(body)
+        if status != 304 and not 200 <= status < 300:
+            raise IOError("Nightscout returned %s for %s." % (status, path))
+        return (status, responseheaders, body)
+
+    def Refresh(self, feed):
+    #fetches the records of one feed from the high-water mark on and merges the ones not seen yet into its file.
+    #returns the number of new records.
+
+        (path, file, field) = self.Feeds[feed]
+        records = self.Load(file) or []
+        highwater = self.State.get(feed)
+        if highwater is None and records:
+            highwater = max(RecordTime(r) for r in records)
+
+        fetched = []
+        before = None
+        while True:
+            query = {"count": PageSize}
+            if highwater is not None:
+                query["find[%s][$gte]" % field] = self.QueryValue(field, highwater)
+            if before is not None:
+                query["find[%s][$lte]" % field] = self.QueryValue(field, before)
+            page = ParseRecords(self.Get(path, query)[2], path)
+            fetched.extend(page)
+            times = [RecordTime(r) for r in page if RecordTime(r) is not None]
+            if len(page) < PageSize or not times or min(times) == before:
+                break      #the last page, or a whole page stamped the same second which paging cannot get past
+            before = min(times)    #Nightscout sends the newest first. page back towards the high-water mark.
+
+        known = set(RecordKey(r) for r in records)
+        new = []
+        for record in fetched:
+            key = RecordKey(record)
+            if key not in known:
+                known.add(key)
+                new.append(record)
+        if new:
+            records = sorted(records + new, key=lambda r: RecordTime(r) or 0, reverse=True)[:CacheSize]
+            self.Save(file, records)
+        times = [RecordTime(r) for r in records if RecordTime(r) is not None]
+        if times:
+            self.State[feed] = max(times)
+            self.SaveState()
+        return len(new)
+
+    def QueryValue(self, field, t):
+    #entries are queried by "date" in milliseconds, treatments by their ISO created_at string
+
+        if field == "date":
+            return "%d" % (t * 1000)
+        return ISOTime(t)
+
+    def RefreshProfile(self):
+    #fetches the profile only if it has changed. returns True if it had.
+
+        validators = self.State.get("profile", {})
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+        if self.Load(ProfileFile) is None:
+            headers = {}    #nothing cached to fall back on
+        (status, responseheaders, body) = self.Get(ProfilePath, headers=headers)
+        if status == 304:
+            return False
+        try:
+            profile = json.loads(body)
+        except ValueError:
+            profile = None
+        if not isinstance(profile, dict):
+            raise IOError("Nightscout sent something which is not a profile for %s." % (ProfilePath))
+        changed = profile != self.Load(ProfileFile)
+        if changed:
+            self.Save(ProfileFile, profile)
+        self.State["profile"] = {"etag": responseheaders.get("etag"), "modified": responseheaders.get("last-modified")}
+        self.SaveState()
+        return changed
+
+    def RefreshAll(self):
+    #returns {feed: new records, "profile": changed}
+
+        result = dict((feed, self.Refresh(feed)) for feed in sorted(self.Feeds))
+        result["profile"] = self.RefreshProfile()
+        return result
+
+if __name__ == "__main__":
+    #python -m bobs.nightscout: refresh the downloads once, e.g. from cron instead of ns-get.sh
+    downloader = Downloader()
+    print(downloader.RefreshAll())
+    print("%i bytes transferred." % downloader.Transferred)
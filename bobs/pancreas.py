@@ -0,0 +1,1495 @@
+#andrewaps - a bolus-based APS using the OpenAPS toolset
+
+#attempts to maintain stable blood glucose level in a T1D by delivering
+#multiple small boluses via the standard Medtronic remote control, using the Easy Bolus function on the pump.
+#does not take into account nor modify the basal rate
+
+#establishes a maximum IOB which can only be exceeded with express agreement of the user
+#in the absence of consent from the user, high glucose is managed by keeping IOB at the set maximum
+#(via repeated delta bolus) until the glucose approaches normal
+
+#by design, the insulin pump remains the lead system, and in the absence of communication from the APS,
+#continues to operate normally.
+#risks relating to over bolusing (hardware or software failure) or under bolusing (lack of communication)
+#are mitigated respectively by Easy Bolus audible notifications, and by CGM alarms + Pump Suspend audible notifications & reminders - all of which are features of the pump
+
+#TO DO:
+#  - Notify user on persistent communication error
+#  - Leave unused ports off all the time
+#  - Make Predict time-aware
+#  - Nightscout updated even for skipped loops (15 minute wait)
+#  - Begin work on message bus
+#  - Doesn't suspend for low glucose when no significant change in glucose value
+#  - Prediction populated from JSON on first run
+
+import os
+import sys
+import urllib2
+import subprocess
+import time
+import json
+import atexit
+from bobs import clock
+from bobs.logger import LogWriter
+from bobs.decisionlog import StructuredLog
+from bobs import pumpworker
+from bobs import iob
+from bobs import history
+from bobs.pumpstate import PumpSnapshot
+from bobs.scheduler import SensorPhase
+from bobs.tasks import SerialQueue, TaskGroup
+from bobs import nightscout
+from bobs import remote
+from bobs import calibration
+from bobs.glucosering import GlucoseRing
+from bobs import statefile
+from bobs.statefile import LoopState
+from bobs import schedules
+from bobs import forecast
+from bobs import dosing
+from bobs import warmstart
+from bobs import lazy
+from bobs import watchdog
+from bobs import usbpower
+
+#GPIO. RPi.GPIO is only imported, and the pins set up, the first time the remote is used (see SetupGPIO()),
+#so that this module can be imported on a machine without a Pi.
+RemoteAct=11     #GPIO physical pin 11, connected to remote "Act" button
+RemoteBolus=13   #GPIO physical pin 13, connected to remote "Bolus" button
+RemoteSuspend=15 #GPIO physical pin 15, connected to remote "Suspend" button
+GPIO=lazy.Lazy(lambda: SetupGPIO(), "RPi.GPIO")   #module (RPi.GPIO, imported and set up by SetupGPIO() on first use. see bobs/lazy.py)
+Remote=remote.Player(GPIO)   #plays the button sequences against monotonic deadlines on its own thread. see bobs/remote.py
+
+#set some global variables. most of these will be populated with real data in the main loop at bottom of the program
+#all are set to initially to safe values.
+MaxIOB=0.0           #float (gets populated later from max_iob.json)
+IOB=0.0              #float (gets populated later from pump data)
+DIA=0                #int (gets populated later from profile.json) (number of hours insulin remains active.)
+TargetGlucose=140    #int (mg/dl for compatibility with OpenAPS toolset) (gets re-populated later from pump settings. for now set at a generic reasonably safe level.)
+Glucose=0            #int (mg/dl for compatibility with OpenAPS toolset) (gets populated later from pump data)
+GlucoseHistory=lazy.Lazy(GlucoseRing, "GlucoseRing")    #GlucoseRing (loaded on first use. mg/dl for compatibility with OpenAPS toolset, with the time of each reading) (kept in ./monitor/glucose_ring.bin between runs, topped up from pump data. GlucoseHistory[0] is the newest. see bobs/glucosering.py)
+GlucoseHistoryFile="./monitor/glucose_history.json"    #written by openaps from the pump's CGM history
+CorrectionFactor=0   #int (this many mg/dl are reduced by 1 unit of insulin) (gets populated later from pump settings - this is the P in a PID controller.)
+Reservoir=300.0      #float  (gets populated later from pump data)
+LogF="x"             #str (gets populated later by the InitLog() function, when the first line is logged)
+ErrorCodeFile="./error-codes.json"
+CorrectionFactorFile="./settings/insulin_sensitivities.json"
+TargetGlucoseFile="./settings/bg_targets.json"    #the "high" glucose target from the pump settings is used as the target in this implementation
+BasalProfileFile="./settings/basal_profile.json"
+CarbRatioFile="./settings/carb_ratios.json"
+MaxIOBFile="./max_iob.json"
+ProfileFile="./settings/profile.json"
+PumpSettings=schedules.SettingsIndex()   #SettingsIndex (the settings files above as time-of-day schedules, parsed again when a file changes. see bobs/schedules.py)
+UseSettingsReload=True   #bln (when true, CorrectionFactor, TargetGlucose, DIA and MaxIOB are looked up again at the start of every loop, for the time of day and from the current files. otherwise they are read once at startup.)
+GlucosePredictFile="./predict.json"     #no longer written. read once to carry the prediction state over to StateFile
+PumpHistoryFile="./monitor/pump_history.json"   #written by "openaps monitor-pump"
+LoopSuccessFile="./loopsuccess.txt"     #no longer written. read once to carry the last success time over to StateFile
+StateFile="./state.bin"    #prediction state, last success, last actuation and the newest readings, in one crash-safe file. see bobs/statefile.py
+State=lazy.Lazy(lambda: OpenState(), "LoopState")  #LoopState (loaded from StateFile by OpenState() on first use. changes are written once per loop by SaveState(), and before each remote sequence by RecordActuation())
+ActuationHold=900    #int (seconds. a bolus started by the previous run this recently may have been cut short by a crash and not be in the pump history or the IOB yet: no bolus until this long after it. see CheckLastActuation())
+BolusHoldUntil=0.0   #float (epoch time before which Bolus() does not bolus. set by CheckLastActuation())
+WaitingThreshold=25  #int (mg/dl for compatibility with OpenAPS toolset)
+                     #the loop runs every 15 minutes, giving each treatment time to start working between each loop. However two conditions trigger the loop to run every 5 minutes instead of 15:
+                     #1- if the glucose changes more than 5 mg/dl since the last loop
+                     #2- if current glucose is higher than (TargetGlucose + WaitingThreshold)
+APSBatteryLow=False  #bln (will be triggered by GPIO when battery gets low)
+ExerciseFactor=1     #int (will be increased when user reports he/she is exercising. this reduces the aggressiveness of the algorithm & therefore reduces insulin during exercise)
+KeepAlive=False      #bln (when true, the USB ports are not shut down between loops)
+UseRemoteTiming=True #bln (when true, the waits after a suspend/resume come from the pump's measured timing profile instead of a flat 15 seconds. measure with "python bobs-pancreas.py --calibrate". see bobs/calibration.py)
+RemoteTiming=None    #TimingProfile (gets populated later by LoadRemoteTiming())
+ReadyDeadline=60     #int (seconds after a suspend/resume to keep checking whether the pump is back in the new state)
+ReadyInterval=1.0    #float (seconds between the first checks. doubles after each one...)
+ReadyMaxInterval=8.0 #float (...up to this)
+QuietMode=False      #bln (when true, the commands from the remote control are slowed down to take into account the time needed for the vibration motor on the pump.)
+UseWarmStart=True    #bln (when true, a restart soon after a successful loop skips Preflight() and, unless the pump history shows a settings change, the settings download. see bobs/warmstart.py)
+WarmStartFile="./warmstart.json"
+WarmStartMaxAge=900  #int (seconds. a start later than this after the last successful loop is always cold)
+WarmSnapshot=lazy.Lazy(lambda: warmstart.Snapshot(WarmStartFile), "Snapshot")   #Snapshot (read on first use. pump model, settings fingerprint and time of the last settings download, saved by SaveWarmStart())
+StickTimeout=60      #int (seconds a warm start waits for the CareLink stick to show up on USB)
+PumpModel=None       #str (gets populated later by Preflight(), or from WarmSnapshot)
+StartedAt=0.0        #float (when Main() started, to log how long startup took)
+UsePumpWorker=True   #bln (when true, pump commands go through one long-lived worker process which keeps the pump session open, instead of a new openaps process per command. see bobs/pumpworker.py)
+PumpWorker=None      #PumpClient (gets populated later by StartPumpWorker())
+PumpWorkerProcess=None   #Popen (the worker process, gets populated later by StartPumpWorker())
+UseWatchdog=True     #bln (when true, a watchdog thread follows the heartbeats of the loop stages and recovers a stuck or failing loop one step at a time - pump worker, USB power, process restart - rebooting only as a last resort. see bobs/watchdog.py)
+Watchdog=None        #Watchdog (gets populated later by StartWatchdog())
+Arguments=[]         #list (the command line, to start again with. gets populated later by Main())
+UseNativeIOB=True    #bln (when true, IOB is calculated in-process from the pump history (any DIA) instead of running "openaps get-iob". see bobs/iob.py)
+IOBModel=iob.IOBEngine(3)   #IOBEngine (keeps the boluses of the last DIA hours between loops. DIA gets populated later from profile.json)
+IOBTime=None         #float (epoch time IOBModel last calculated the IOB for. the forecast is made for the same moment.)
+UseHistorySync=True  #bln (when true, only new pump history is downloaded and kept in ./monitor/pump_history.jsonl, instead of "openaps monitor-pump" fetching it all each time. see bobs/history.py)
+PumpHistory=lazy.Lazy(history.HistoryStore, "HistoryStore")   #HistoryStore (local copy of the pump history, loaded from disk on first use)
+Snapshot=PumpSnapshot()   #PumpSnapshot (pump status, reservoir, IOB and history sync for the current loop. see bobs/pumpstate.py)
+UseStructuredLog=False  #bln (when true, every log line is also written as a JSON record to ./logs/<timestamp>-APSlog.jsonl, with an index by code and day. see bobs/decisionlog.py for queries.)
+UsePrediction=True   #bln (EXPERIMENTAL - initial testing shows leads to hypos if factor is too high. when true, the algorithm will check actual results against predictions to detect meals or exercise & react. this is the D in a PID controller.)
+MealDetectReponseFactor=1.0  #float (goes with UsePrediction. a number which can be changed to tune the algorithm's response to a meal. higher = more aggressive. this factor dampens glucose change speed in both directions, up and down. it is the D in a PID controller.)
+LoopFrequency=300    #int (How many seconds between loops - used to calculate predicted change
+LoopWaitTime=240     #int (roughly equivalent to LoopFrequency minus the time it takes for the loop to run. this is the actual time the loop will wait between runs.)
+LoopsPerHour=3600/LoopFrequency
+USBWakeTime=10       #int (seconds allowed for USB and the Carelink stick to come back after waking up. a wake now waits for the stick itself, and this is only the first guess and the wait when the stick cannot be seen)
+Power=usbpower.PowerManager(lambda command: HubCtrl(command), lambda: warmstart.StickPresent(), USBWakeTime)   #PowerManager (the one owner of the USB and Ethernet power state. measures how long a wake takes and what sleeping saves. see bobs/usbpower.py)
+PowerReportInterval=3600 #int (seconds between logs of the USB power figures)
+UseSensorSchedule=True  #bln (when true, WaitAWhile() learns when the CGM readings arrive and polls just after the next one is due, instead of sleeping a fixed LoopWaitTime)
+SensorSchedule=SensorPhase()   #SensorPhase (learns the 5 minute phase of the CGM readings from the timestamps GetGlucose() sees)
+SensorRetries=3      #int (how many more times to ask for a reading which is late)
+SensorRetryDelay=20  #int (seconds between those attempts)
+LastReadingTime=None #float (epoch time of the newest reading GetGlucose() has seen)
+UseBackgroundTasks=True  #bln (when true, pump I/O is serialised through PumpQueue, and uptime, Nightscout, UI and log flushing run on their own threads so they never hold up a dosing decision. see bobs/tasks.py)
+PumpQueue=SerialQueue()  #SerialQueue (every pump command and remote sequence, one at a time)
+Tasks=TaskGroup(onerror=lambda name, e: AppendLog("Tasks", 7000, "Task %s failed: %s" % (name, e)))   #TaskGroup (the side jobs of the loop. populated after the functions below are defined)
+UptimeInterval=60    #int (seconds between uptime samples)
+UIInterval=10        #int (seconds between UI refreshes)
+LogFlushInterval=30  #int (seconds between forced log flushes)
+Uptime=" "           #str (latest output of "uptime", logged at the start of each loop)
+UseNightscoutOutbox=True #bln (when true, readings, boluses and device status are queued in ./nightscout/outbox and uploaded in batches by the Nightscout task, instead of running /home/pi/update-nightscout.sh. host and secret come from ./nightscout.ini. see bobs/nightscout.py)
+Nightscout=None      #Uploader (gets populated later by QueueNightscout())
+NightscoutHost=None  #str (the host named in ./nightscout.ini, "" if none. read once by NightscoutConfigured(). without one nothing goes to Nightscout.)
+NightscoutInterval=60    #int (seconds between upload attempts, on top of the ones kicked by the loop. failed uploads back off on their own.)
+QueuedReadingTime=None   #float (time of the last reading queued for Nightscout)
+UseNightscoutDownload=True   #bln (when true, a background task keeps ./nightscout/nsglucosehistory, nspumphistory and nsprofile up to date, fetching only what is new. replaces the ns-get.sh downloads. the task is only started if ./nightscout.ini names a host.)
+NightscoutDownloader=None    #Downloader (gets populated later by DownloadNightscout())
+NightscoutDownloadInterval=900   #int (seconds between downloads)
+UseForecast=True     #bln (when true, CalculateBolus() also projects glucose over the next ForecastHorizon minutes from the insulin on board and the recent deviation. logged, sent to Nightscout and the UI - it does not change the dose. see bobs/forecast.py)
+ForecastHorizon=180  #int (minutes)
+ForecastStep=5       #int (minutes between forecast points)
+Prediction=None      #GlucoseForecast (the latest forecast, gets populated later by ForecastGlucose())
+ContinueLooping=True #bln (yep. keep that up until I say False.)
+
+#Next: Gain Scheduling  *** DANGER ZONE ***
+#considering that the correction factor (amount of insulin needed to reduce by (x) mg/dl) is not linear, and that a higher proportion of insulin is needed at higher glucose values,
+#the algorithm applies an AggressionFactor multiplier to the CorrectionFactor to tweak how aggressive it is: The higher the glucose, the more aggressive the algorithm.
+#these factors create a curve similar to an exponential curve.
+
+UseGainScheduling=True  #set this to False if you want a linear aggression. linear aggression is SAFER because it is simpler and easier to understand. if setting this to False, you can then ignore the next two values.
+
+AggressionFactorBase=1.3  #increase this number by increments of 0.1 (testing along the way) if the algorithm has a tendency to overshoot and push glucose level too far below the target glucose (e.g. hypo happens even if pump has been suspended for a while).
+AggressionFactorWidth=275 #decrease this number by increments of 25 (testing along the way) if it takes too long to come down from a high glucose. Doing so will increase the aggressiveness at high glucose values.
+#these two numbers are linked together, so each time you change one, you **must** change the other or you will get unexpected and potentially dangerous results. they require some patience to tweak.
+#the relationship is: AggressionFactor = AggressionFactorBase - ((Glucose-TargetGlucose)/AggressionFactorWidth)
+#see CalculateBolus() for the full AggressionFactor calculation.
+#the AggressionFactor only has an effect when (Glucose - TargetGlucose) > 0.
+
+def CalculateBolus(glucose):
+#v4 done, untested
+#the math is in bobs/dosing.py (Correction() and Decide()). this function feeds it the globals, the loop state and the pump status, logs the result and carries out the suspend/resume.
+
+    if glucose < 0:                        #glucose == -1 means that the glucose data is older that 4m59s
+       AppendLog("CalculateBolus()",5005)
+       return -1
+
+    if UsePrediction:
+        lg4p = int(State.Get("lg4p"))     #"last glucose, for prediction"
+        lcf4p = State.Get("lcf4p")        #"last correction factor, for prediction"
+        lpc4p = State.Get("lpc4p")        #"last PredictionCorrection, for prediction"
+    else:
+        (lg4p, lcf4p, lpc4p) = (0, 0, 0)
+    c = dosing.Correction(glucose, IOB, TargetGlucose, CorrectionFactor, DIA, lg4p, lcf4p, lpc4p, DosingSettings())
+    floatUnits = float(c["units"])
+    PredictionCorrection = float(c["prediction"])
+    AdjustedCorrectionFactor = float(c["adjusted"])
+
+    Logdata="Gluc=%i TgtGluc=%i PredictCorr=%f NeededCorr=%i CorrFactor=%i ExerFactor=%i AggrFactor=%f AdjCorrFactor=%f Needed=%f IOB=%f Units=%f MaxIOB=%f" % (glucose,TargetGlucose,PredictionCorrection,c["needed"],CorrectionFactor,ExerciseFactor,c["aggression"],AdjustedCorrectionFactor,c["unitsneeded"],IOB,floatUnits,MaxIOB)
+    if UsePrediction:
+        Logdata += " lg4p=%s lcf4p=%s lpc4p=%s DIA=%s LoopsPerHour=%s MealDetectReponseF=%s." % (lg4p,lcf4p,lpc4p,DIA,LoopsPerHour,MealDetectReponseFactor)
+    AppendLog("CalculateBolus()", 7000, Logdata)
+
+    ForecastGlucose(glucose, IOBTime)
+
+    #now store current predict-relevant data for next time this function runs. written to disk with the rest of the loop state by SaveState().
+    if UsePrediction:
+        State.Update(lg4p=glucose, lcf4p=AdjustedCorrectionFactor, lpc4p=PredictionCorrection)
+
+    #now all the calculation has been done. we'll need all that for the logs & later loops. but before we proceed, let's do a sanity check on the sensor data. 
+    #if there has been a sudden/significant change in glucose direction, let's wait one loop for confirmation before reacting. sudden changes in direction are one of the signs of a potentially faulty sensor.
+    if not SensorSanityCheck(): 
+        return -1
+      
+    #time to start treatment. first deal with whether or not the pump is, or should be, suspended.
+    try: 
+        p = GetStatus()         #returns: 0 - status(str), 1 - bolusing(bln), 2 -suspended(bln)
+    except:
+        AppendLog("CalculateBolus()", 5080)
+        return -1
+    else:
+        PumpSuspended = p[2]
+
+    AppendLog("CalculateBolus()", 7000, "PumpSuspended is " + str(PumpSuspended))
+
+    consecutive = GlucoseHistory.Consecutive(3)    #the readings SensorSanityCheck() judged. after a gap, wait for more before a bolus.
+    descending = dosing.Descending([GlucoseHistory[0], GlucoseHistory[1]], consecutive, GlucoseHistory.RateOfChange())
+    (units, intent, reason) = dosing.Decide(glucose, IOB, TargetGlucose, MaxIOB, c, PumpSuspended, False, descending, 0)
+    if int(reason) == 5001:    #a bolus over MaxIOB, and nothing else stops it: only now is the user asked, and the answer decides
+        Proceed = ConfirmBolus(floatUnits, IOB)
+        (units, intent, reason) = dosing.Decide(glucose, IOB, TargetGlucose, MaxIOB, c, PumpSuspended, False, descending, Proceed)
+    (units, intent, reason) = (float(units), int(intent), int(reason))
+
+    if intent == dosing.Suspend:   #if we're on our way down or already under, and the pump is not suspended...
+	    #the use of -0.5 is to prevent the pump being suspended (which includes basal) when IOB is reasonably close to my usual basal insulin requirement.
+        #PredictionCorrection is being used here as an indicator whether the glucose is going up or down.
+        AppendLog("CalculateBolus()",6003, "Negative bolus of %s units requested." % (floatUnits))
+        try:
+            SuspendPump(True)
+        except:
+            AppendLog("CalculateBolus()", 5008)
+        return units                   #exit function now. negative bolus will trigger no action from Bolus()
+
+    elif intent == dosing.Resume:
+        #activate pump
+        AppendLog("CalculateBolus()",6004, "Bolus of %s units is requested." % (floatUnits))   #pump status is correct
+        try:
+            SuspendPump(False)
+        except:
+            AppendLog("CalculateBolus()", 5008)
+		
+    else:
+        AppendLog("CalculateBolus()",6006)   #pump status is already correct
+
+    if reason == 5011:   #also, don't bolus if under the target glucose level.
+        AppendLog("CalculateBolus()",5011)
+        return -1
+
+    if reason == 5016:    #while we're at it, don't bolus anything if glucose is descending, or may be: after a gap, or on a falling trend.
+        AppendLog("CalculateBolus()",5016, "%s followed by %s, %.1f mg/dl per minute over 15 minutes%s." % (GlucoseHistory[1], GlucoseHistory[0], GlucoseHistory.RateOfChange() or 0, "" if consecutive else ", readings not consecutive"))
+        return -1
+    
+    #now deal with the bolus.
+    #negative bolus situation is already dealt with above in the suspend pump section.
+    #first check it will not exceed MaxIOB. If yes, the user has been asked for confirmation above.
+    if reason == 6001:
+        AppendLog("CalculateBolus()",6010)
+    else:
+        AppendLog("CalculateBolus()",6011)
+        if reason == 6000:
+            AppendLog("CalculateBolus()", 6000)
+        elif reason == 5002:
+            AppendLog("CalculateBolus()", 5002, "Proposed bolus reduced to %s units." % (units))
+        else:
+            AppendLog("CalculateBolus()", 5001, "%s units" % (floatUnits))
+
+    #alright, if all is still well, return the calculated outcome and exit.
+    if reason in (6001, 6000, 5002):
+        AppendLog("CalculateBolus()", 6001)
+        return units
+    else:
+        AppendLog("CalculateBolus()", 5007)
+        return -1
+
+def DosingSettings():
+#v1 done, untested
+#the tuning globals which bobs/dosing.py needs, read at each decision so that changes (and the replay's overrides) count
+
+    return {"UseGainScheduling": UseGainScheduling, "AggressionFactorBase": AggressionFactorBase, "AggressionFactorWidth": AggressionFactorWidth,
+            "UsePrediction": UsePrediction, "MealDetectReponseFactor": MealDetectReponseFactor, "LoopsPerHour": LoopsPerHour, "ExerciseFactor": ExerciseFactor}
+
+def ForecastGlucose(glucose, now=None):
+#v2 done, untested
+#projects glucose over ForecastHorizon minutes from the boluses in IOBModel and the deviation of the recent readings. returns the GlucoseForecast, or None.
+#now is the time the IOB was calculated for (IOBTime), so that both come from the same clock. the loop's clock if not given.
+
+    global Prediction
+    if not UseForecast:
+        return None
+    if now is None:
+        now = clock.Time()
+    try:
+        deviation = forecast.Deviation(IOBModel, GlucoseHistory, CorrectionFactor, now)
+        Prediction = forecast.Forecast(IOBModel, glucose, CorrectionFactor, now, deviation, ForecastHorizon, ForecastStep)
+    except:
+        AppendLog("ForecastGlucose()", 7000, "Could not calculate the forecast.")
+        Prediction = None
+        return None
+    (lowest, when) = Prediction.Minimum()
+    AppendLog("ForecastGlucose()", 7000, "Deviation=%.2f mg/dl/min Eventual=%i Lowest=%i at %s In1h=%i (%.1f ms)." % (deviation, Prediction.Eventual(), lowest, clock.Strftime("%H:%M", when), Prediction.At(60), Prediction.Seconds*1000))
+    return Prediction
+
+def RemoteTimings():
+#v1 done, untested
+
+    if QuietMode:
+        return remote.QuietTimings
+    return remote.NormalTimings
+
+def Bolus(units): 
+#v2 done, untested
+
+    if units >= 0 and clock.Time() < BolusHoldUntil:    #see CheckLastActuation()
+        AppendLog("Bolus()", 5018, "%s units requested. Held until %s." % (units, clock.Strftime("%H:%M:%S", BolusHoldUntil)))
+        return -1
+
+    if units >= 0:
+        try:
+            p = GetStatus()         #returns: 0 - status(str), 1 - bolusing(bln), 2 -suspended(bln)
+        except:
+            AppendLog("Bolus()", 5080)
+            return -1
+        else:
+	        PumpBolusing = p[1]
+
+        if PumpBolusing:
+            AppendLog("Bolus()",5004)
+            return -1
+        else:
+            AppendLog("Bolus()",5009)
+
+        try:
+            tempval = GetReservoir()
+        except:
+            AppendLog("Bolus()", 5081)
+            Reservoir = 300
+        else:
+		    Reservoir = tempval
+			
+        if units > Reservoir:
+            AppendLog("Bolus()", 5003, "Reservoir contains %s units." % (Reservoir))
+            return -1
+        else:
+            roundedUnits = float(str(round(units,1)))    #dirty hack (which works though!) to deal with the fact that round() only affects the displayed number, not the actual number
+            AppendLog("Bolus()", 7000, "%s units rounded to %s units" % (units, roundedUnits))
+
+            if roundedUnits>0:
+                AppendLog("Bolus()", 6002, "Sending %s units." % (roundedUnits))
+	
+                #initiate comms, count up bolus in Easy Bolus, execute, wait while Easy Bolus counts up the dose for confirmation, confirm
+                ticks=int(roundedUnits*10)       #Easy Bolus configured on the pump to count up in tenths of a unit
+                RecordActuation("bolus", roundedUnits)    #on disk before the first button press
+                report=Remote.Play(remote.BolusWaveform(RemoteAct, RemoteBolus, ticks, RemoteTimings()))
+                AppendLog("Bolus()", 7000, "Remote sequence " + report.Summary())
+
+                Snapshot.Invalidate()    #status, reservoir and IOB have all changed
+                QueueNightscout("treatments", nightscout.Treatment("Correction Bolus", clock.Time(), insulin=roundedUnits))
+               
+                return 1
+
+            else:
+                AppendLog("Bolus()",5007, "%s units requested." % (roundedUnits))
+                return -1              
+    else:
+        AppendLog("Bolus()",5007, "%s units requested." % (units))
+        return -1
+
+def SensorSanityCheck():
+#v4 done, untested
+#a sudden change of direction fails the check, with or without a gap between the readings. readings which are not
+#consecutive pass it, but CalculateBolus() then holds any bolus until they are (see dosing.Descending()).
+
+    a = GlucoseHistory[2]
+    b = GlucoseHistory[1]
+    c = GlucoseHistory[0]
+
+    if dosing.Erratic([c, b, a]):    #see bobs/dosing.py
+        AppendLog("SensorSanityCheck()", 5012, "Erratic data: %s followed by %s followed by %s." % (a,b,c))
+        return False
+    elif not GlucoseHistory.Consecutive(3):
+        AppendLog("SensorSanityCheck()", 6016, "Readings not consecutive: %s followed by %s followed by %s. No bolus until they are." % (a,b,c))
+        return True
+    else:
+        AppendLog("SensorSanityCheck()", 6016, "Consistent data: %s followed by %s followed by %s." % (a,b,c))
+        return True
+        
+def GetIOB():
+#v3 done, untested
+#IOB is calculated once per loop (or after a bolus/suspend) and then served from the loop snapshot.
+
+    return Snapshot.Get("iob", ReadIOB)
+
+def SyncPumpHistory():
+#v1 done, untested
+#brings the local pump history store up to date (bobs/history.py) and queues the new records for Nightscout. returns them.
+
+    NewRecords = PumpHistory.Sync(RunOpenaps)
+    if NewRecords:
+        QueueNightscout("treatments", *[nightscout.PumpHistoryRecord(r) for r in NewRecords])
+    return NewRecords
+
+def ReadIOB():
+#v4 done, untested
+#with UseHistorySync only the pump history since the last sync is downloaded, into the local store (bobs/history.py).
+#with UseNativeIOB the IOB is calculated in-process by bobs/iob.py instead of by "openaps get-iob" (node), at the loop's
+#time (not a clock file which may be stale), which is kept in IOBTime for the forecast.
+
+    global IOBTime
+
+    try:
+        if UseHistorySync:
+            NewRecords=Snapshot.Get("history", SyncPumpHistory)
+            AppendLog("GetIOB()", 7000, "%i new pump history records." % (len(NewRecords)))
+        else:
+            output=RunOpenaps("monitor-pump")
+            print output
+    except:
+        AppendLog("GetIOB()", 5000, "Could not retrieve current pump data.")
+        raise IOError("Could not retrieve current pump data.")
+	
+    if UseNativeIOB:
+        try:
+            IOBModel.SetDIA(DIA)
+            if UseHistorySync:
+                IOBModel.Add(PumpHistory.Recent(DIA*3600))
+            else:
+                IOBModel.Refresh(PumpHistoryFile)
+            now = clock.Time()
+            IOBdata = IOBModel.Current(now)
+            IOBTime = now
+        except:
+            AppendLog("GetIOB()", 5051)
+            raise IOError("Could not calculate IOB.")
+        else:
+            return IOBdata["iob"]
+
+    try:
+        output=RunOpenaps("get-iob")   #get-iob is an alias for "use iob shell monitor/pump_history.json settings/profile.json monitor/clock.json"
+        IOBdata = json.loads(output)
+    except:
+        AppendLog("GetIOB()", 5051)
+        raise IOError("Could not calculate IOB.")
+    else:
+        return IOBdata["iob"]
+
+def PrepIOB():
+#v1 done, tested
+
+    try:
+        output=RunOpenaps("get-settings")
+        print output
+    except:
+        AppendLog("PrepIOB()", 5000, "Could not get pump settings.")
+        raise IOError("Could not get pump settings.")
+		
+def GetMaxIOB():
+#v2 done, untested
+#read again only when max_iob.json changes
+
+    try:
+        return PumpSettings.Value(MaxIOBFile, schedules.MaxIOB)
+    except:
+        AppendLog("GetMaxIOB()", 5050)
+        raise IOError("Could not get Max IOB.")
+        
+def GetDIA():
+#v2 done, untested
+#read again only when profile.json changes
+
+    try:
+        return PumpSettings.Value(ProfileFile, schedules.DIA)
+    except:
+        AppendLog("GetDIA()", 5052)
+        raise IOError("Could not get DIA from profile.json.")
+        
+def ConfirmBolus(units, IOB):
+#v1 in progress
+
+    #get user confirmation
+    return 2  # 0= do nothing, 1= go ahead full amount, 2= reduce to Max_IOB (default)
+
+def GetGlucose():
+#v1 done, tested
+#also records the time of the reading in LastReadingTime, and teaches it to the sensor schedule.
+
+    global LastReadingTime, QueuedReadingTime
+
+    try:
+        txtglucose=RunOpenaps("most-recent-reading")   #most-recent-reading is an alias for "use pump iter_glucose 5"
+        glucosedata = json.loads(txtglucose)
+    except:
+        #failed to communicate: 
+        AppendLog("GetGlucose()", 5000)
+        raise IOError("Could not communicate with the pump")
+    else:
+        try:
+            for stanza in range(0,6):
+                if glucosedata[stanza]["name"] == "GlucoseSensorData":
+                    lastreadingtime = glucosedata[stanza]["date"]
+                    currentglucose = glucosedata[stanza]["sgv"]
+                    break
+        except:
+            AppendLog("GetGlucose", 5061, "Could not find the date or value of most recent reading in the output.")
+            raise IOError("Could not find the date or value of the most recent reading in the output.")
+        else:
+            lastreadingtuple = (int(lastreadingtime[0:4]), int(lastreadingtime[5:7]), int(lastreadingtime[8:10]), int(lastreadingtime[11:13]), int(lastreadingtime[14:16]), int(lastreadingtime[17:19]), 0, 0, -1)
+            LastReadingTime = time.mktime(lastreadingtuple)
+            SensorSchedule.Observe(LastReadingTime)
+            GlucoseHistory.Append(LastReadingTime, currentglucose)
+            if LastReadingTime != QueuedReadingTime:
+                QueueNightscout("entries", nightscout.Entry(currentglucose, LastReadingTime))
+                QueuedReadingTime = LastReadingTime
+            if clock.Time() - LastReadingTime > 299:      #if last reading is older than 4 minutes 59 seconds
+                AppendLog("GetGlucose()", 5060)
+                return -1
+                
+        return currentglucose
+
+def GetReservoir():
+#v2 done, untested
+
+    try:
+        return Snapshot.Get("reservoir", ReadReservoir)
+    except:
+        AppendLog("GetReservoir()", 5000)
+        return 300
+
+def ReadReservoir():
+#v1 done, tested
+
+    output=RunOpenaps("get-reservoir")   #get-reservoir is an alias for "use pump reservoir"
+    return json.loads(output)
+
+def GetCorrectionFactor(file):
+#v2 done, untested
+#the insulin sensitivity in force now, from the pump's schedule (used to be the first entry, whatever the time of day)
+
+    try:
+        return PumpSettings.Value(file, schedules.Sensitivities)
+    except:
+        AppendLog("GetCorrectionFactor()", 5070)
+        raise IOError("Could not get correction factor.")
+
+def GetBasalRate(file):
+#v1 done, untested
+#the basal rate in force now, in units per hour
+
+    try:
+        return PumpSettings.Value(file, schedules.BasalRates)
+    except:
+        AppendLog("GetBasalRate()", 5072)
+        raise IOError("Could not get basal rate.")
+
+def GetCarbRatio(file):
+#v1 done, untested
+#the carb ratio in force now, in grams per unit
+
+    try:
+        return PumpSettings.Value(file, schedules.CarbRatios)
+    except:
+        AppendLog("GetCarbRatio()", 5073)
+        raise IOError("Could not get carb ratio.")
+
+def SetLoopSuccess():
+#v2 done, untested
+#written to disk with the rest of the loop state by SaveState(). if that doesn't work, the successful loop will not be recorded and eventually the system will restart. not a big deal....
+
+    State.Update(lastsuccess=clock.Time())
+    if Watchdog is not None:
+        Watchdog.Success()
+
+def SaveState():
+#v1 done, untested
+#the one write of the loop state per loop
+
+    (times, values) = GlucoseHistory.Latest(statefile.HistoryLength)
+    padding = [0] * (statefile.HistoryLength - len(times))
+    State.Update(loop=Log.Loop, historytimes=list(times) + padding, historyvalues=list(values) + padding)
+    try:
+        State.Commit()
+    except:
+        AppendLog("SaveState()", 5017)
+        return -1
+    return 1
+
+def RestoreHistory():
+#v1 done, untested
+#puts the readings kept in the loop state back into GlucoseHistory, in case its own file was lost. returns how many were missing.
+
+    added = 0
+    for (t, mgdl) in sorted(zip(State.Get("historytimes"), State.Get("historyvalues"))):
+        if t > 0 and GlucoseHistory.Append(t, mgdl):
+            added += 1
+    return added
+
+def RecordActuation(action, units=0.0):
+#v2 done, untested
+#called before the remote sequence starts, and written to disk at once, so that the record survives a crash in the
+#middle of it. read back at the next start by CheckLastActuation().
+
+    State.Update(actiontime=clock.Time(), action=statefile.Actions[action], actionunits=units)
+    try:
+        State.Commit()
+    except:
+        AppendLog("RecordActuation()", 5017)
+
+def CheckLastActuation():
+#v1 done, untested
+#at startup: if the previous run started a bolus less than ActuationHold seconds ago, it may have been stopped in the
+#middle of it, and the bolus may not show in the pump history (or the IOB) yet. boluses are held until then, so that
+#it is not given twice. suspends and resumes need nothing: the pump's status is read every loop.
+
+    global BolusHoldUntil
+    started = State.Get("actiontime")
+    if State.Get("action") != statefile.Actions["bolus"] or not 0 <= clock.Time() - started < ActuationHold:
+        return False
+    BolusHoldUntil = started + ActuationHold
+    AppendLog("CheckLastActuation()", 5018, "A bolus of %s units was started %i seconds before this start. No bolus until %s." % (State.Get("actionunits"), clock.Time() - started, clock.Strftime("%H:%M:%S", BolusHoldUntil)))
+    return True
+
+def CheckLastSuccess():
+#v3 done, untested
+#with the watchdog running, repetitive failures start its recovery steps instead of a reboot.
+
+    LastSuccess=State.Get("lastsuccess")
+    if LastSuccess <= 0:
+        AppendLog("CheckLastSuccess()",5013)
+        return False
+    else:
+        MinutesSinceSuccess = (clock.Time() - LastSuccess)/60
+        AppendLog("CheckLastSuccess()",7000,"Last success %f minutes ago." % (MinutesSinceSuccess))
+        if MinutesSinceSuccess > 10:
+            AppendLog("CheckLastSuccess()",5014)
+            if Watchdog is not None:
+                Watchdog.Trip("no successful loop for %i minutes" % (MinutesSinceSuccess))
+            else:
+                ShutdownRestart()
+                
+def GetStatus():
+#v2 done, untested
+#returns tuple: position 0 - status(str), position 1 - bolusing(bln), position 2 -suspended(bln)
+#the pump is only asked once per loop, or again after the remote has been used.
+
+    return Snapshot.Get("status", ReadStatus)
+
+def ReadStatus():
+#v1 done, tested
+
+    try:
+        output=RunOpenaps("get-status")   #get-status is an alias for "use pump status"
+        statusdata = json.loads(output)
+    except:
+        AppendLog("GetStatus()", 5080)
+        raise IOError("Could not get pump status.")
+    else:
+        AppendLog("GetStatus()",6005)
+        return (statusdata["status"],statusdata["bolusing"],statusdata["suspended"])
+
+def SuspendPump(desiredstatus):
+#v3 done, untested
+#desiredstatus is boolean. True=Suspend. False=Resume.
+#after the remote sequence, checks with growing gaps whether the pump answers and is in the new state, and returns as soon as it is.
+#only falls back to the old fixed waits (from the calibrated timing profile, see SettleTime()) if that does not happen by ReadyDeadline.
+
+    if desiredstatus:
+        AppendLog("SuspendPump()", 6003)  #suspending
+    else:
+        AppendLog("SuspendPump()", 6004)  #resuming
+
+    try:
+        p = GetStatus()
+    except:
+        AppendLog("SuspendPump()", 5080)
+        raise IOError("Could not get pump status.")
+
+    action = "suspend" if desiredstatus else "resume"
+    if p[2] != desiredstatus:
+
+        #initiate comms, send Suspend/Resume command, execute
+        RecordActuation("suspend" if desiredstatus else "resume")    #on disk before the first button press
+        report=Remote.Play(remote.SuspendWaveform(RemoteAct, RemoteSuspend, RemoteTimings()))
+        AppendLog("SuspendPump()", 7000, "Remote sequence " + report.Summary())
+
+        Snapshot.Invalidate()    #status has changed, and so will IOB once basal stops/starts
+
+        #the pump seems somewhat knocked out after a change from suspend to resume. takes a while for comms to work again.
+        try:
+            (p, attempts, seconds) = calibration.Poll(lambda: PumpInState(desiredstatus), ReadyInterval, ReadyDeadline, FirstPollTime(action), 2, ReadyMaxInterval)
+        except calibration.NotReady as e:
+            AppendLog("SuspendPump()", 5008, str(e))
+            if UseRemoteTiming and RemoteTiming is not None and SettleTime(action, 15) < 15:
+                RemoteTiming.Widen(action)      #the profile was too optimistic. wait longer next time.
+        else:
+            AppendLog("SuspendPump()", 7000, "Pump ready after %i checks in %.1f seconds." % (attempts, seconds))
+            if UseRemoteTiming and RemoteTiming is not None:
+                RemoteTiming.Observe(action, attempts, seconds)
+            AppendLog("SuspendPump()",6007,"Status is: %s." % (p[2]))
+            QueueNightscout("treatments", nightscout.Treatment("Note", clock.Time(), notes="Pump %s." % ("suspended" if desiredstatus else "resumed")))
+            return 1
+
+    settle = SettleTime(action, 15)
+    try:
+        output=RunOpenaps("get-session")   #get-session is an alias for "use pump Session". doing this to reset the session, otherwise second call to GetStatus() fails
+    except:
+        AppendLog("SuspendPump()", 5082, "Trying again in %i seconds." % (settle))
+        clock.Sleep(settle)
+        try:    #smash, bang, hit it again.
+            output=RunOpenaps("get-session")
+        except:
+            #and if this didn't work, with a resigned sigh, we move on. we'll figure it out later.
+            AppendLog("SuspendPump()", 5082, "Moving on in 15 seconds.")
+            clock.Sleep(15)
+
+    try:
+        p = GetStatus()
+    except:
+        AppendLog("SuspendPump()", 5080)
+        raise IOError("Could not get pump status.")
+		
+    if p[2] == desiredstatus:
+        AppendLog("SuspendPump()",6007,"Status is: %s." % (p[2]))
+        QueueNightscout("treatments", nightscout.Treatment("Note", clock.Time(), notes="Pump %s." % ("suspended" if desiredstatus else "resumed")))
+        return 1
+    else:
+        AppendLog("SuspendPump()",5006,"Status is: %s." % (p[2]))
+        return -1
+
+def PumpInState(desiredstatus):
+#v1 done, untested
+#one readiness check after a suspend/resume: opens a new pump session and reads the status. raises until the pump answers and is in the desired state.
+
+    RunOpenaps("get-session")   #get-session is an alias for "use pump Session". without it the status read after a suspend/resume fails
+    statusdata = json.loads(RunOpenaps("get-status"))
+    if statusdata["suspended"] != desiredstatus:
+        raise IOError("Suspended is still %s." % (statusdata["suspended"]))
+    return (statusdata["status"],statusdata["bolusing"],statusdata["suspended"])
+
+def FirstPollTime(action):
+#v1 done, untested
+
+    if not UseRemoteTiming:
+        return calibration.FirstPoll
+    if RemoteTiming is None:
+        LoadRemoteTiming()
+    return RemoteTiming.FirstPoll(action)
+
+def LoadRemoteTiming():
+#v1 done, untested
+#the timing profile of the pump named in pump.ini
+
+    global RemoteTiming
+    try:
+        serial = pumpworker.ReadSerial()
+    except:
+        serial = "default"
+    RemoteTiming = calibration.TimingProfile(serial)
+    return RemoteTiming
+
+def SettleTime(action, default):
+#v1 done, untested
+#seconds to wait after a suspend/resume before talking to the pump again: the calibrated time plus margins, at most default.
+
+    if not UseRemoteTiming:
+        return default
+    if RemoteTiming is None:
+        LoadRemoteTiming()
+    return RemoteTiming.Settle(action, default)
+
+def CalibrateRemote(rounds=3):
+#v1 done, untested
+#suspends and resumes the pump a few times, measuring how long it takes to answer again. never boluses.
+
+    def Toggle():
+        Remote.Play(remote.SuspendWaveform(RemoteAct, RemoteSuspend, RemoteTimings()))
+        Snapshot.Invalidate()
+
+    def Ready():
+        RunOpenaps("get-session")
+        ReadStatus()
+
+    AppendLog("CalibrateRemote()", 7000, "Calibrating remote timing with %i suspend/resume cycles." % (rounds))
+    measured = calibration.Calibrate(LoadRemoteTiming(), Toggle, Ready, lambda: ReadStatus()[2], rounds, lambda message: AppendLog("CalibrateRemote()", 7000, message))
+    for action in sorted(measured):
+        AppendLog("CalibrateRemote()", 7000, "%s now waits %.1f seconds (was 15)." % (action, RemoteTiming.Settle(action, 15)))
+    return measured
+
+def GetTargetGlucose(file):
+#v2 done, untested
+#the "high" target in force now, from the pump's schedule
+
+    try:
+        return PumpSettings.Value(file, schedules.Targets)
+    except:
+        AppendLog("GetTargetGlucose()", 5071)
+        raise IOError("Could not get target glucose.")
+
+def RefreshSettings():
+#v1 done, untested
+#looks up CorrectionFactor, TargetGlucose, DIA and MaxIOB for the time of day, from the files as they are now.
+#a value is only replaced when it differs from the last lookup - the file changed or a new segment of the day started -
+#so one set by hand stays until then. a file which cannot be read keeps the value it had.
+
+    if not UseSettingsReload:
+        return 0
+    changed = 0
+    for (name, file, parse, code) in [("CorrectionFactor", CorrectionFactorFile, schedules.Sensitivities, 5070),
+                                      ("TargetGlucose", TargetGlucoseFile, schedules.Targets, 5071),
+                                      ("DIA", ProfileFile, schedules.DIA, 5052),
+                                      ("MaxIOB", MaxIOBFile, schedules.MaxIOB, 5050)]:
+        try:
+            (different, value) = PumpSettings.Changed(file, parse)
+        except:
+            AppendLog("RefreshSettings()", code)
+            continue
+        if PumpSettings.Get(file, parse).Error is not None:
+            AppendLog("RefreshSettings()", code, "Keeping the last good settings. %s" % (PumpSettings.Get(file, parse).Error))
+        if different:
+            AppendLog("RefreshSettings()", 7000, "%s is now %s (was %s)." % (name, value, globals()[name]))
+            globals()[name] = value
+            changed += 1
+    return changed
+        
+def NightscoutConfigured(function):
+#v1 done, untested
+#true if ./nightscout.ini names a Nightscout host. says so once in the log if it does not.
+
+    global NightscoutHost
+    if NightscoutHost is None:
+        NightscoutHost = nightscout.ReadConfig()[0] or ""
+        if not NightscoutHost:
+            AppendLog(function, 7000, "No host in %s. Nothing is sent to or fetched from Nightscout." % (nightscout.NightscoutIniFile))
+    return bool(NightscoutHost)
+
+def QueueNightscout(collection, *records):
+#v3 done, untested
+#adds records to the Nightscout outbox. only touches the SD card - the upload happens later, on the Nightscout task.
+#without a host in nightscout.ini the records are not kept at all.
+
+    global Nightscout
+    if not UseNightscoutOutbox or not NightscoutConfigured("QueueNightscout()"):
+        return 0
+    try:
+        if Nightscout is None:
+            Nightscout = nightscout.Uploader()
+        dropped = Nightscout.Outbox.Put(collection, *records)
+    except:
+        AppendLog("QueueNightscout()", 5042, "Could not queue %s." % (collection))
+        return -1
+    if dropped:
+        AppendLog("QueueNightscout()", 7000, "Nightscout outbox full. %i old %s records dropped without being uploaded." % (dropped, collection))
+    return 1
+
+def UpdateNightscout():
+#v3 done, untested
+#with UseNightscoutOutbox, uploads whatever is in the outbox (see QueueNightscout()). otherwise runs the upload script.
+#runs on the Nightscout task, not on the loop.
+
+    if UseNightscoutOutbox:
+        if Nightscout is None or Nightscout.Waiting():    #nothing queued yet, or no host to send it to
+            return 0
+        uploaded = Nightscout.Drain()
+        if uploaded < 0:
+            AppendLog("UpdateNightScout()", 5040, "%s Next attempt in %i seconds." % (Nightscout.LastError, Nightscout.NextAttempt - clock.Time()))
+            return -1
+        if uploaded > 0:
+            AppendLog("UpdateNightScout()", 6015, "%i records uploaded." % (uploaded))
+        return 1
+
+    try:
+        response=urllib2.urlopen('http://77.154.221.246',timeout=2)
+    except:
+        AppendLog("UpdateNightScout()",5040)
+        return -1
+    else:
+        GetIOB()
+        try:
+            p=subprocess.Popen("/home/pi/update-nightscout.sh", stdout=subprocess.PIPE, shell=True)
+            (output, err) = p.communicate()    
+        except:
+            AppendLog("UpdateNightScout()",5041)
+            return -1
+        else:
+            AppendLog("UpdateNightScout()",6015)
+            return 1
+
+
+def DownloadNightscout():
+#v2 done, untested
+#brings the local copies of the Nightscout data up to date. runs on its own task, not on the loop.
+
+    global NightscoutDownloader
+    if not UseNightscoutDownload or not NightscoutConfigured("DownloadNightscout()"):
+        return 0
+    try:
+        if NightscoutDownloader is None:
+            NightscoutDownloader = nightscout.Downloader()
+        before = NightscoutDownloader.Transferred
+        result = NightscoutDownloader.RefreshAll()
+    except:
+        AppendLog("DownloadNightscout()", 5043)
+        return -1
+    AppendLog("DownloadNightscout()", 7000, "New entries: %s, new treatments: %s, profile changed: %s. %i bytes." % (result["entries"], result["treatments"], result["profile"], NightscoutDownloader.Transferred - before))
+    return 1
+
+def UpdateUI(glucose, IOB, timestamp, reservoir, apsbattery, exercisemode, prediction=None):
+#v1 in progress
+#prediction is the latest GlucoseForecast, or None
+#include:
+# - pump busy or not
+# - 
+
+    return 1
+
+def CheckUserInput():
+#v1 in progress
+    #on error raise IOError
+
+#include:
+# - set/release exercise mode (time limit as well)
+# - reload settings
+# - exit to shell
+# - shutdown/restart
+# - confirm bolus
+# - _maybe_ switch on and off HDMI port (power saving)
+# - prevent user input during a loop
+# - bolus suspend mode e.g. for when in the shower or otherwise disconnected from the pump.
+# - keepalive mode: shut off USB power management
+
+    return 1
+
+def ExerciseMode():
+#v1 in progress
+#user sets it and unsets it
+#in this mode, ExerciseFactor becomes something more, like 3 (divides the aggressiveness of the algorithm by 3)
+#needs also the option to have it time out and return to normal for PWD like me, who will forget to set it back to normal.
+
+    return 1
+
+def BolusSuspend():
+#v1 in progress
+#mode to suspend bolusing
+#user can set/unset (same mechanisms as exercise mode) for when disconnected from the pump, e.g. in the shower.
+
+    return 1
+
+def Preflight():
+#v2 in progress
+#To do: Check the clock
+
+    global PumpModel
+
+    try:
+        Power.Sleep()
+    except:
+        pass
+
+    clock.Sleep(1)
+
+    try:
+        AppendLog("Preflight()", 7000, "CareLink stick ready %.1f seconds after waking USB." % (Power.Wake()))
+    except calibration.NotReady as e:
+        AppendLog("Preflight()", 7000, "%s" % (e))
+    except:
+        AppendLog("Preflight()",5092)
+        command="sudo reboot"
+        p=subprocess.Popen (command, stdout=subprocess.PIPE, shell=True)
+
+    try:
+        output=RunOpenaps("get-model")   #get-model is an alias for "use pump model"
+    except:
+        #failed to communicate: 
+        AppendLog("Preflight()",5000)
+        raise IOError("Could not communicate with the pump.")
+    else:
+        AppendLog("Preflight()",6009,"Model is %s" % output)
+        PumpModel = output.strip().strip('"')
+        return 1
+
+def WarmStartCheck():
+#v1 done, untested
+#true if this start can be warm (see bobs/warmstart.py): wakes USB and waits for the CareLink stick instead of Preflight().
+
+    global PumpModel
+    if not UseWarmStart:
+        return False
+    (usable, why) = WarmSnapshot.Usable(State.Get("lastsuccess"), warmstart.Fingerprint(), clock.Time(), WarmStartMaxAge)
+    if not usable:
+        AppendLog("WarmStartCheck()", 7000, "Cold start: %s." % (why))
+        return False
+
+    try:
+        seconds = Power.Wake(True, StickTimeout)    #in case the crash came while USB and Ethernet were asleep
+    except calibration.NotReady as e:
+        AppendLog("WarmStartCheck()", 7000, "Cold start: %s" % (e))
+        return False
+    except:
+        AppendLog("WarmStartCheck()", 7000, "Cold start: could not wake USB.")
+        return False
+    PumpModel = WarmSnapshot.Get("model")
+    AppendLog("WarmStartCheck()", 7000, "Warm start: %s. CareLink stick ready after %.1f seconds." % (why, seconds))
+    return True
+
+def SettingsChangedOnPump():
+#v1 done, untested
+#brings the pump history up to date and looks for settings changes since the last settings download. true if there are any, or if it cannot tell.
+
+    try:
+        SyncPumpHistory()
+    except:
+        AppendLog("SettingsChangedOnPump()", 5000, "Could not read the pump history. Downloading the settings.")
+        return True
+    changes = [r for r in PumpHistory.Since(WarmSnapshot.Get("settings_time", 0)) if warmstart.SettingsChange(r)]
+    if changes:
+        AppendLog("SettingsChangedOnPump()", 7000, "%i settings changes on the pump (%s). Downloading the settings." % (len(changes), ", ".join(sorted(set(r["_type"] for r in changes)))))
+        return True
+    AppendLog("SettingsChangedOnPump()", 7000, "No settings changes on the pump since %s." % (clock.Strftime("%Y-%m-%d %H:%M:%S", WarmSnapshot.Get("settings_time", 0))))
+    return False
+
+def SaveWarmStart(settingstime):
+#v1 done, untested
+
+    if not UseWarmStart:
+        return 0
+    try:
+        WarmSnapshot.Save(PumpModel, warmstart.Fingerprint(), settingstime, Log.Loop)
+    except:
+        AppendLog("SaveWarmStart()", 7000, "Could not save %s. The next start will be cold." % (WarmStartFile))
+        return -1
+    return 1
+
+def ResetPrediction():
+#v2 done, untested
+
+    State.Update(lg4p=0, lcf4p=0.0, lpc4p=0.0)
+    try:
+        State.Commit()
+    except:
+        AppendLog("ResetPrediction()", 5093)
+        
+def WaitAWhile(LastGlucose):
+#v3 done, untested
+#wait up to 15 minutes to let previous treatment start to work. However, check each 5 minutes whether the glucose is changing rapidly, in which case break early and rerun the loop.
+#also break and rerun the loop if glucose is too high to be waiting around.
+#switch off peripherals while waiting - waste of energy.
+#with UseSensorSchedule, each check happens just after the next CGM reading is due (see bobs/scheduler.py) rather than after a fixed wait,
+#and if the reading is late the pump is asked again a few times before giving up.
+#the ports are woken as long before the pump read as recent wakes have taken (see bobs/usbpower.py), and the read
+#happens when the stick is back, or at the planned time if it was back sooner.
+
+    for iteration in range(0,3):
+        if KeepAlive:
+            WakeLead = USBWakeTime
+        else:
+            WakeLead = Power.Lead()
+        if UseSensorSchedule and SensorSchedule.Ready():
+            PollTime = SensorSchedule.PollTime(clock.Time() + WakeLead)
+            SleepTime = PollTime - WakeLead - clock.Time()
+            AppendLog("WaitAWhile()", 6012, "Next reading due at %s. Waking in %i seconds." % (clock.Strftime("%H:%M:%S", PollTime - SensorSchedule.Margin), SleepTime))
+        else:
+            PollTime = clock.Time() + LoopWaitTime
+            SleepTime = LoopWaitTime-WakeLead
+            AppendLog("WaitAWhile()", 6012)
+        
+        Heartbeat("wait", SleepTime + WakeLead + usbpower.WakeTimeout + SensorRetries*SensorRetryDelay + watchdog.Stall)
+        if not KeepAlive:
+            try:
+                Power.Sleep()
+            except:
+                pass
+
+        clock.Sleep(SleepTime)
+
+        if not KeepAlive:
+            try:
+                Power.Wake()
+            except calibration.NotReady as e:
+                AppendLog("WaitAWhile()", 7000, "%s" % (e))
+            except:
+                AppendLog("WaitAWhile",5092)
+                command="sudo reboot"
+                p=subprocess.Popen (command, stdout=subprocess.PIPE, shell=True)
+
+        clock.Sleep(max(0, PollTime - clock.Time()))
+
+        PreviousReadingTime = LastReadingTime
+        try:
+            Glucose=GetGlucose()
+            if UseSensorSchedule:
+                for retry in range(0,SensorRetries):
+                    if LastReadingTime != PreviousReadingTime:
+                        break
+                    AppendLog("WaitAWhile()", 7000, "New reading not in yet. Asking again in %i seconds." % (SensorRetryDelay))
+                    clock.Sleep(SensorRetryDelay)
+                    Glucose=GetGlucose()
+        except:
+            AppendLog("WaitAWhile()", 5061, "Exiting wait state.")
+            break
+        else:
+            AppendLog("WaitAWhile()", 7000, "Current glucose is %i and previous glucose was %i." % (Glucose, LastGlucose))
+            if abs(Glucose-LastGlucose) > 5:
+                AppendLog("WaitAWhile()", 6014)
+                break
+            elif Glucose - TargetGlucose > WaitingThreshold:
+                AppendLog("WaitAWhile()", 6013, "However, glucose is above waiting threshold of %i. Exiting wait state." % (TargetGlucose + WaitingThreshold))
+                break
+            else:
+                AppendLog("WaitAWhile()", 6013)
+                Tasks.Kick("nightscout")
+
+    AppendLog("WaitAWhile()", 7000, "Wait is over.")
+
+def MonitorBattery():
+#v1 in progress, hardware dependent
+
+    return 1
+
+def ShutdownRestart():
+#v2 done, untested
+#a reboot because the loop keeps failing is always followed by a cold start.
+
+    WarmSnapshot.Forget()
+    AppendLog("ShutdownRestart()", 7000,"Rebooting in 60 seconds...")
+    Log.Flush()
+
+    clock.Sleep(60)
+    
+    command="sudo reboot"
+    try:
+        p=subprocess.Popen (command, stdout=subprocess.PIPE, shell=True)
+        (output, err) = p.communicate()
+    except:
+        AppendLog("ShutdownRestart()",5015)
+        return -1
+        
+        
+def InitLog():
+#v1 done, tested
+
+    logfilename = "./logs/" + clock.Strftime("%Y%m%d-%H%M%S") + "-APSlog.txt"
+    print "Initiating log file " + logfilename
+    LogFile=open(logfilename,"w")
+    LogFile.write("Initiating log file " + logfilename + "\n")
+    LogFile.close()
+          
+    return logfilename
+
+def OpenLog():
+#v1 done, untested
+#creates the log file and its writer. called when the first line is logged.
+
+    global LogF
+    LogF=InitLog()
+    if UseStructuredLog:
+        writer=LogWriter(LogF, ErrorCodeFile, structured=StructuredLog(LogF.replace(".txt", ".jsonl")))
+    else:
+        writer=LogWriter(LogF, ErrorCodeFile)
+    atexit.register(writer.Close)
+    return writer
+
+#the log writer keeps the log file open and writes from a background thread. see bobs/logger.py
+Log=lazy.Lazy(OpenLog, "LogWriter")   #LogWriter (created by OpenLog() on first use, so that importing this module leaves no log file behind)
+
+def SetupGPIO(gpio=None):
+#v1 done, untested
+#imports RPi.GPIO, unless a module with the same functions is given (the replay's fake remote), and sets the remote's
+#pins up as outputs, low. returns the module.
+
+    if gpio is None:
+        import RPi.GPIO as gpio
+    gpio.setmode(gpio.BOARD)  #physical pin reference scheme
+    gpio.setwarnings(False)   #avoid "already in use" warnings when GPIO.cleanup() does not have the opportunity to run
+    for pin in (RemoteAct, RemoteBolus, RemoteSuspend):
+        gpio.setup(pin, gpio.OUT)
+        gpio.output(pin, gpio.LOW)
+    return gpio
+
+def OpenState():
+#v1 done, untested
+#loads StateFile. the first time, takes over what the old predict.json and loopsuccess.txt held.
+
+    state = LoopState(StateFile)
+    if state.Fresh:
+        state.Import(GlucosePredictFile, LoopSuccessFile)
+    return state
+
+def RunOpenaps(*args):
+#v3 done, untested
+#runs an openaps alias (or command line) and returns its output text. goes through the pump worker when it is running.
+#waits its turn in PumpQueue, so the Nightscout task and the loop never talk to the pump at the same time.
+
+    if PumpWorker is not None:
+        return PumpQueue.Call(CallPumpWorker, *args)
+    return PumpQueue.Call(pumpworker.RunOpenaps, *args)
+
+def CallPumpWorker(*args):
+#v1 done, untested
+#one call through the pump worker. if the worker has exited, or does not answer a ping after a call timed out, it is
+#dropped and the call (and the ones after it) go to openaps directly. the watchdog may start a new worker later.
+
+    worker = PumpWorker
+    if worker is None or (PumpWorkerProcess is not None and PumpWorkerProcess.poll() is not None):
+        DropPumpWorker("Pump worker has exited.")
+        return pumpworker.RunOpenaps(*args)
+    try:
+        return worker.Call(*args)
+    except pumpworker.NoReply:
+        if worker.Ping():
+            raise       #alive, and the call failed like any other pump call
+        DropPumpWorker("Pump worker does not answer.")
+        return pumpworker.RunOpenaps(*args)
+
+def DropPumpWorker(why):
+#v1 done, untested
+
+    global PumpWorker, PumpWorkerProcess
+    AppendLog("DropPumpWorker()", 5000, "%s Using openaps directly." % (why))
+    if PumpWorkerProcess is not None:
+        pumpworker.StopWorker(PumpWorkerProcess)
+    (PumpWorkerProcess, PumpWorker) = (None, None)
+
+def StartPumpWorker():
+#v2 done, untested
+
+    global PumpWorker, PumpWorkerProcess
+    try:
+        (PumpWorkerProcess, PumpWorker) = pumpworker.StartWorker()
+    except:
+        AppendLog("StartPumpWorker()", 5000, "Could not start pump worker. Using openaps directly.")
+        (PumpWorkerProcess, PumpWorker) = (None, None)
+    else:
+        AppendLog("StartPumpWorker()", 7000, "Pump worker started, pid %s." % (PumpWorkerProcess.pid))
+
+def StopPumpWorker():
+#v1 done, untested
+
+    global PumpWorker, PumpWorkerProcess
+    if PumpWorker is not None:
+        PumpWorker.Stop()
+    if PumpWorkerProcess is not None:
+        pumpworker.StopWorker(PumpWorkerProcess)
+    (PumpWorkerProcess, PumpWorker) = (None, None)
+
+def RestartPumpWorker():
+#v1 done, untested
+#watchdog step: ends the worker, stuck or not, and starts a new one with a new pump session. a call stuck on the old
+#one times out on its own (see pumpworker.RequestTimeout) and the next call goes to the new one.
+#also brings back a worker which was dropped. false if the loop does not use a worker.
+
+    if not UsePumpWorker:
+        return False
+    if PumpWorkerProcess is not None:
+        pumpworker.StopWorker(PumpWorkerProcess)
+    StartPumpWorker()
+    return PumpWorker is not None
+
+def PowerCycleUSB(offtime=5):
+#v1 done, untested
+#watchdog step: USB and Ethernet off and on again, then waits for the CareLink stick.
+
+    try:
+        AppendLog("PowerCycleUSB()", 7000, "CareLink stick ready after %.1f seconds." % (Power.Cycle(offtime, StickTimeout)))
+    except calibration.NotReady as e:
+        AppendLog("PowerCycleUSB()", 7000, "%s" % (e))
+    return True
+
+def HubCtrl(command):
+#v2 done, untested
+#runs hub-ctrl for the power manager. raises if it fails, so that the power manager does not take the switch as done.
+
+    p=subprocess.Popen (command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+    (output, err) = p.communicate()
+    if p.returncode != 0:
+        raise IOError("%s exited with %s: %s" % (command, p.returncode, (output or "").strip()))
+
+def ReportPower():
+#v1 done, untested
+
+    report = Power.Report()
+    if report["wake_max"] is None:
+        wakes = "no wakes measured yet"
+    else:
+        wakes = "wake to CareLink ready %.1f s (median), %.1f s (slowest), %i timeouts" % (report["wake_median"], report["wake_max"], report["wake_timeouts"])
+    AppendLog("ReportPower()", 7000, "USB off %.0f%% of the time, about %.1f Wh a day saved%s. %i switches, %i redundant ones skipped, %s. Waking %.1f seconds ahead." % (
+              report["off_fraction"]*100, report["wh_per_day"], " (KeepAlive is on)" if KeepAlive else "", report["transitions"], report["skipped"], wakes, report["lead"]))
+
+def RestartProcess():
+#v1 done, untested
+#watchdog step: starts the program again in this process (same pid, same screen session). if the last successful
+#loop was recent enough it is a warm start, without Preflight().
+
+    AppendLog("RestartProcess()", 7000, "Restarting: %s" % (" ".join(Arguments)))
+    if PumpWorkerProcess is not None:
+        pumpworker.StopWorker(PumpWorkerProcess)
+    if lazy.Created(GlucoseHistory):
+        GlucoseHistory.Flush()
+    Log.Close()
+    os.execv(sys.executable, [sys.executable] + Arguments)
+
+def StartWatchdog():
+#v1 done, untested
+
+    global Watchdog
+    Watchdog = watchdog.Watchdog([("pump worker", RestartPumpWorker),
+                                  ("usb power", PowerCycleUSB),
+                                  ("process", RestartProcess),
+                                  ("reboot", lambda: ShutdownRestart() != -1)],
+                                 lambda code, message: AppendLog("Watchdog", code, message))
+    Watchdog.Start()
+    atexit.register(Watchdog.Stop)
+    for (step, (runs, seconds, recovered)) in sorted(Watchdog.Summary().items()):
+        AppendLog("StartWatchdog()", 7000, "Recovery step '%s': run %i times, %.0f seconds, loop recovered %i times." % (step, runs, seconds, recovered))
+
+def Heartbeat(stage, allowance=None):
+#v1 done, untested
+#tells the watchdog that the loop has reached stage, and will reach the next one within allowance seconds.
+
+    if Watchdog is not None:
+        Watchdog.Beat(stage, allowance)
+
+def AppendLog(function, code, message=" "):
+#v2 done, untested
+#error codes 5xxx, 6002, 6003 and 6004 are fsynced before returning. everything else is buffered.
+
+    return Log.Append(function, code, message)
+
+def SampleUptime():
+#v1 done, untested
+
+    global Uptime
+    p=subprocess.Popen ("uptime", stdout=subprocess.PIPE, shell=True)
+    (output, err) = p.communicate()
+    Uptime = output
+
+def RefreshUI():
+#v1 done, untested
+
+    UpdateUI(Glucose, IOB, clock.Time(), Reservoir, APSBatteryLow, ExerciseFactor, Prediction)
+
+def Treat(glucose):
+#v1 done, untested
+#the dosing decision and its remote sequence, as one job on the pump queue. nothing else uses the pump until it is done.
+
+    return Bolus(CalculateBolus(glucose))
+
+def StartTasks():
+#v1 done, untested
+
+    PumpQueue.Start()
+    if UseNightscoutDownload and NightscoutConfigured("StartTasks()"):
+        Tasks.Add("nsdownload", lambda: DownloadNightscout(), NightscoutDownloadInterval)
+    Tasks.Start()
+    atexit.register(Tasks.Stop)
+    AppendLog("StartTasks()", 7000, "Background tasks started: %s." % (", ".join(sorted(Tasks.Tasks))))
+
+#side jobs of the loop. they run in line until StartTasks() is called.
+#lambdas so that the current function is looked up at each run (the replay swaps some of them).
+Tasks.Add("uptime", lambda: SampleUptime(), UptimeInterval)
+Tasks.Add("nightscout", lambda: UpdateNightscout(), NightscoutInterval)
+Tasks.Add("ui", lambda: RefreshUI(), UIInterval)
+Tasks.Add("logflush", lambda: Log.Flush(), LogFlushInterval)
+Tasks.Add("power", lambda: ReportPower(), PowerReportInterval)
+	
+def LoopOnce():
+#v1 done, tested
+#one pass of the main loop: read glucose and IOB, treat, then wait for the next pass.
+
+    global Glucose, IOB
+
+    Log.Loop += 1
+    Heartbeat("loop")
+    Snapshot.NewLoop()
+    RefreshSettings()
+    Tasks.Kick("uptime")    #in line when the tasks are not started, otherwise the periodic sample is recent enough
+    AppendLog("Main program:",7001,Uptime)
+    try:
+        Glucose=GetGlucose()
+        Heartbeat("glucose")
+        IOB=GetIOB()
+        Heartbeat("iob")
+        SetLoopSuccess()    #if we've made it this far, then 99% chance we have enough to finish the loop. set success early because later there are too many factors which may lead (legitimately) to an early exit.
+
+    except:
+        CheckLastSuccess()
+
+        AppendLog("Main program:",5090,"Waiting 1 minute.")
+        Heartbeat("usb reset", 60 + watchdog.Stall)
+        if KeepAlive:
+            USBofftime=5
+        else:
+            USBofftime=50       
+        AppendLog("Main program:",5090,"Resetting USB devices.")
+        try:
+            Power.Sleep()
+        except:
+            pass
+
+        clock.Sleep(USBofftime)
+
+        WokeAt=clock.Monotonic()
+        try:
+            Power.Wake()
+        except calibration.NotReady as e:
+            AppendLog("Main program:",5090,"%s" % (e))
+        except:
+            AppendLog("Main program:",5092)
+            ShutdownRestart()
+
+        clock.Sleep(max(0, 60-USBofftime-(clock.Monotonic()-WokeAt)))
+
+    else:
+        Heartbeat("treat", 2*watchdog.Stall)   #a long bolus count-up, and the waits for the pump around it
+        PumpQueue.Call(Treat, Glucose)
+        Heartbeat("save")
+        SaveState()
+        QueueNightscout("devicestatus", nightscout.DeviceStatus(clock.Time(), iob=IOB, uptime=Uptime, predicted=Prediction.Curve() if Prediction is not None else None))
+        Tasks.Kick("nightscout")
+        Tasks.Kick("ui")
+        CheckLastSuccess()
+        WaitAWhile(Glucose)
+
+#main program
+#v2 done, untested
+#only runs when started by bobs-pancreas.py (or "python -m bobs.pancreas"). importing this module sets nothing up:
+#GPIO, the log file, the loop state and the pump history are created when they are first used.
+
+def Main(argv=None):
+
+    global MaxIOB, Reservoir, CorrectionFactor, TargetGlucose, DIA, StartedAt, Arguments
+
+    if argv is None:
+        argv = sys.argv
+    StartedAt=clock.Monotonic()
+    Arguments=list(argv)
+
+    if UsePumpWorker:
+        StartPumpWorker()
+        atexit.register(StopPumpWorker)
+    if UseBackgroundTasks:
+        StartTasks()
+
+    if "--calibrate" in argv:
+        try:
+            Preflight()
+            CalibrateRemote()
+        except Exception as e:
+            AppendLog("Main program:", 5008, "Calibration failed: %s" % (e))
+        Log.Close()
+        if lazy.Created(GPIO):
+            GPIO.cleanup()
+        sys.exit(0)
+
+    if UseWatchdog:
+        StartWatchdog()
+        Heartbeat("startup", StickTimeout + 2*watchdog.Stall)   #a cold start downloads all the settings
+    try:
+        Warm=WarmStartCheck()
+        if not Warm:
+            Preflight()
+        AppendLog("Main program:", 7000, "%i readings added to the glucose history from %s." % (GlucoseHistory.WarmLoad(GlucoseHistoryFile), GlucoseHistoryFile))
+        AppendLog("Main program:", 7000, "%i readings restored to the glucose history from %s." % (RestoreHistory(), StateFile))
+        CheckLastActuation()
+        atexit.register(GlucoseHistory.Flush)
+        if not Warm or SettingsChangedOnPump():
+            PrepIOB()														#needed for subsequent functions
+            SettingsTime=clock.Time()
+        else:
+            SettingsTime=WarmSnapshot.Get("settings_time")
+        MaxIOB=GetMaxIOB()
+        if not Warm:
+            Reservoir=GetReservoir()                                        #on a warm start, Bolus() reads it when it is needed
+        CorrectionFactor=GetCorrectionFactor(CorrectionFactorFile)	        #uses insulin sensitivies downloaded in PrepIOB() function
+        TargetGlucose=GetTargetGlucose(TargetGlucoseFile)					#uses glucose targets downloaded in PrepIOB() function
+        DIA=GetDIA()                                                        #uses DIA downloaded in PrepIOB() function
+        CheckUserInput()
+        if UsePrediction and not Warm:
+            ResetPrediction()                                               #a warm start carries on from the prediction state in StateFile
+        SaveWarmStart(SettingsTime)
+        AppendLog("Main program:", 7000, "%s start took %.1f seconds." % ("Warm" if Warm else "Cold", clock.Monotonic() - StartedAt))
+    except:
+        AppendLog("Main program:", 5091)
+        ShutdownRestart()
+
+    while ContinueLooping:
+        LoopOnce()
+
+    AppendLog("Main program - ",6008)
+    Log.Close()
+
+    if lazy.Created(GPIO):
+        GPIO.cleanup()
+
+if __name__ == "__main__":
+    Main()
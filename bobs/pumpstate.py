@@ -0,0 +1,49 @@
+#loop-scoped snapshot of pump state.
+#
+#one pass through CalculateBolus() -> SuspendPump() -> Bolus() used to ask the pump for its status up to four times,
+#and UpdateNightscout() recalculated IOB right after the main loop had done it. the snapshot remembers each value
+#(status, reservoir, IOB, history sync) for the rest of the loop, up to a time limit. it is cleared at the start of
+#every loop and whenever the remote has been used (bolus, suspend/resume), since that is what changes pump state.
+
+from bobs import clock
+
+SnapshotTTL=120   #int (seconds a value is trusted, even within one loop)
+
+class PumpSnapshot(object):
+
+    def __init__(self, ttl=SnapshotTTL, now=clock.Time):
+        self.TTL = ttl
+        self.Clock = now
+        self.Values = {}
+        self.Hits = 0
+        self.Misses = 0
+
+    def Get(self, name, loader):
+    #returns the remembered value, or calls loader() for a fresh one. errors from loader are not remembered.
+
+        if name in self.Values:
+            (value, stamp) = self.Values[name]
+            if self.Clock() - stamp < self.TTL:
+                self.Hits += 1
+                return value
+        value = loader()
+        self.Values[name] = (value, self.Clock())
+        self.Misses += 1
+        return value
+
+    def Invalidate(self, *names):
+    #forgets the named values, or everything if no names are given
+
+        if not names:
+            self.Values.clear()
+        for name in names:
+            self.Values.pop(name, None)
+
+    def NewLoop(self):
+    #clears the snapshot and returns the hit/miss counts of the loop just finished
+
+        counts = (self.Hits, self.Misses)
+        self.Invalidate()
+        self.Hits = 0
+        self.Misses = 0
+        return counts
@@ -0,0 +1,250 @@
+#long-lived pump communication worker.
+#
+#the control loop used to fork a fresh "openaps <alias>" process for every pump call, paying interpreter startup,
+#the openaps/decocare imports and a new pump session each time. the worker is started once by the loop (bobs/pancreas.py),
+#keeps a decocare session to the pump open, and answers requests over a local zmq REQ/REP socket.
+#only one request is served at a time, which matches the radio: it can only do one thing at a time.
+#
+#requests and replies are JSON:
+#  request: {"args": ["get-status"]}      (the openaps command line, without "openaps")
+#  reply:   {"ok": true, "output": "<same text openaps would have printed>"}  or  {"ok": false, "error": "..."}
+#
+#aliases the decocare session can serve directly are handled in-process. anything else (most-recent-reading,
+#monitor-pump, get-iob, get-settings...) falls back to running the openaps alias, still serialised through the worker.
+#get-session closes the stick and opens a new session, as "openaps use pump Session" in a new process did.
+#
+#a worker which died, or never came up, must not cost 120 seconds per pump call: StartWorker() waits for the new
+#worker to answer a ping, and after a request times out the loop pings it again before trusting it any further.
+#
+#run standalone with: python -m bobs.pumpworker
+
+import os
+import sys
+import time
+import json
+import subprocess
+import ConfigParser
+
+WorkerAddress="ipc:///tmp/bobs-pumpworker.ipc"
+RequestTimeout=120    #int (seconds the client waits for a reply. history downloads can take a while.)
+StartTimeout=30       #int (seconds StartWorker() waits for a new worker to answer a ping)
+PingTimeout=5         #int (seconds a ping waits. the worker answers pings between requests, so a busy one will not)
+SessionMinutes=10     #int (how long the pump radio is kept powered by each power_control call)
+PumpIniFile="./pump.ini"   #openaps device file holding the pump serial number
+
+def RunOpenaps(*args):
+#runs an openaps alias (or any openaps command line) in a child process. returns the output text.
+
+    p=subprocess.Popen(["openaps"] + list(args), stdout=subprocess.PIPE)
+    (output, err) = p.communicate()
+    return output
+
+class NoReply(IOError):
+#the worker did not answer in time: busy with a long request, stuck, or gone
+    pass
+
+class ShellBackend(object):
+#one openaps process per request. used when decocare cannot be imported or a session cannot be opened.
+
+    def Run(self, args):
+        return RunOpenaps(*args)
+
+    def Reset(self):
+        pass
+
+class DecocareBackend(object):
+#keeps one decocare stick and pump session open between requests
+
+    Handled = ("get-status", "get-reservoir", "get-model", "get-session")
+
+    def __init__(self, serial, fallback):
+        self.Serial = serial
+        self.Fallback = fallback
+        self.Pump = None
+        self.Link = None
+        self.SessionExpires = 0
+
+    def Open(self):
+        from decocare import link, stick, session
+        from decocare.scan import scan
+
+        self.Link = link.Link(scan())
+        carelink = stick.Stick(self.Link)
+        carelink.open()
+        self.Pump = session.Pump(carelink, self.Serial)
+        self.PowerUp()
+        self.Pump.read_model()    #also selects the model specific commands
+
+    def PowerUp(self):
+        self.Pump.power_control(minutes=SessionMinutes)
+        self.SessionExpires = time.time() + SessionMinutes*60 - 30
+
+    def Reset(self):
+        if self.Link is not None:
+            try:
+                self.Link.close()
+            except:
+                pass
+        self.Pump = None
+        self.Link = None
+        self.SessionExpires = 0
+
+    def Run(self, args):
+        if len(args) != 1 or args[0] not in self.Handled:
+            return self.Fallback.Run(args)
+        alias = args[0]
+
+        if alias == "get-session":
+            self.Reset()    #a new session, not just more radio time
+        if self.Pump is None:
+            try:
+                self.Open()
+            except:
+                self.Reset()
+                print("Pump worker: could not open a decocare session, using openaps for %s." % alias)
+                return self.Fallback.Run(args)
+        elif time.time() > self.SessionExpires:
+            self.PowerUp()
+
+        try:
+            if alias == "get-status":
+                result = self.Pump.model.read_status()
+            elif alias == "get-reservoir":
+                result = self.Pump.model.read_reservoir()
+            elif alias == "get-model":
+                result = self.Pump.model.read_model()
+            else:
+                result = {"serial": self.Serial, "expires": self.SessionExpires}
+        except:
+            self.Reset()    #session is probably gone. open a fresh one on the next request.
+            raise
+        return json.dumps(result)
+
+def ReadSerial(file=PumpIniFile):
+    config = ConfigParser.RawConfigParser()
+    config.read(file)
+    return config.get('device "pump"', "serial")
+
+def MakeBackend():
+    fallback = ShellBackend()
+    try:
+        import decocare
+        return DecocareBackend(ReadSerial(), fallback)
+    except:
+        print("Pump worker: decocare session not available, using openaps processes.")
+        return fallback
+
+def Serve(address=WorkerAddress, backend=None):
+    if backend is None:
+        backend = MakeBackend()
+
+    import zmq      #only the worker and its client need the message bus, not everything which imports this module
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.REP)
+    socket.bind(address)
+
+    while True:
+        try:
+            request = json.loads(socket.recv())
+        except ValueError:
+            socket.send(json.dumps({"ok": False, "error": "Bad request."}))
+            continue
+
+        args = request.get("args", [])
+        if args == ["stop"]:
+            socket.send(json.dumps({"ok": True, "output": ""}))
+            break
+        if args == ["ping"]:
+            socket.send(json.dumps({"ok": True, "output": "pong"}))
+            continue
+        try:
+            output = backend.Run(args)
+        except Exception as e:
+            reply = {"ok": False, "error": "%s: %s" % (" ".join(args), e)}
+        else:
+            reply = {"ok": True, "output": output}
+        socket.send(json.dumps(reply))
+
+    socket.close()
+
+class PumpClient(object):
+#talks to the worker. a request that times out closes the socket so the next call starts clean (lazy pirate).
+
+    def __init__(self, address=WorkerAddress, timeout=RequestTimeout):
+        self.Address = address
+        self.Timeout = timeout
+        self.Context = None
+        self.Socket = None
+
+    def Connect(self):
+        import zmq
+        if self.Context is None:
+            self.Context = zmq.Context.instance()
+        self.Socket = self.Context.socket(zmq.REQ)
+        self.Socket.setsockopt(zmq.LINGER, 0)
+        self.Socket.connect(self.Address)
+
+    def Call(self, *args):
+    #returns the output text for the openaps alias/command line, like openaps would print it. raises IOError on
+    #failure, NoReply on timeout.
+
+        return self.Request(args, self.Timeout)
+
+    def Request(self, args, timeout):
+        if self.Socket is None:
+            self.Connect()
+        self.Socket.send(json.dumps({"args": list(args)}))
+        if not self.Socket.poll(timeout*1000):
+            self.Socket.close()
+            self.Socket = None
+            raise NoReply("No reply from pump worker for %s." % " ".join(args))
+        reply = json.loads(self.Socket.recv())
+        if not reply["ok"]:
+            raise IOError(reply["error"])
+        return reply["output"]
+
+    def Ping(self, timeout=PingTimeout):
+    #true if the worker answers within timeout seconds
+
+        try:
+            return self.Request(["ping"], timeout) == "pong"
+        except IOError:
+            return False
+
+    def Stop(self):
+        try:
+            self.Request(["stop"], 5)
+        except IOError:
+            pass
+
+def StartWorker(address=WorkerAddress, timeout=StartTimeout):
+#starts the worker as a child process of the control loop and returns (process, client).
+#raises IOError, with the process stopped again, if the worker does not answer a ping within timeout seconds.
+
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "-m", "bobs.pumpworker", address], cwd=os.getcwd(),
+                               env=dict(os.environ, PYTHONPATH=here))
+    client = PumpClient(address)
+    if not client.Ping(timeout):
+        StopWorker(process)
+        raise IOError("Pump worker did not answer within %i seconds (exit code %s)." % (timeout, process.returncode))
+    return (process, client)
+
+def StopWorker(process, timeout=5):
+#ends a worker process which may be stuck: SIGTERM, then SIGKILL if it has not gone after timeout seconds
+
+    if process.poll() is not None:
+        return process.returncode
+    try:
+        process.terminate()
+        for i in range(0, int(timeout*10)):
+            if process.poll() is not None:
+                return process.returncode
+            time.sleep(0.1)
+        process.kill()
+    except OSError:
+        pass
+    return process.wait()
+
+if __name__ == "__main__":
+    Serve(*sys.argv[1:2])
@@ -0,0 +1,169 @@
+#pulse-train sequencer for the pump remote.
+#
+#Bolus() and SuspendPump() used to press the remote buttons with GPIO.output() and a sleep() after each edge, so
+#every sleep's lateness added up over a long Easy Bolus count, and now and then a press was too short or too close to
+#the next one for the pump to notice. here a button sequence is first compiled into a waveform - a list of edges,
+#each at a fixed offset from the start - and then played on a dedicated thread which waits for each edge's deadline
+#on the monotonic clock. sleep lateness does not add up from edge to edge, and the lateness of every edge is measured.
+#a button is always held for its full time, though: when a press starts late, its release and every edge after it
+#are pushed back by as much, rather than cutting the press short.
+#
+#timings are in seconds. QuietTimings are the slower ones from the old copy of the loop in bobs-pancreas-noloop.py, which leave time for the
+#pump's vibration motor between presses.
+
+import threading
+import Queue
+from bobs import clock
+
+NormalTimings={"wake": 3.0,       #Act held down to wake the pump's remote receiver
+               "wakegap": 0.5,    #pause after waking, before the next button
+               "press": 0.2,      #Easy Bolus press
+               "gap": 0.2,        #pause between Easy Bolus presses
+               "button": 0.5,     #Suspend/Act press in a suspend/resume
+               "execute": 0.2,    #Act press which ends the Easy Bolus count
+               "countup": 2.0,    #wait while Easy Bolus counts the dose back for confirmation...
+               "countupper": 0.6, #...plus this much per tenth of a unit
+               "confirm": 0.5}    #Act press which confirms the bolus
+QuietTimings=dict(NormalTimings, gap=0.7, countupper=1.1)
+SpinMargin=0.002     #float (seconds before a deadline at which the player stops sleeping coarsely and closes in with short sleeps)
+
+class Waveform(object):
+#a compiled button sequence: edges as (offset from start, pin, level), in order
+
+    def __init__(self, name=""):
+        self.Name = name
+        self.Edges = []
+        self.Length = 0.0    #offset of the end of the sequence (after the last pause)
+
+    def Press(self, pin, hold, gap=0.0):
+    #one button press: pin goes high now, low after hold seconds, and the next button waits gap seconds more
+
+        self.Edges.append((self.Length, pin, 1))
+        self.Edges.append((self.Length + hold, pin, 0))
+        self.Length += hold + gap
+        return self
+
+    def Wait(self, seconds):
+        self.Length += seconds
+        return self
+
+    def Duration(self):
+        return self.Length
+
+def BolusWaveform(act, bolus, ticks, timings=NormalTimings):
+#Act to wake, ticks+1 Easy Bolus presses (needs one more than the number of tenths - found by testing),
+#Act to execute, wait for the count back, Act to confirm
+
+    wave = Waveform("bolus %i ticks" % ticks)
+    wave.Press(act, timings["wake"])
+    for tick in range(0, ticks+1):
+        wave.Press(bolus, timings["press"], timings["gap"])
+    wave.Press(act, timings["execute"], timings["countup"] + ticks*timings["countupper"])
+    wave.Press(act, timings["confirm"])
+    return wave
+
+def SuspendWaveform(act, suspend, timings=NormalTimings):
+#Act to wake, Suspend, Act to execute. the same sequence suspends and resumes.
+
+    wave = Waveform("suspend")
+    wave.Press(act, timings["wake"], timings["wakegap"])
+    wave.Press(suspend, timings["button"], timings["button"])
+    wave.Press(act, timings["button"])
+    return wave
+
+class PlayReport(object):
+#what happened when a waveform was played. Lateness holds how late each edge was, in seconds.
+
+    def __init__(self, wave):
+        self.Name = wave.Name
+        self.Edges = len(wave.Edges)
+        self.Lateness = []
+        self.Duration = 0.0
+        self.Shift = 0.0     #seconds the edges were pushed back to keep late presses held for their full time
+        self.Error = None
+
+    def MaxJitter(self):
+        return max(self.Lateness) if self.Lateness else 0.0
+
+    def MeanJitter(self):
+        return sum(self.Lateness) / len(self.Lateness) if self.Lateness else 0.0
+
+    def Summary(self):
+        return "%s: %i edges in %.1f s, jitter mean %.1f ms, max %.1f ms, pushed back %.1f ms." % (self.Name, self.Edges, self.Duration, self.MeanJitter()*1000, self.MaxJitter()*1000, self.Shift*1000)
+
+class Player(object):
+#plays waveforms on the GPIO pins, one at a time, on its own thread. Play() waits until the waveform is done.
+
+    def __init__(self, gpio):
+        self.GPIO = gpio
+        self.Queue = Queue.Queue()
+        self.Thread = None
+        self.Lock = threading.Lock()
+        self.Reports = []    #the last few reports, newest last
+
+    def Start(self):
+        with self.Lock:
+            if self.Thread is None:
+                self.Thread = threading.Thread(target=self._Run, name="RemotePlayer")
+                self.Thread.daemon = True
+                self.Thread.start()
+
+    def Play(self, wave):
+    #returns a PlayReport. raises IOError if a GPIO call failed (all pins are set low again first).
+
+        self.Start()
+        report = PlayReport(wave)
+        done = threading.Event()
+        self.Queue.put((wave, report, done))
+        done.wait()
+        self.Reports = (self.Reports + [report])[-20:]
+        if report.Error is not None:
+            raise IOError("Remote sequence %s failed: %s" % (wave.Name, report.Error))
+        return report
+
+    def WaitUntil(self, deadline):
+        while True:
+            remaining = deadline - clock.Monotonic()
+            if remaining <= 1e-6:    #close enough. a simulated clock at epoch scale cannot step any finer.
+                return
+            if remaining > 2*SpinMargin:
+                clock.Sleep(remaining - SpinMargin)
+            else:
+                clock.Sleep(min(remaining, 0.0005))
+
+    def Perform(self, wave, report):
+    #a release is due at its deadline or its hold time after the press actually started, whichever is later.
+    #when it is the latter, the edges after it are pushed back by as much (report.Shift).
+
+        start = clock.Monotonic()
+        rises = {}    #pin: (offset of its press, monotonic time it went high)
+        try:
+            for (offset, pin, level) in wave.Edges:
+                deadline = start + offset + report.Shift
+                if not level and pin in rises:
+                    (riseoffset, rose) = rises.pop(pin)
+                    held = rose + offset - riseoffset
+                    if held > deadline:
+                        report.Shift += held - deadline
+                        deadline = held
+                self.WaitUntil(deadline)
+                self.GPIO.output(pin, self.GPIO.HIGH if level else self.GPIO.LOW)
+                now = clock.Monotonic()
+                if level:
+                    rises[pin] = (offset, now)
+                report.Lateness.append(max(0.0, now - deadline))
+            self.WaitUntil(start + wave.Length + report.Shift)
+        except Exception as e:
+            report.Error = str(e)
+            for pin in set(edge[1] for edge in wave.Edges):
+                try:
+                    self.GPIO.output(pin, self.GPIO.LOW)
+                except:
+                    pass
+        report.Duration = clock.Monotonic() - start
+
+    def _Run(self):
+        while True:
+            (wave, report, done) = self.Queue.get()
+            self.Perform(wave, report)
+            done.set()
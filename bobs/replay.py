@@ -0,0 +1,515 @@
+#offline replay of the control loop over recorded data, without a pump, a remote or a Pi.
+#
+#the loop (bobs/pancreas.py) is imported as a fresh module for each run. its GPIO is set up with a fake remote which
+#decodes the button presses back into boluses and suspend/resume, openaps is replaced by a recorded pump which
+#answers from the Nightscout and monitor JSON files, and the loop runs on a simulated clock
+#(bobs/clock.py) so that the 15 second settle delays, bolus count-ups and WaitAWhile() waits cost nothing.
+#
+#glucose and IOB come from what actually happened (open loop): the replay shows what the current decision logic would
+#have done at each reading, not how glucose would have responded to it. with --closed, the pump answers instead with
+#glucose shifted by the insulin the replayed logic gave minus the insulin really given, and with the replayed boluses
+#in its history (see ClosedLoopPump) - a first-order guess at how glucose would have responded.
+#
+#usage: python -m bobs.replay [--start 2016-01-30T00:00:00] [--end ...] [--set AggressionFactorBase=1.4] [--full] [--closed] [--steps]
+
+import os
+import imp
+import json
+import time
+import types
+import shutil
+import tempfile
+import bisect
+import argparse
+import subprocess
+import numpy as np
+
+import bobs
+bobs.__path__[:] = [os.path.abspath(path) for path in bobs.__path__]    #run as "python -m bobs.replay" it is relative to the directory Run() leaves
+from bobs import clock
+from bobs import history
+from bobs import iob
+from bobs import schedules
+from bobs import lazy
+
+RepoDir=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CoreFile=os.path.join(RepoDir, "bobs", "pancreas.py")
+GlucoseFiles=["nightscout/glucosehistory.json", "monitor/glucose_history.json"]
+PumpHistoryFiles=["nightscout/pumphistory.json", "monitor/pump_history.json"]
+SettingsFiles=["max_iob.json", "error-codes.json", "settings/profile.json", "settings/insulin_sensitivities.json", "settings/bg_targets.json"]
+PollDelay=30          #int (seconds between a reading landing and the loop asking for it)
+EpisodeGap=3600       #int (seconds. readings further apart than this start a new episode of the closed loop replay)
+BasalChunk=300        #int (seconds. a suspend is counted as the basal it misses, in chunks of this length)
+
+class FakeRemote(object):
+#decodes GPIO edges from Bolus() and SuspendPump() back into pump actions, the way the pump would react to the remote
+
+    def __init__(self, pump, act, bolus, suspend):
+        self.Pump = pump
+        self.Pins = {act: "act", bolus: "bolus", suspend: "suspend"}
+        self.Levels = {}
+        self.Reset()
+
+    def Reset(self):
+        self.Pending = None
+        self.Presses = 0
+        self.Executed = False
+
+    def Edge(self, pin, level):
+        button = self.Pins.get(pin)
+        wasdown = self.Levels.get(pin, 0)
+        self.Levels[pin] = level
+        if button is None or not level or wasdown:
+            return      #only count presses, not releases
+
+        if button == "bolus":
+            self.Pending = "bolus"
+            self.Presses += 1
+        elif button == "suspend":
+            self.Pending = "suspend"
+        elif self.Pending == "suspend":
+            self.Pump.ToggleSuspend()
+            self.Reset()
+        elif self.Pending == "bolus" and not self.Executed:
+            self.Executed = True       #Easy Bolus counts up the dose for confirmation
+        elif self.Pending == "bolus":
+            self.Pump.Deliver((self.Presses - 1) / 10.0)    #Bolus() presses one more time than the number of tenths
+            self.Reset()
+        else:
+            self.Reset()               #wake-up press
+
+def FakeGPIOModule(remote):
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BOARD = 10
+    gpio.OUT = 0
+    gpio.LOW = 0
+    gpio.HIGH = 1
+    gpio.setmode = lambda mode: None
+    gpio.setwarnings = lambda flag: None
+    gpio.setup = lambda pin, mode: None
+    gpio.cleanup = lambda: None
+    gpio.output = lambda pin, level: remote[0].Edge(pin, level) if remote[0] is not None else None
+    return gpio
+
+def LoadJSON(datadir, names):
+    records = []
+    for name in names:
+        try:
+            with open(os.path.join(datadir, name)) as datafile:
+                records.extend(json.load(datafile))
+        except (IOError, ValueError):
+            pass
+    return records
+
+def LoadGlucose(datadir, files=GlucoseFiles):
+#recorded sensor readings as a sorted list of (epoch, record), one per reading time
+
+    readings = {}
+    for record in LoadJSON(datadir, files):
+        if record.get("name") == "GlucoseSensorData" and "sgv" in record:
+            readings[record["date"]] = record
+    return sorted((iob.ParseTimestamp(date), record) for (date, record) in readings.items())
+
+def LoadPumpHistory(datadir, files=PumpHistoryFiles):
+    records = {}
+    for record in LoadJSON(datadir, files):
+        if "timestamp" in record:
+            records[history.RecordKey(record)] = record
+    return sorted(records.values(), key=lambda r: r["timestamp"])
+
+class RecordedPump(object):
+#answers openaps commands from recorded data at the simulated time
+
+    def __init__(self, clock, glucose, pumphistory, reservoir=300.0):
+        self.Clock = clock
+        self.Glucose = glucose
+        self.GlucoseTimes = [t for (t, r) in glucose]
+        self.History = [(iob.ParseTimestamp(r["timestamp"]), r) for r in pumphistory]
+        self.Suspended = False
+        self.Reservoir = reservoir
+        self.Boluses = []        #(epoch, units) sent by the replayed logic
+        self.Suspends = []       #(epoch, True=suspended / False=resumed)
+        self.Calls = 0
+
+    def ToggleSuspend(self):
+        self.Suspended = not self.Suspended
+        self.Suspends.append((self.Clock.Now, self.Suspended))
+
+    def Deliver(self, units):
+        self.Reservoir -= units
+        self.Boluses.append((self.Clock.Now, units))
+
+    def Run(self, *args):
+        self.Calls += 1
+        now = self.Clock.Now
+        command = " ".join(args)
+        if command == "most-recent-reading":
+            i = bisect.bisect_right(self.GlucoseTimes, now)
+            return json.dumps([r for (t, r) in reversed(self.Glucose[max(0, i-6):i])])
+        if command == "get-status":
+            return json.dumps({"status": "normal", "bolusing": False, "suspended": self.Suspended})
+        if command == "get-reservoir":
+            return json.dumps(self.Reservoir)
+        if command.startswith("use pump iter_pump_hours"):
+            since = now - int(args[-1]) * 3600
+            return json.dumps([r for (t, r) in reversed(self.History) if since <= t <= now])
+        if command == "get-model":
+            return "\"754\""
+        return "{}"     #get-session, get-settings, monitor-pump: nothing to do offline
+
+def Absorbed(times, doses, dia, since=None):
+#units absorbed by each of times (epoch seconds) from doses [(epoch, units), ...].
+#with since (one epoch per time), only doses from then on count.
+
+    times = np.asarray(times, dtype=float)
+    if not doses or not len(times):
+        return np.zeros(len(times))
+    when = np.array([t for (t, u) in doses], dtype=float)
+    units = np.array([u for (t, u) in doses], dtype=float)
+    minago = (times[:, np.newaxis] - when) / 60.0
+    (remaining, activity) = iob.Curve(minago, units, dia)
+    counts = minago >= 0
+    if since is not None:
+        counts &= when >= np.asarray(since, dtype=float)[:, np.newaxis]
+    return np.where(counts, units - remaining, 0.0).sum(axis=1)
+
+def SuspendedIntervals(changes, end):
+#[(from, to), ...] from a list of (epoch, True=suspended / False=resumed). a suspend which is never resumed lasts until end.
+
+    intervals = []
+    since = None
+    for (t, suspended) in sorted(changes):
+        if suspended and since is None:
+            since = t
+        elif not suspended and since is not None:
+            intervals.append((since, t))
+            since = None
+    if since is not None and since < end:
+        intervals.append((since, end))
+    return intervals
+
+def MissedBasal(intervals, basal):
+#the basal a pump did not give while suspended, as doses [(epoch, -units), ...]. basal is a Schedule of units per hour.
+
+    doses = []
+    for (start, stop) in intervals:
+        for t in np.arange(start, stop, BasalChunk):
+            doses.append((float(t), -basal.At(t) * min(BasalChunk, stop - t) / 3600.0))
+    return doses
+
+def LoadSettings(datadir):
+#(DIA, insulin sensitivity Schedule, basal Schedule) from the settings files in datadir
+
+    def Load(name):
+        with open(os.path.join(datadir, name)) as settingsfile:
+            return json.load(settingsfile)
+    return (Load("settings/profile.json")["dia"], schedules.Sensitivities(Load("settings/insulin_sensitivities.json")), schedules.BasalRates(Load("settings/basal_profile.json")))
+
+class ClosedLoopPump(RecordedPump):
+#a RecordedPump which feels the replayed treatment. the readings are split into episodes wherever they are more than
+#EpisodeGap apart. within an episode, the recorded boluses are taken out of the pump history and the replayed ones
+#put in, and each reading is shifted by the insulin sensitivity times the difference in insulin absorbed since the
+#start of the episode: replayed boluses and missed basal, minus recorded boluses and missed basal.
+
+    def __init__(self, clock, glucose, pumphistory, settings, start=None, end=None):
+        RecordedPump.__init__(self, clock, glucose, pumphistory)
+        (self.DIA, self.Sensitivities, self.Basal) = settings
+        self.Window = [(t, r) for (t, r) in glucose if (start is None or t >= start) and (end is None or t < end)]
+        times = [t for (t, r) in self.Window]
+        self.EpisodeStarts = [t for (i, t) in enumerate(times) if i == 0 or t - times[i-1] > EpisodeGap]
+        self.EpisodeEnds = [t for (i, t) in enumerate(times) if i == len(times)-1 or times[i+1] - t > EpisodeGap]
+        self.End = times[-1] + PollDelay if times else 0.0
+
+        recordedboluses = []
+        changes = []
+        kept = []
+        for (t, record) in self.History:
+            inside = self.EpisodeStart(t) is not None
+            if record.get("_type") == "Bolus" and inside:
+                recordedboluses.extend((b[0], b[1]) for b in iob.Boluses([record]))
+                continue
+            if record.get("_type") in ("PumpSuspend", "PumpResume") and inside:
+                changes.append((t, record["_type"] == "PumpSuspend"))
+            kept.append((t, record))
+        self.History = kept
+        self.ReplayedKey = None
+        self.ReplayedDoses = []
+        self.Recorded = recordedboluses + MissedBasal(self.Clip(SuspendedIntervals(changes, self.End)), self.Basal)
+
+    def EpisodeStart(self, t):
+    #start of the episode t falls in (up to PollDelay after its last reading), or None
+
+        i = bisect.bisect_right(self.EpisodeStarts, t) - 1
+        if i < 0 or t > self.EpisodeEnds[i] + PollDelay:
+            return None
+        return self.EpisodeStarts[i]
+
+    def Clip(self, intervals):
+    #the parts of the intervals which fall inside an episode. a suspend over a gap in the data does not count.
+
+        clipped = []
+        for (start, stop) in intervals:
+            for (first, last) in zip(self.EpisodeStarts, self.EpisodeEnds):
+                (a, b) = (max(start, first), min(stop, last + PollDelay))
+                if a < b:
+                    clipped.append((a, b))
+        return clipped
+
+    def Deliver(self, units):
+        RecordedPump.Deliver(self, units)
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.Clock.Now))
+        self.History.append((self.Clock.Now, {"_type": "Bolus", "timestamp": stamp, "amount": units, "programmed": units, "_date": "replay"}))
+
+    def Replayed(self):
+    #the replayed boluses and missed basal. only worked out again after a bolus or a suspend/resume.
+
+        key = (len(self.Boluses), len(self.Suspends))
+        if self.ReplayedKey != key:
+            self.ReplayedDoses = self.Boluses + MissedBasal(self.Clip(SuspendedIntervals(self.Suspends, self.End)), self.Basal)
+            self.ReplayedKey = key
+        return self.ReplayedDoses
+
+    def Shift(self, times):
+    #mg/dl to add to the recorded glucose at each of times
+
+        times = np.asarray(times, dtype=float)
+        since = [self.EpisodeStart(t) for t in times]
+        since = np.array([t if s is None else s for (t, s) in zip(times, since)], dtype=float)
+        sensitivity = np.array([self.Sensitivities.At(t) for t in times], dtype=float)
+        return -sensitivity * (Absorbed(times, self.Replayed(), self.DIA, since) - Absorbed(times, self.Recorded, self.DIA, since))
+
+    def Simulated(self):
+    #(times, mg/dl) of every reading in the replay window, as the replayed treatment would have left them
+
+        times = np.array([t for (t, r) in self.Window], dtype=float)
+        values = np.array([r["sgv"] for (t, r) in self.Window], dtype=float)
+        return (times, np.clip(values + self.Shift(times), 39, 401))
+
+    def Run(self, *args):
+        output = RecordedPump.Run(self, *args)
+        if " ".join(args) == "most-recent-reading":
+            records = json.loads(output)
+            times = [iob.ParseTimestamp(r["date"]) for r in records]
+            for (record, shift) in zip(records, self.Shift(times)):
+                record["sgv"] = int(np.clip(round(record["sgv"] + shift), 39, 401))
+            output = json.dumps(records)
+        return output
+
+def LoadCore(gpio, name="bobs_pancreas_replay"):
+#loads bobs/pancreas.py as a fresh module (the loop keeps its state in module globals, so each run gets its own),
+#with gpio set up in place of RPi.GPIO
+
+    aps = imp.load_source(name, CoreFile)
+    lazy.Set(aps.GPIO, aps.SetupGPIO(gpio))
+    return aps
+
+class Replay(object):
+
+    def __init__(self, datadir=RepoDir, overrides=None, quiet=True, closed=False):
+        self.DataDir = os.path.abspath(datadir)
+        self.Overrides = overrides or {}
+        self.Quiet = quiet
+        self.Closed = closed
+        self.Glucose = LoadGlucose(self.DataDir)
+        self.PumpHistory = LoadPumpHistory(self.DataDir)
+        self.Settings = LoadSettings(self.DataDir) if closed else None
+
+    def Setup(self, scratch):
+        os.mkdir(os.path.join(scratch, "logs"))
+        os.mkdir(os.path.join(scratch, "monitor"))
+        os.mkdir(os.path.join(scratch, "settings"))
+        for name in SettingsFiles:
+            shutil.copy(os.path.join(self.DataDir, name), os.path.join(scratch, name))
+
+    def Run(self, start=None, end=None, full=False):
+    #replays the recorded readings between start and end (epoch seconds). returns a report dict.
+    #by default the decision logic runs once per reading. with full=True the real main loop (LoopOnce()) runs instead,
+    #including WaitAWhile()'s waits, until the simulated clock reaches the end.
+
+        readings = [(t, r) for (t, r) in self.Glucose if (start is None or t >= start) and (end is None or t < end)]
+        if not readings:
+            return Report([], None, 0.0, 0.0)
+
+        scratch = tempfile.mkdtemp(prefix="bobs-replay-")
+        cwd = os.getcwd()
+        simulated = clock.SimulatedClock(readings[0][0])
+        if self.Closed:
+            pump = ClosedLoopPump(simulated, self.Glucose, self.PumpHistory, self.Settings, start, end)
+        else:
+            pump = RecordedPump(simulated, self.Glucose, self.PumpHistory)
+        remote = [None]
+        real = clock.Use(simulated)
+        try:
+            self.Setup(scratch)
+            os.chdir(scratch)
+            aps = LoadCore(FakeGPIOModule(remote))
+            remote[0] = FakeRemote(pump, aps.RemoteAct, aps.RemoteBolus, aps.RemoteSuspend)
+            events = self.Prepare(aps, pump)
+            started = time.time()
+            if full:
+                steps = self.LoopFull(aps, simulated, pump, events, readings[-1][0] + PollDelay)
+            else:
+                steps = self.LoopReadings(aps, simulated, pump, events, readings)
+            wall = time.time() - started
+        finally:
+            clock.Use(real)
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+        return Report(steps, pump, simulated.Slept, wall)
+
+    def Prepare(self, aps, pump):
+    #swaps the loaded script's pump, shell and logging for offline ones. returns the list AppendLog() collects into.
+
+        aps.RunOpenaps = pump.Run
+        aps.PumpWorker = None
+        aps.UseHistorySync = True
+        aps.UseNativeIOB = True
+        aps.KeepAlive = True
+        aps.PumpHistory = history.HistoryStore()
+        aps.subprocess = RecordedShell()
+        aps.Power.Present = lambda: None    #no CareLink stick to look for: a USB wake waits the fixed USBWakeTime, as it used to
+        aps.UpdateNightscout = lambda: 1
+        aps.UseNightscoutOutbox = False
+        aps.ShutdownRestart = lambda: aps.AppendLog("ShutdownRestart()", 7000, "Reboot skipped in replay.")
+
+        events = []
+        def AppendLog(function, code, message=" "):
+            events.append((code, function, message.strip()))
+            if not self.Quiet:
+                print("%s %s %s %s" % (clock.Strftime("%Y-%m-%d %H:%M:%S"), code, function, message))
+            return 1
+        aps.AppendLog = AppendLog
+
+        aps.MaxIOB = aps.GetMaxIOB()
+        aps.CorrectionFactor = aps.GetCorrectionFactor(aps.CorrectionFactorFile)
+        aps.TargetGlucose = aps.GetTargetGlucose(aps.TargetGlucoseFile)
+        aps.DIA = aps.GetDIA()
+        for (name, value) in self.Overrides.items():
+            setattr(aps, name, value)
+        if aps.UsePrediction:
+            aps.ResetPrediction()
+        return events
+
+    def LoopReadings(self, aps, simulated, pump, events, readings):
+        steps = []
+        for (t, record) in readings:
+            simulated.AdvanceTo(t + PollDelay)
+            del events[:]
+            bolused = len(pump.Boluses)
+            aps.Snapshot.NewLoop()
+            aps.RefreshSettings()
+            step = {"time": t, "sgv": record["sgv"], "glucose": None, "iob": None, "units": None}
+            try:
+                aps.Glucose = aps.GetGlucose()
+                aps.IOB = aps.GetIOB()
+            except:
+                step["error"] = True
+            else:
+                step["glucose"] = aps.Glucose
+                step["iob"] = aps.IOB
+                step["units"] = aps.CalculateBolus(aps.Glucose)
+                aps.Bolus(step["units"])
+            steps.append(FinishStep(step, pump, bolused, events))
+        return steps
+
+    def LoopFull(self, aps, simulated, pump, events, end):
+        units = []
+        calculate = aps.CalculateBolus
+        def CalculateBolus(glucose):
+            units.append(calculate(glucose))
+            return units[-1]
+        aps.CalculateBolus = CalculateBolus
+
+        steps = []
+        while simulated.Now < end:
+            t = simulated.Now
+            del events[:]
+            del units[:]
+            bolused = len(pump.Boluses)
+            aps.Glucose = None
+            aps.IOB = None
+            aps.LoopOnce()
+            step = {"time": t, "sgv": None, "glucose": aps.Glucose, "iob": aps.IOB, "units": units[0] if units else None}
+            steps.append(FinishStep(step, pump, bolused, events))
+        return steps
+
+class RecordedShell(object):
+#stands in for the subprocess module inside the replayed script: nothing is run (no hub-ctrl, no reboot)
+
+    PIPE = subprocess.PIPE
+    STDOUT = subprocess.STDOUT
+    returncode = 0
+
+    def __init__(self):
+        self.Commands = []
+
+    def Popen(self, command, **kwargs):
+        self.Commands.append(command)
+        return self
+
+    def communicate(self):
+        return ("", None)
+
+def FinishStep(step, pump, bolused, events):
+    step["bolus"] = sum(u for (when, u) in pump.Boluses[bolused:])
+    step["suspended"] = pump.Suspended
+    step["codes"] = [code for (code, function, message) in events]
+    return step
+
+def Report(steps, pump, slept, wall):
+    report = {"loops": len(steps),
+              "wall_seconds": wall,
+              "loops_per_second": len(steps) / wall if wall > 0 else None,
+              "simulated_seconds": (steps[-1]["time"] - steps[0]["time"]) if steps else 0,
+              "slept_seconds": slept,
+              "steps": steps,
+              "boluses": pump.Boluses if pump else [],
+              "total_units": sum(u for (t, u) in pump.Boluses) if pump else 0.0,
+              "suspends": [t for (t, s) in pump.Suspends if s] if pump else [],
+              "resumes": [t for (t, s) in pump.Suspends if not s] if pump else [],
+              "pump_calls": pump.Calls if pump else 0}
+    if isinstance(pump, ClosedLoopPump):
+        (times, values) = pump.Simulated()
+        report["simulated"] = zip(times.tolist(), values.tolist())
+    return report
+
+def ParseTime(text):
+    return iob.ParseTimestamp(text) if text else None
+
+def ParseOverride(text):
+    (name, value) = text.split("=", 1)
+    try:
+        return (name, json.loads(value))
+    except ValueError:
+        return (name, value)
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded glucose and pump data through the BOBS decision logic.")
+    parser.add_argument("--data", default=RepoDir, help="directory holding nightscout/ and monitor/ (default: the repository)")
+    parser.add_argument("--start", help="first reading to replay, e.g. 2016-01-30T00:00:00")
+    parser.add_argument("--end", help="replay readings before this time")
+    parser.add_argument("--set", action="append", default=[], help="override a setting, e.g. --set AggressionFactorBase=1.4")
+    parser.add_argument("--full", action="store_true", help="run the real main loop, with its waits, instead of one decision per reading")
+    parser.add_argument("--closed", action="store_true", help="let glucose and IOB respond to the replayed boluses and suspends")
+    parser.add_argument("--steps", action="store_true", help="print every step")
+    parser.add_argument("--verbose", action="store_true", help="print the log lines as the loop writes them")
+    args = parser.parse_args(argv)
+
+    replay = Replay(args.data, dict(ParseOverride(o) for o in args.set), quiet=not args.verbose, closed=args.closed)
+    report = replay.Run(ParseTime(args.start), ParseTime(args.end), full=args.full)
+
+    if args.steps:
+        for step in report["steps"]:
+            print("%s sgv=%s iob=%s units=%s bolus=%.1f suspended=%s codes=%s" % (
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(step["time"])), step["sgv"], step["iob"],
+                step["units"], step["bolus"], step["suspended"], ",".join(str(c) for c in step["codes"])))
+    print("Loops: %i (%.1f simulated hours, %.0f s of sleeps skipped)" % (report["loops"], report["simulated_seconds"]/3600.0, report["slept_seconds"]))
+    print("Boluses: %i, %.1f units. Suspends: %i. Resumes: %i." % (len(report["boluses"]), report["total_units"], len(report["suspends"]), len(report["resumes"])))
+    if report.get("simulated"):
+        values = np.array([g for (t, g) in report["simulated"]])
+        print("Simulated glucose: mean %.0f, lowest %.0f, highest %.0f mg/dl. %.1f%% of readings 70-180." % (values.mean(), values.min(), values.max(), 100.0*np.mean((values >= 70) & (values <= 180))))
+    if report["loops_per_second"]:
+        print("Throughput: %.1f loops per second (%.2f s wall)." % (report["loops_per_second"], report["wall_seconds"]))
+
+if __name__ == "__main__":
+    Main()
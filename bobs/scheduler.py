@@ -0,0 +1,59 @@
+#sensor-arrival-aligned scheduling.
+#
+#the CGM sends a reading every 5 minutes, always at the same offset ("phase") within the 5 minute cycle. the pump
+#stamps each reading with the minute it arrived. SensorPhase learns the phase from those timestamps and tells
+#WaitAWhile() when the next reading is due, so USB can be woken and the pump polled just after it lands, instead of
+#after a fixed sleep which on average acts on glucose that is already minutes old.
+
+import math
+from collections import deque
+
+SensorPeriod=300     #int (seconds between CGM readings)
+PollMargin=75        #int (seconds after the expected reading to poll. the pump stamps readings to the minute, and the radio is a little late.)
+PhaseSamples=12      #int (readings used to estimate the phase. an hour's worth.)
+
+class SensorPhase(object):
+
+    def __init__(self, period=SensorPeriod, margin=PollMargin, samples=PhaseSamples):
+        self.Period = period
+        self.Margin = margin
+        self.Offsets = deque(maxlen=samples)
+        self.LastSeen = None     #epoch of the newest reading observed
+
+    def Observe(self, readingtime):
+    #records the timestamp (epoch seconds) of a reading. repeated timestamps are ignored.
+
+        if readingtime is None or readingtime == self.LastSeen:
+            return
+        if self.LastSeen is None or readingtime > self.LastSeen:
+            self.LastSeen = readingtime
+        self.Offsets.append(readingtime % self.Period)
+
+    def Ready(self):
+        return len(self.Offsets) > 0
+
+    def Phase(self):
+    #offset of the readings within the period, in seconds. a circular mean, so 4:59 and 0:01 average to 0:00.
+
+        if not self.Offsets:
+            return None
+        angles = [2 * math.pi * o / self.Period for o in self.Offsets]
+        angle = math.atan2(sum(math.sin(a) for a in angles), sum(math.cos(a) for a in angles))
+        return (angle * self.Period / (2 * math.pi)) % self.Period
+
+    def NextReading(self, now):
+    #expected time of the first reading not yet seen whose poll time is still ahead of now
+
+        phase = self.Phase()
+        after = now - self.Margin
+        if self.LastSeen is not None:
+            after = max(after, self.LastSeen + self.Period / 2.0)   #never wait for a reading we already have
+        due = math.floor((after - phase) / self.Period) * self.Period + phase
+        while due <= after:
+            due += self.Period
+        return due
+
+    def PollTime(self, now):
+    #when to ask the pump for the next reading
+
+        return self.NextReading(now) + self.Margin
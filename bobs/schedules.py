@@ -0,0 +1,135 @@
+#time-of-day schedules from the pump settings, reloaded when the files change.
+#
+#GetCorrectionFactor() and GetTargetGlucose() used to return the first entry of the schedule in the settings file, and
+#the settings were read once at startup: a pump with more than one insulin sensitivity or target during the day got
+#the midnight value all day, and a change to settings/*.json needed a restart. here each file becomes a Schedule - the
+#start of each segment in minutes after midnight, sorted, next to its value - and "the value now" is a bisect on the
+#minute of the day. a SettingsFile checks the file's mtime and size whenever it is asked for a value, and parses it
+#again only if they changed. a file which cannot be read or parsed (openaps rewriting it, say) leaves the last good
+#schedule in place; Error says what went wrong.
+#
+#single values (max_iob.json, the DIA in profile.json) are schedules with one segment, so they reload the same way.
+
+import os
+import json
+import time
+import bisect
+from bobs import clock
+
+class Schedule(object):
+
+    def __init__(self, starts, values):
+        pairs = sorted(zip(starts, values), key=lambda pair: pair[0])
+        if not pairs:
+            raise ValueError("Empty schedule.")
+        self.Starts = [start for (start, value) in pairs]    #minutes after midnight, ascending
+        self.Values = [value for (start, value) in pairs]
+
+    def __len__(self):
+        return len(self.Starts)
+
+    def Segment(self, minute):
+    #index of the segment in force at minute (after midnight). before the first start, the last segment of the day before.
+
+        return (bisect.bisect_right(self.Starts, minute) - 1) % len(self.Starts)
+
+    def At(self, t=None):
+    #the value in force at epoch time t (now by default), in local time like the pump
+
+        return self.Values[self.Segment(MinuteOfDay(t))]
+
+def MinuteOfDay(t=None):
+    local = time.localtime(clock.Time() if t is None else t)
+    return local.tm_hour*60 + local.tm_min
+
+def StartMinute(start):
+#"HH:MM:SS" to minutes after midnight
+
+    (hours, minutes, seconds) = start.split(":")
+    return int(hours)*60 + int(minutes)
+
+def FromEntries(entries, key):
+    return Schedule([StartMinute(entry["start"]) for entry in entries], [entry[key] for entry in entries])
+
+#parsers: the loaded JSON of each settings file to a Schedule
+
+def Sensitivities(data):     #settings/insulin_sensitivities.json, mg/dl per unit
+    return FromEntries(data["sensitivities"], "sensitivity")
+
+def Targets(data):           #settings/bg_targets.json, the "high" target in mg/dl
+    return FromEntries(data["targets"], "high")
+
+def BasalRates(data):        #settings/basal_profile.json, units per hour
+    return FromEntries(data, "rate")
+
+def CarbRatios(data):        #settings/carb_ratios.json, grams per unit
+    return FromEntries(data["schedule"], "ratio")
+
+def MaxIOB(data):            #max_iob.json
+    return Schedule([0], [data["max_iob"]])
+
+def DIA(data):               #settings/profile.json, hours
+    return Schedule([0], [data["dia"]])
+
+class SettingsFile(object):
+
+    def __init__(self, file, parse):
+        self.File = file
+        self.Parse = parse
+        self.Stamp = None        #(mtime, size) of the file when it was last parsed
+        self.Schedule = None
+        self.Loads = 0           #how many times the file has been parsed
+        self.Error = None        #why the last reload failed, or None
+        self.Last = None         #the value Value() returned last
+
+    def Check(self):
+    #parses the file again if it changed since the last time. returns True if it did.
+    #raises IOError if the file cannot be used and there is no earlier schedule to fall back on.
+
+        try:
+            info = os.stat(self.File)
+            stamp = (info.st_mtime, info.st_size)
+            if stamp == self.Stamp:
+                return False
+            with open(self.File) as settingsfile:
+                schedule = self.Parse(json.load(settingsfile))
+        except Exception as e:
+            self.Error = "%s: %s" % (self.File, e)
+            if self.Schedule is None:
+                raise IOError(self.Error)
+            return False
+        self.Stamp = stamp
+        self.Schedule = schedule
+        self.Loads += 1
+        self.Error = None
+        return True
+
+    def Value(self, t=None):
+        self.Check()
+        self.Last = self.Schedule.At(t)
+        return self.Last
+
+    def Changed(self, t=None):
+    #(True, value) if the value now differs from what Value() returned last - the file changed, or a new segment
+    #of the day started. (False, value) otherwise.
+
+        previous = self.Last
+        value = self.Value(t)
+        return (value != previous, value)
+
+class SettingsIndex(object):
+#one SettingsFile per path, so every caller shares the same parsed schedule
+
+    def __init__(self):
+        self.Files = {}
+
+    def Get(self, file, parse):
+        if file not in self.Files:
+            self.Files[file] = SettingsFile(file, parse)
+        return self.Files[file]
+
+    def Value(self, file, parse, t=None):
+        return self.Get(file, parse).Value(t)
+
+    def Changed(self, file, parse, t=None):
+        return self.Get(file, parse).Changed(t)
@@ -0,0 +1,144 @@
+#the loop's persistent state in one crash-safe file.
+#
+#the prediction state (lg4p, lcf4p, lpc4p) used to live in predict.json and the time of the last successful loop in
+#loopsuccess.txt, both rewritten in place every loop. a power cut in the middle of a write left a broken file, and
+#CalculateBolus() fell back to no prediction at all. LoopState keeps these, the last actuation and the newest glucose
+#readings in a fixed binary layout in a memory-mapped file, with two slots which are written in turn. each slot carries
+#a sequence number and a CRC, so after a crash the newest slot which is intact is used: at worst the last write is lost.
+#there is one write (Commit()) per loop, and reading needs no parsing beyond struct.unpack.
+#
+#layout: header "BOBS" + layout version, then two slots of: sequence (uint64), crc32 of the payload (uint32), payload.
+
+import os
+import json
+import mmap
+import zlib
+import struct
+
+StateFile="./state.bin"
+LayoutVersion=1
+HistoryLength=12     #int (newest glucose readings copied into the state, so the ring can be refilled if it is lost)
+Fields=[("loop", "Q", 0),            #name, struct code, default
+        ("lg4p", "d", 0.0),          #last glucose, for prediction
+        ("lcf4p", "d", 0.0),         #last correction factor, for prediction
+        ("lpc4p", "d", 0.0),         #last PredictionCorrection, for prediction
+        ("lastsuccess", "d", 0.0),   #epoch time of the last successful loop
+        ("actiontime", "d", 0.0),    #epoch time the last actuation was started (committed before the remote sequence)...
+        ("action", "i", 0),          #...what it was (see Actions)...
+        ("actionunits", "d", 0.0),   #...and the units, for a bolus
+        ("historytimes", "%id" % HistoryLength, None),
+        ("historyvalues", "%if" % HistoryLength, None)]
+Actions={"none": 0, "bolus": 1, "suspend": 2, "resume": 3}
+
+HeaderFormat="<4sI"
+SlotFormat="<QI"
+PayloadFormat="<" + "".join(code for (name, code, default) in Fields)
+
+def Defaults():
+    values = {}
+    for (name, code, default) in Fields:
+        values[name] = [0] * HistoryLength if default is None else default
+    return values
+
+def Pack(values):
+    flat = []
+    for (name, code, default) in Fields:
+        if default is None:
+            flat.extend(values[name])
+        else:
+            flat.append(values[name])
+    return struct.pack(PayloadFormat, *flat)
+
+def Unpack(payload):
+    flat = list(struct.unpack(PayloadFormat, payload))
+    values = {}
+    for (name, code, default) in Fields:
+        if default is None:
+            values[name] = flat[:HistoryLength]
+            flat = flat[HistoryLength:]
+        else:
+            values[name] = flat.pop(0)
+    return values
+
+class LoopState(object):
+
+    def __init__(self, file=StateFile):
+        self.File = file
+        self.HeaderSize = struct.calcsize(HeaderFormat)
+        self.SlotSize = struct.calcsize(SlotFormat) + struct.calcsize(PayloadFormat)
+        size = self.HeaderSize + 2*self.SlotSize
+        fresh = not os.path.exists(file) or os.path.getsize(file) != size
+        if fresh:
+            with open(file, "wb") as statefile:
+                statefile.write(struct.pack(HeaderFormat, "BOBS", LayoutVersion) + "\0" * (2*self.SlotSize))
+                statefile.flush()
+                os.fsync(statefile.fileno())
+        self.Handle = open(file, "r+b")
+        self.Map = mmap.mmap(self.Handle.fileno(), size)
+        (magic, version) = struct.unpack_from(HeaderFormat, self.Map, 0)
+        if magic != "BOBS" or version != LayoutVersion:
+            self.Map[0:size] = struct.pack(HeaderFormat, "BOBS", LayoutVersion) + "\0" * (2*self.SlotSize)
+            fresh = True
+        self.Fresh = fresh       #true if there was no usable state file (see Import())
+        (self.Sequence, slot, self.Values) = self.Newest()
+
+    def ReadSlot(self, slot):
+    #(sequence, values) of a slot, or (0, None) if it is empty or damaged
+
+        offset = self.HeaderSize + slot*self.SlotSize
+        (sequence, crc) = struct.unpack_from(SlotFormat, self.Map, offset)
+        payload = self.Map[offset + struct.calcsize(SlotFormat):offset + self.SlotSize]
+        if sequence == 0 or zlib.crc32(payload) & 0xffffffff != crc:
+            return (0, None)
+        return (sequence, Unpack(payload))
+
+    def Newest(self):
+        slots = [self.ReadSlot(0) + (0,), self.ReadSlot(1) + (1,)]
+        (sequence, values, slot) = max(slots, key=lambda s: s[0])
+        if values is None:
+            return (0, None, Defaults())
+        return (sequence, slot, values)
+
+    def Get(self, name):
+        return self.Values[name]
+
+    def Update(self, **values):
+    #changes values in memory. nothing is written until Commit().
+
+        for name in values:
+            if name not in self.Values:
+                raise KeyError("No such state field: %s" % name)
+        self.Values.update(values)
+
+    def Commit(self):
+    #writes the values into the older slot, then syncs. the newer slot stays intact until the next commit.
+
+        self.Sequence += 1
+        payload = Pack(self.Values)
+        offset = self.HeaderSize + (self.Sequence % 2)*self.SlotSize
+        self.Map[offset + struct.calcsize(SlotFormat):offset + self.SlotSize] = payload
+        struct.pack_into(SlotFormat, self.Map, offset, self.Sequence, zlib.crc32(payload) & 0xffffffff)
+        self.Map.flush()
+
+    def Import(self, predictfile, successfile):
+    #takes the values from the old predict.json and loopsuccess.txt, where they can still be read. returns what was imported.
+
+        imported = []
+        try:
+            with open(predictfile) as predict:
+                data = json.load(predict)
+            self.Update(lg4p=data["lg4p"], lcf4p=data["lcf4p"], lpc4p=data["lpc4p"])
+            imported.append(predictfile)
+        except:
+            pass
+        try:
+            with open(successfile) as success:
+                self.Update(lastsuccess=float(success.readline()))
+            imported.append(successfile)
+        except:
+            pass
+        return imported
+
+    def Close(self):
+        self.Map.close()
+        self.Handle.close()
@@ -0,0 +1,158 @@
+#concurrent work around the control loop.
+#
+#the loop used to run uptime, the Nightscout upload (with its 2 second reachability probe and the upload script) and
+#the UI update in line with the dosing decisions, so a slow network pushed back the next glucose read. now:
+#  - all pump I/O (openaps/worker calls and remote button sequences) goes through one SerialQueue, since the radio
+#    can only do one thing at a time, whichever thread asks.
+#  - the slow side jobs are Tasks on their own threads. they run every so often and/or when the loop kicks them, and
+#    the loop never waits for them. kicks which arrive while a task is busy are merged into one more run.
+#
+#python 2 has no asyncio, so these are plain threads. until Start() is called nothing runs in the background: calls
+#and kicks run in line in the caller's thread. the replay in bobs/replay.py relies on that with its simulated clock.
+
+import sys
+import threading
+import Queue
+from bobs import clock
+
+class SerialQueue(object):
+#runs calls one at a time, in the order they were submitted, on its own thread. Call() waits for the result.
+
+    def __init__(self, name="PumpQueue"):
+        self.Name = name
+        self.Queue = Queue.Queue()
+        self.Thread = None
+        self.Calls = 0
+        self.Waited = 0.0    #total seconds callers spent waiting for the queue and their call
+
+    def Start(self):
+        if self.Thread is None:
+            self.Thread = threading.Thread(target=self._Run, name=self.Name)
+            self.Thread.daemon = True
+            self.Thread.start()
+
+    def Stop(self):
+        if self.Thread is not None:
+            self.Queue.put(None)
+            self.Thread.join(10)
+            self.Thread = None
+
+    def Call(self, func, *args):
+    #returns func(*args), or raises whatever it raised. runs in line if the queue is not started,
+    #or if called from a job already running on the queue (e.g. GetStatus() inside a queued sequence).
+
+        if self.Thread is None or threading.current_thread() is self.Thread:
+            return func(*args)
+        start = clock.Monotonic()
+        box = {}
+        done = threading.Event()
+        self.Queue.put((func, args, box, done))
+        done.wait()
+        self.Calls += 1
+        self.Waited += clock.Monotonic() - start
+        if "error" in box:
+            raise box["error"][0], box["error"][1], box["error"][2]
+        return box["result"]
+
+    def _Run(self):
+        while True:
+            job = self.Queue.get()
+            if job is None:
+                break
+            (func, args, box, done) = job
+            try:
+                box["result"] = func(*args)
+            except:
+                box["error"] = sys.exc_info()
+            done.set()
+
+class Task(object):
+#one side job. runs every interval seconds (if given) and whenever Kick() is called.
+
+    def __init__(self, name, func, interval=None, onerror=None):
+        self.Name = name
+        self.Func = func
+        self.Interval = interval
+        self.OnError = onerror     #called with (name, exception) when func raises
+        self.Wake = threading.Event()
+        self.Thread = None
+        self.Stopping = False
+        self.Runs = 0
+        self.Errors = 0
+        self.LastDuration = None   #seconds the last run took
+
+    def Start(self):
+        if self.Thread is None:
+            self.Stopping = False
+            self.Thread = threading.Thread(target=self._Run, name=self.Name)
+            self.Thread.daemon = True
+            self.Thread.start()
+
+    def Stop(self):
+        if self.Thread is not None:
+            self.Stopping = True
+            self.Wake.set()
+            self.Thread.join(10)
+            self.Thread = None
+
+    def Kick(self):
+    #asks for a run as soon as possible. never waits, unless the task is not started, in which case it runs now.
+
+        if self.Thread is None:
+            self.RunOnce()
+        else:
+            self.Wake.set()
+
+    def RunOnce(self):
+        start = clock.Monotonic()
+        try:
+            self.Func()
+        except Exception as e:
+            self.Errors += 1
+            if self.OnError is not None:
+                self.OnError(self.Name, e)
+        self.Runs += 1
+        self.LastDuration = clock.Monotonic() - start
+
+    def _Run(self):
+        while not self.Stopping:
+            if self.Interval is not None:
+                self.RunOnce()
+            self.Wake.wait(self.Interval)    #real time, even when the loop runs on a simulated clock
+            self.Wake.clear()
+            if self.Stopping:
+                break
+            if self.Interval is None:
+                self.RunOnce()
+
+class TaskGroup(object):
+#the side jobs of the loop, by name
+
+    def __init__(self, onerror=None):
+        self.OnError = onerror
+        self.Tasks = {}
+        self.Running = False
+
+    def Add(self, name, func, interval=None):
+        self.Tasks[name] = Task(name, func, interval, self.OnError)
+        if self.Running:
+            self.Tasks[name].Start()
+        return self.Tasks[name]
+
+    def Kick(self, name):
+        self.Tasks[name].Kick()
+
+    def Start(self):
+        for task in self.Tasks.values():
+            task.Start()
+        self.Running = True
+
+    def Stop(self):
+        for task in self.Tasks.values():
+            task.Stop()
+        self.Running = False
+
+    def Stats(self):
+    #{name: (runs, errors, last duration)}
+
+        return dict((name, (task.Runs, task.Errors, task.LastDuration)) for (name, task) in self.Tasks.items())
@@ -0,0 +1,165 @@
+#parameter sweep for the gain scheduling settings, over the recorded data.
+#
+#AggressionFactorBase, AggressionFactorWidth and MealDetectReponseFactor used to be tuned by hand on a real person,
+#"by increments of 0.1, testing along the way". here each candidate set is run through the replay (bobs/replay.py,
+#one decision per reading), spread over a process pool with one worker per core, and the sets are ranked.
+#
+#the replay runs closed loop (replay.ClosedLoopPump): the recorded glucose is shifted by the insulin the set would have
+#given minus the insulin which was really given, and the set's own boluses count towards its IOB. this is a first-order
+#guess at what glucose would have been - good enough to compare settings with each other, not to trust one blindly.
+#
+#ranking is safety first: the least time below HypoLimit, then the most time in range, then the least insulin.
+#
+#usage: python -m bobs.tuner [--base 1.1:1.6:0.1] [--width 200:350:25] [--meal 0.5:1.5:0.25] [--random 500]
+#                            [--start ...] [--end ...] [--processes 4] [--top 10] [--out results.json]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+
+from bobs import replay
+
+Parameters=["AggressionFactorBase", "AggressionFactorWidth", "MealDetectReponseFactor"]
+DefaultRanges={"AggressionFactorBase": (1.1, 1.6, 0.1),
+               "AggressionFactorWidth": (200, 350, 25),
+               "MealDetectReponseFactor": (0.5, 1.5, 0.25)}
+RangeLow=70          #int (mg/dl, bottom of the target range)
+RangeHigh=180        #int (mg/dl, top of the target range)
+HypoLimit=70         #int (mg/dl, below this counts as hypo exposure)
+
+def Steps(low, high, step):
+#low, low+step, ... up to and including high
+
+    count = int(round((high - low) / float(step))) + 1
+    return [round(low + i*step, 6) for i in range(0, count)]
+
+def Grid(ranges):
+#every combination of the values in ranges ({name: [values]}), as a list of {name: value}
+
+    names = sorted(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*[ranges[name] for name in names])]
+
+def Sample(ranges, count, seed=None):
+#count random picks from the grid (all of it if it is smaller)
+
+    grid = Grid(ranges)
+    if count >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, count)
+
+def Score(report):
+#time in range, hypo exposure and insulin from a closed loop replay report
+
+    glucose = np.array([g for (t, g) in report.get("simulated", [])], dtype=float)
+    if not len(glucose):
+        return {"in_range": 0.0, "below": 0.0, "hypo_area": 0.0, "units": 0.0, "lowest": None, "mean": None}
+    return {"in_range": float(np.mean((glucose >= RangeLow) & (glucose <= RangeHigh))),    #fraction of readings
+            "below": float(np.mean(glucose < HypoLimit)),                                   #fraction of readings
+            "hypo_area": float(np.mean(np.clip(HypoLimit - glucose, 0, None))),             #mg/dl below HypoLimit, per reading
+            "units": float(report["total_units"]),
+            "lowest": float(glucose.min()),
+            "mean": float(glucose.mean())}
+
+def RankKey(result):
+    score = result["score"]
+    return (round(score["below"], 4), round(score["hypo_area"], 2), -round(score["in_range"], 4), score["units"])
+
+Worker=None     #(Replay, start, end) in each pool process, set up by InitWorker()
+
+def InitWorker(datadir, start, end):
+#loads the recorded data once per process. the replayed script prints as it starts up: that goes nowhere.
+
+    global Worker
+    sys.stdout = open(os.devnull, "w")
+    Worker = (replay.Replay(datadir, closed=True), start, end)
+
+def Evaluate(params):
+#one parameter set through the replay. returns {"params", "score", "boluses", "suspends", "seconds"}
+
+    (player, start, end) = Worker
+    started = time.time()
+    player.Overrides = dict(params)
+    report = player.Run(start, end)
+    return {"params": params,
+            "score": Score(report),
+            "boluses": len(report["boluses"]),
+            "suspends": len(report["suspends"]),
+            "seconds": time.time() - started}
+
+def Sweep(candidates, datadir=replay.RepoDir, start=None, end=None, processes=None, progress=None):
+#runs every candidate parameter set and returns the results, best first
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, InitWorker, (datadir, start, end))
+    results = []
+    try:
+        for result in pool.imap_unordered(Evaluate, candidates, max(1, len(candidates) // (processes*8))):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(candidates))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return sorted(results, key=RankKey)
+
+def ParseRange(text, default):
+#"1.1:1.6:0.1" (low:high:step) or "1.2,1.3,1.5" (a list). None gives the default range.
+
+    if text is None:
+        return Steps(*default)
+    if ":" in text:
+        return Steps(*[float(part) for part in text.split(":")])
+    return [float(part) for part in text.split(",")]
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank gain scheduling settings by replaying recorded glucose and pump data.")
+    parser.add_argument("--data", default=replay.RepoDir, help="directory holding nightscout/, monitor/ and settings/ (default: the repository)")
+    parser.add_argument("--start", help="first reading to replay, e.g. 2016-01-30T00:00:00")
+    parser.add_argument("--end", help="replay readings before this time")
+    parser.add_argument("--base", help="AggressionFactorBase values, low:high:step or a,b,c (default 1.1:1.6:0.1)")
+    parser.add_argument("--width", help="AggressionFactorWidth values (default 200:350:25)")
+    parser.add_argument("--meal", help="MealDetectReponseFactor values (default 0.5:1.5:0.25)")
+    parser.add_argument("--random", type=int, help="run this many random picks from the grid instead of all of it")
+    parser.add_argument("--seed", type=int, help="seed for --random")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--top", type=int, default=10, help="how many of the best sets to print")
+    parser.add_argument("--out", help="write all results, best first, to this JSON file")
+    args = parser.parse_args(argv)
+
+    ranges = {"AggressionFactorBase": ParseRange(args.base, DefaultRanges["AggressionFactorBase"]),
+              "AggressionFactorWidth": ParseRange(args.width, DefaultRanges["AggressionFactorWidth"]),
+              "MealDetectReponseFactor": ParseRange(args.meal, DefaultRanges["MealDetectReponseFactor"])}
+    candidates = Sample(ranges, args.random, args.seed) if args.random else Grid(ranges)
+
+    def Progress(done, total):
+        if done == total or done % 50 == 0:
+            sys.stderr.write("\r%i/%i" % (done, total))
+            if done == total:
+                sys.stderr.write("\n")
+
+    started = time.time()
+    results = Sweep(candidates, args.data, replay.ParseTime(args.start), replay.ParseTime(args.end), args.processes, Progress)
+    wall = time.time() - started
+
+    print("%i parameter sets in %.1f s (%.1f per second)." % (len(results), wall, len(results) / wall if wall > 0 else 0))
+    print("%-6s %-6s %-6s  %8s %8s %9s %7s %7s" % ("Base", "Width", "Meal", "InRange", "Below70", "HypoArea", "Units", "Lowest"))
+    for result in results[:args.top]:
+        params = result["params"]
+        score = result["score"]
+        print("%-6s %-6s %-6s  %7.1f%% %7.1f%% %9.2f %7.1f %7s" % (params["AggressionFactorBase"], params["AggressionFactorWidth"], params["MealDetectReponseFactor"],
+              score["in_range"]*100, score["below"]*100, score["hypo_area"], score["units"], "%.0f" % score["lowest"] if score["lowest"] is not None else "-"))
+    if args.out:
+        with open(args.out, "w") as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,143 @@
+#power state of the USB hub and Ethernet (port 2 of hub 0, switched with hub-ctrl).
+#
+#Preflight(), WaitAWhile(), the main loop's error path, the warm start and the watchdog each ran
+#"./hub-ctrl.c/hub-ctrl -h 0 -P 2 -p 0/1" on their own: nobody knew whether the ports were on, so they were switched
+#on when already on, and every wake was followed by a blind 10 second wait for the CareLink stick. here one
+#PowerManager owns the ports:
+# - it knows their state, and a transition to the state they are already in does nothing.
+# - a wake waits until the CareLink stick is back on the bus, not a fixed time, and remembers how long that took.
+#   Lead() is how early to wake before the next pump read so that the stick is just ready for it.
+# - it adds up the time spent on and off, and EnergySaved() turns the time off into watt-hours per day, to show what
+#   KeepAlive=False is worth.
+#
+#the manager does not run hub-ctrl itself: the loop gives it a function which does (so that the replay can stand in
+#for it), and one which says whether the stick is present (True/False, None if it cannot tell - then a wake waits
+#the old fixed time).
+
+import threading
+from bobs import clock
+from bobs import calibration
+
+OffCommand="./hub-ctrl.c/hub-ctrl -h 0 -P 2 -p 0"    #put USB and Ethernet to sleep
+OnCommand="./hub-ctrl.c/hub-ctrl -h 0 -P 2 -p 1"     #wake USB and Ethernet up
+BlindWait=10         #int (seconds waited after a wake when the stick cannot be seen. the old USBWakeTime)
+WakeTimeout=30       #int (seconds a wake waits for the stick before giving up)
+PollInterval=0.2     #float (seconds between looks for the stick)
+WakeMargin=1.0       #float (seconds added to the slowest recent wake, for Lead())
+KeepLatencies=20     #int (how many recent wake latencies Lead() looks at)
+PortWatts=0.8        #float (rough draw of the USB hub, Ethernet chip and CareLink stick while the ports are on. adjust for the board in use.)
+
+class PowerManager(object):
+
+    def __init__(self, run, present=None, blindwait=BlindWait, timeout=WakeTimeout, watts=PortWatts):
+        self.Run = run               #runs a command line. raises if it could not be run.
+        self.Present = present       #True if the CareLink stick is on the bus, False if not, None if it cannot tell
+        self.BlindWait = blindwait
+        self.Timeout = timeout
+        self.Watts = watts
+        self.Lock = threading.RLock()
+        self.On = None               #True/False, None until the first transition (the ports are in whatever state the last run left them)
+        self.Since = clock.Monotonic()
+        self.OnSeconds = 0.0
+        self.OffSeconds = 0.0
+        self.Transitions = 0
+        self.Skipped = 0             #transitions not made because the ports were already in that state
+        self.Latencies = []          #seconds from wake to stick ready, most recent last
+        self.Timeouts = 0
+
+    def Account(self, now=None):
+    #adds the time since the last call to the current state's total
+
+        if now is None:
+            now = clock.Monotonic()
+        if self.On is True:
+            self.OnSeconds += now - self.Since
+        elif self.On is False:
+            self.OffSeconds += now - self.Since
+        self.Since = now
+
+    def Switch(self, on):
+    #returns True if the ports were switched, False if they were already that way. raises if hub-ctrl could not be run.
+
+        with self.Lock:
+            if self.On == on:
+                self.Skipped += 1
+                return False
+            self.Account()
+            try:
+                self.Run(OnCommand if on else OffCommand)
+            except:
+                self.On = None    #no idea now. the next call will try again.
+                raise
+            self.On = on
+            self.Transitions += 1
+            return True
+
+    def Sleep(self):
+        return self.Switch(False)
+
+    def Wake(self, wait=True, timeout=None):
+    #switches the ports on and, with wait, waits until the stick is ready. returns the seconds waited (0 if the ports
+    #were already on). raises calibration.NotReady if the stick did not show up within timeout seconds.
+
+        with self.Lock:
+            started = clock.Monotonic()
+            if not self.Switch(True) or not wait:
+                return 0.0
+            if self.Present is None or self.Present() is None:
+                clock.Sleep(self.BlindWait)
+                return clock.Monotonic() - started
+
+            def Ready():
+                if not self.Present():
+                    raise IOError("CareLink stick not on the USB bus.")
+
+            try:
+                calibration.Poll(Ready, PollInterval, self.Timeout if timeout is None else timeout)
+            except calibration.NotReady:
+                self.Timeouts += 1
+                raise
+            seconds = clock.Monotonic() - started
+            self.Latencies = (self.Latencies + [seconds])[-KeepLatencies:]
+            return seconds
+
+    def Cycle(self, offtime, timeout=None):
+    #off, offtime seconds, on again and wait for the stick. returns the seconds waited for it.
+
+        with self.Lock:
+            self.Sleep()
+            clock.Sleep(offtime)
+            return self.Wake(True, timeout)
+
+    def Lead(self):
+    #seconds before a pump read to wake the ports: the slowest recent wake plus WakeMargin, or BlindWait before the
+    #first measured one
+
+        if not self.Latencies:
+            return float(self.BlindWait)
+        return max(self.Latencies) + WakeMargin
+
+    def EnergySaved(self):
+    #estimated watt-hours per day saved by switching the ports off, from the share of time they have been off
+
+        with self.Lock:
+            self.Account()
+            total = self.OnSeconds + self.OffSeconds
+            if total <= 0:
+                return 0.0
+            return self.Watts * 24 * self.OffSeconds / total
+
+    def Report(self):
+        with self.Lock:
+            saved = self.EnergySaved()
+            total = self.OnSeconds + self.OffSeconds
+            latencies = sorted(self.Latencies)
+            return {"on": self.On,
+                    "transitions": self.Transitions,
+                    "skipped": self.Skipped,
+                    "off_fraction": self.OffSeconds / total if total > 0 else 0.0,
+                    "wake_median": latencies[len(latencies)//2] if latencies else None,
+                    "wake_max": latencies[-1] if latencies else None,
+                    "wake_timeouts": self.Timeouts,
+                    "lead": self.Lead(),
+                    "wh_per_day": saved}
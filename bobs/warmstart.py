@@ -0,0 +1,112 @@
+#warm start after a crash or a reboot.
+#
+#a cold start power-cycles the USB hub, asks the pump for its model and downloads all its settings before the first
+#loop, and launch-bobs.sh waited a flat 60 seconds before even starting. after a crash-reboot none of that has changed.
+#at the end of each cold start a small snapshot is kept: the pump model, a fingerprint of the settings files and when
+#the settings were last downloaded. the next start is warm if the snapshot is there, the loop ran successfully not
+#long ago (the loop state in state.bin says when), and the settings files still match the fingerprint. a warm start
+#only waits until the CareLink stick shows up on USB, and downloads the settings again only if the pump history has
+#a settings change since the last download.
+
+import os
+import glob
+import json
+import hashlib
+from bobs import clock
+from bobs import calibration
+
+SnapshotFile="./warmstart.json"
+SettingsFiles=["./settings/insulin_sensitivities.json", "./settings/bg_targets.json", "./settings/basal_profile.json",
+               "./settings/carb_ratios.json", "./settings/profile.json", "./settings/settings.json", "./max_iob.json"]
+MaxAge=1800          #int (seconds. warm start only if the last successful loop was at most this long ago)
+StickVendor="0a21"   #str (USB vendor id of the Medtronic CareLink stick...)
+StickProduct="8001"  #str (...and its product id)
+USBDevices="/sys/bus/usb/devices"
+
+def Fingerprint(files=SettingsFiles):
+#sha1 over the names and contents of the settings files. a missing file counts too.
+
+    digest = hashlib.sha1()
+    for name in files:
+        digest.update(name + "\0")
+        try:
+            with open(name, "rb") as settingsfile:
+                digest.update(settingsfile.read())
+        except IOError:
+            digest.update("missing")
+        digest.update("\0")
+    return digest.hexdigest()
+
+def SettingsChange(record):
+#true for pump history records which change a setting the loop downloads (ChangeBasalProfile_new_profile,
+#ChangeBGTargetRange, ChangeInsulinSensitivity, SelectBasalProfile, ChangeTime, ...)
+
+    kind = record.get("_type") or ""
+    return kind.startswith("Change") or kind.startswith("Select")
+
+def StickPresent(devices=USBDevices):
+#true if the CareLink stick is on the USB bus. None if the bus cannot be looked at (no sysfs).
+
+    if not os.path.isdir(devices):
+        return None
+    for device in glob.glob(os.path.join(devices, "*")):
+        try:
+            with open(os.path.join(device, "idVendor")) as vendor:
+                with open(os.path.join(device, "idProduct")) as product:
+                    if vendor.read().strip() == StickVendor and product.read().strip() == StickProduct:
+                        return True
+        except IOError:
+            continue
+    return False
+
+def WaitForStick(timeout=60, interval=0.5, devices=USBDevices):
+#waits until the CareLink stick is on the bus. returns the seconds it took. raises calibration.NotReady after timeout.
+
+    def Ready():
+        if StickPresent(devices) is False:
+            raise IOError("CareLink stick not on the USB bus.")
+
+    (result, attempts, seconds) = calibration.Poll(Ready, interval, timeout)
+    return seconds
+
+class Snapshot(object):
+
+    def __init__(self, file=SnapshotFile):
+        self.File = file
+        try:
+            with open(file) as snapshotfile:
+                self.Data = json.load(snapshotfile)
+        except:
+            self.Data = None
+
+    def Get(self, name, default=None):
+        return default if self.Data is None else self.Data.get(name, default)
+
+    def Usable(self, lastsuccess, fingerprint, now=None, maxage=MaxAge):
+    #(True, why) if a warm start is safe, (False, why not) otherwise
+
+        if now is None:
+            now = clock.Time()
+        if self.Data is None:
+            return (False, "no snapshot in %s" % (self.File))
+        if lastsuccess <= 0 or now - lastsuccess > maxage:
+            return (False, "last successful loop was %s" % ("never" if lastsuccess <= 0 else "%i seconds ago" % (now - lastsuccess)))
+        if fingerprint != self.Get("fingerprint"):
+            return (False, "settings files changed since the snapshot")
+        return (True, "pump %s, last successful loop %i seconds ago" % (self.Get("model"), now - lastsuccess))
+
+    def Save(self, model, fingerprint, settingstime, loop=0):
+        self.Data = {"model": model, "fingerprint": fingerprint, "settings_time": settingstime, "saved": clock.Time(), "loop": loop}
+        temp = self.File + ".tmp"
+        with open(temp, "w") as snapshotfile:
+            json.dump(self.Data, snapshotfile, indent=2, sort_keys=True)
+        os.rename(temp, self.File)
+
+    def Forget(self):
+    #the next start will be cold
+
+        self.Data = None
+        try:
+            os.remove(self.File)
+        except OSError:
+            pass
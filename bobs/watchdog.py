@@ -0,0 +1,216 @@
+#in-process watchdog with staged recovery.
+#
+#CheckLastSuccess() used to reboot the Pi as soon as the last successful loop was more than 10 minutes old. a reboot
+#means the full boot, launch-bobs.sh and a cold start before the next dose, for what is usually one stuck radio or a
+#hung openaps call. here the loop beats a heartbeat at each stage (Beat()), saying how long the stage may take, and
+#a thread checks the heartbeats. when a stage overruns, or the loop reports that it keeps failing (Trip()), recovery
+#goes up one step at a time, and each step gets Grace seconds to bring a successful loop back before the next:
+#  1. restart the pump worker, and with it the pump session
+#  2. power-cycle USB and Ethernet with hub-ctrl
+#  3. restart the process (a warm start if it has not been too long, see bobs/warmstart.py)
+#  4. reboot
+#if the loop is still not back after the last step, recovery starts over from the first step, and each round waits
+#twice as long as the one before for its steps to work (up to MaxGrace), so that a loop which cannot be fixed this
+#way does not reboot the Pi every few minutes. a successful loop (Success()) starts again from the first step of the
+#first round.
+#
+#every step is recorded with how long it took to run and how long until the loop recovered or the next step was
+#needed, in ./watchdog.json so that the restart and reboot steps are completed by the process which comes after.
+#the steps themselves are functions of the loop: they return True once done, False if they do not apply (no pump
+#worker to restart, for instance), in which case the next step runs straight away.
+
+import os
+import json
+import threading
+from bobs import clock
+
+RecordFile="./watchdog.json"
+Interval=10          #int (seconds between checks of the heartbeat)
+Stall=300            #int (seconds a stage may take when it does not say. longer than a pump call's timeout)
+Grace=180            #int (seconds a recovery step is given to bring a successful loop back)
+MaxGrace=3600        #int (seconds. the longest Grace gets, after doubling each round)
+KeepRecords=100      #int (how many recovery steps are kept in RecordFile)
+
+class Watchdog(object):
+
+    def __init__(self, steps, log=None, file=RecordFile, interval=Interval, stall=Stall, grace=Grace, maxgrace=MaxGrace):
+        self.Steps = steps           #[(name, func)], mildest first
+        self.Log = log               #called with (code, message)
+        self.File = file
+        self.Interval = interval
+        self.StallTime = stall
+        self.Grace = grace
+        self.MaxGrace = max(grace, maxgrace)
+        self.Lock = threading.RLock()
+        self.Wake = threading.Event()
+        self.Thread = None
+        self.Stopping = False
+        self.Stage = "start"
+        self.Deadline = None         #monotonic time by which the next heartbeat is due
+        self.Problem = None          #why recovery is needed, None while the loop is healthy
+        self.Level = 0               #the next recovery step. len(Steps) once the last one has run: then the next round starts
+        self.Round = 0               #how many times recovery has started over from the first step
+        self.StepDone = None         #monotonic time the last recovery step finished
+        self.Records = self.Load()
+        pending = self.Pending()
+        if pending is not None:
+            #a restart or reboot which has not brought the loop back yet: carry on from the step after it
+            names = [name for (name, func) in steps]
+            if pending["step"] in names:
+                self.Level = names.index(pending["step"]) + 1
+                self.Round = pending.get("round", 0)
+                self.StepDone = clock.Monotonic()    #and give it its Grace from now
+
+    def Load(self):
+        try:
+            with open(self.File) as recordfile:
+                return json.load(recordfile)
+        except:
+            return []
+
+    def Save(self):
+        temp = self.File + ".tmp"
+        try:
+            with open(temp, "w") as recordfile:
+                json.dump(self.Records[-KeepRecords:], recordfile, indent=2, sort_keys=True)
+            os.rename(temp, self.File)
+        except (IOError, OSError):
+            pass
+
+    def Start(self):
+        if self.Thread is None:
+            self.Beat("start")
+            self.Stopping = False
+            self.Thread = threading.Thread(target=self._Run, name="Watchdog")
+            self.Thread.daemon = True
+            self.Thread.start()
+
+    def Stop(self):
+        if self.Thread is not None:
+            self.Stopping = True
+            self.Wake.set()
+            self.Thread.join(10)
+            self.Thread = None
+
+    def Beat(self, stage, allowance=None):
+    #the loop has reached stage, and will reach the next one within allowance seconds (Stall if not given)
+
+        with self.Lock:
+            self.Stage = stage
+            self.Deadline = clock.Monotonic() + (self.StallTime if allowance is None else allowance)
+
+    def Trip(self, why):
+    #the loop knows it is in trouble (e.g. no successful loop for too long). recovery starts at the next check.
+
+        with self.Lock:
+            if self.Problem is None:
+                self.Problem = why
+        self.Wake.set()
+
+    def Success(self):
+    #a successful loop. closes the open recovery record, if any, and starts again from the first step.
+
+        with self.Lock:
+            pending = self.Pending()
+            if pending is not None:
+                pending["result"] = "recovered"
+                pending["until"] = clock.Time()
+                self.Save()
+                if self.Log is not None:
+                    self.Log(6017, "Recovered %.0f seconds after step '%s'." % (pending["until"] - pending["time"], pending["step"]))
+            self.Problem = None
+            self.Level = 0
+            self.Round = 0
+            self.StepDone = None
+
+    def Wait(self):
+    #seconds the current round gives each step: Grace, doubled each round, up to MaxGrace
+
+        return min(self.Grace * 2 ** self.Round, self.MaxGrace)
+
+    def Pending(self):
+    #the last recovery record, if its outcome is not known yet (it can come from before a restart or reboot)
+
+        if self.Records and self.Records[-1].get("result") is None:
+            return self.Records[-1]
+        return None
+
+    def Check(self, now=None):
+    #runs the next recovery step if one is due. returns its name, or None.
+    #the lock is not held while a step runs, so the loop is never held up by its own recovery.
+
+        if now is None:
+            now = clock.Monotonic()
+        with self.Lock:
+            if self.Problem is None and self.Deadline is not None and now > self.Deadline:
+                self.Problem = "no heartbeat after stage '%s' for %.0f seconds" % (self.Stage, now - self.Deadline + self.StallTime)
+            if self.Problem is None:
+                return None
+            if self.StepDone is not None and now - self.StepDone < self.Wait():
+                return None
+        for attempt in range(len(self.Steps)):    #each step at most once per check, in case none of them applies
+            if self.Level >= len(self.Steps):
+                self.Level = 0
+                self.Round += 1
+                if self.Log is not None:
+                    self.Log(7000, "Recovery starts over from step '%s', round %i, %.0f seconds per step." % (self.Steps[0][0], self.Round + 1, self.Wait()))
+            (name, func) = self.Steps[self.Level]
+            self.Level += 1
+            if self.RunStep(name, func):
+                return name
+        return None
+
+    def RunStep(self, name, func):
+    #runs one recovery step and records it. false if it did not apply.
+
+        with self.Lock:
+            pending = self.Pending()
+            if pending is not None:
+                pending["result"] = "escalated"
+                pending["until"] = clock.Time()
+            record = {"step": name, "why": self.Problem, "time": clock.Time(), "seconds": None, "result": None, "until": None, "round": self.Round}
+            self.Records.append(record)
+            self.Save()    #before the step: a restart or reboot does not come back
+        if self.Log is not None:
+            self.Log(5094, "Step '%s': %s." % (name, record["why"]))
+        started = clock.Monotonic()
+        try:
+            done = func()
+            if not done and self.Log is not None:
+                self.Log(7000, "Step '%s' does not apply." % (name))
+        except Exception as e:
+            done = False
+            if self.Log is not None:
+                self.Log(7000, "Step '%s' failed: %s" % (name, e))
+        with self.Lock:
+            record["seconds"] = clock.Monotonic() - started
+            if not done:
+                self.Records.remove(record)
+                if pending is not None:
+                    pending["result"] = None
+                    pending["until"] = None
+                self.Save()
+                return False
+            self.StepDone = clock.Monotonic()
+            self.Deadline = self.StepDone + self.Wait()
+            self.Save()
+        if self.Log is not None:
+            self.Log(7000, "Step '%s' took %.1f seconds." % (name, record["seconds"]))
+        return True
+
+    def Summary(self):
+    #{step: (times run, seconds spent running it, times it brought the loop back)}
+
+        summary = {}
+        for record in self.Records:
+            (runs, seconds, recovered) = summary.get(record["step"], (0, 0.0, 0))
+            summary[record["step"]] = (runs + 1, seconds + (record["seconds"] or 0.0), recovered + (record["result"] == "recovered"))
+        return summary
+
+    def _Run(self):
+        while not self.Stopping:
+            self.Wake.wait(self.Interval)    #real time, even when the loop runs on a simulated clock
+            self.Wake.clear()
+            if self.Stopping:
+                break
+            self.Check()
@@ -1,4 +1,8 @@
-sleep 60
+#wait until the CareLink stick (USB id 0a21:8001) is on the bus, instead of a flat 60 seconds. go ahead anyway after 60.
+for i in $(seq 1 120); do
+    lsusb | grep -q "0a21:8001" && break
+    sleep 0.5
+done
 echo "Launching BOBS. Use screen -r to view."
 cd /home/pi/BOBS-Pancreas
 screen -dmS bash sudo python bobs-pancreas.py
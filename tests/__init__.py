@@ -0,0 +1,2 @@
+#unit tests for the bobs modules. run from the top of the repository with:
+#  python -m unittest discover -s tests -t .
@@ -0,0 +1,80 @@
+#the last actuation in the loop state (bobs/pancreas.py with bobs/statefile.py): it is on disk before the remote
+#sequence starts, so a crash in the middle of a bolus leaves the record behind, and the next start holds boluses for
+#ActuationHold seconds after a bolus the previous run started.
+
+import os
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import lazy
+from bobs import statefile
+from bobs import pancreas
+
+class Crash(Exception):
+    pass
+
+class CrashingRemote(object):
+#the process dies while the buttons are being pressed
+
+    def Play(self, waveform):
+        raise Crash()
+
+class ActuationTest(unittest.TestCase):
+
+    Patched = ("AppendLog", "State", "Remote", "GetStatus", "GetReservoir", "BolusHoldUntil")
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1454187797.0))
+        self.Dir = tempfile.mkdtemp()
+        self.File = os.path.join(self.Dir, "state.bin")
+        self.Saved = dict((name, getattr(pancreas, name)) for name in self.Patched)
+        self.Logged = []
+        pancreas.AppendLog = lambda function, code, message=" ": self.Logged.append(code)
+        pancreas.State = lazy.Lazy(lambda: statefile.LoopState(self.File))
+        pancreas.Remote = CrashingRemote()
+        pancreas.GetStatus = lambda: ("normal", False, False)
+        pancreas.GetReservoir = lambda: 100.0
+        pancreas.BolusHoldUntil = 0.0
+
+    def tearDown(self):
+        for (name, value) in self.Saved.items():
+            setattr(pancreas, name, value)
+        clock.Use(self.Real)
+        shutil.rmtree(self.Dir)
+
+    def Restart(self):
+    #what the next process finds in the state file
+
+        pancreas.State = lazy.Lazy(lambda: statefile.LoopState(self.File))
+        pancreas.BolusHoldUntil = 0.0
+
+    def testBolusIsRecordedBeforeTheRemoteSequence(self):
+        self.assertRaises(Crash, pancreas.Bolus, 0.5)
+        state = statefile.LoopState(self.File)
+        self.assertEqual((state.Get("action"), state.Get("actionunits"), state.Get("actiontime")), (statefile.Actions["bolus"], 0.5, clock.Time()))
+
+    def testRecentBolusHoldsTheNextRunsBoluses(self):
+        self.assertRaises(Crash, pancreas.Bolus, 0.5)
+        clock.Sleep(120)
+        self.Restart()
+        self.assertTrue(pancreas.CheckLastActuation())
+        self.assertEqual(pancreas.BolusHoldUntil, clock.Time() - 120 + pancreas.ActuationHold)
+        self.assertEqual(pancreas.Bolus(0.8), -1)
+        self.assertEqual(self.Logged[-2:], [5018, 5018])
+        clock.Sleep(pancreas.ActuationHold)
+        self.assertRaises(Crash, pancreas.Bolus, 0.8)    #held no longer: the remote is used again
+
+    def testOldBolusOrOtherActionsDoNotHold(self):
+        pancreas.RecordActuation("bolus", 0.5)
+        clock.Sleep(pancreas.ActuationHold + 1)
+        self.Restart()
+        self.assertFalse(pancreas.CheckLastActuation())
+        pancreas.RecordActuation("suspend")
+        self.Restart()
+        self.assertFalse(pancreas.CheckLastActuation())
+        self.assertEqual(pancreas.BolusHoldUntil, 0.0)
+        self.assertNotIn(5018, self.Logged)
+
+if __name__ == "__main__":
+    unittest.main()
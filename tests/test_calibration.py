@@ -0,0 +1,94 @@
+#bobs/calibration.py: readiness polling backs off and gives up on time, settle delays come from the slowest
+#measurement, and calibration stops at a toggle which did not take and always leaves the pump as it found it.
+
+import os
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import calibration
+
+class FakePump(object):
+#a pump which needs Busy seconds after a toggle before it answers. Ignore is the number of toggles it misses.
+
+    def __init__(self, suspended=False, busy=4.0, ignore=()):
+        self.Suspended = suspended
+        self.Busy = busy
+        self.Ignore = set(ignore)
+        self.Toggles = 0
+        self.AnswersFrom = 0.0
+
+    def Toggle(self):
+        if self.Toggles not in self.Ignore:
+            self.Suspended = not self.Suspended
+        self.Toggles += 1
+        self.AnswersFrom = clock.Monotonic() + self.Busy
+
+    def Ready(self):
+        if clock.Monotonic() < self.AnswersFrom:
+            raise IOError("no answer")
+
+    def State(self):
+        self.Ready()
+        return self.Suspended
+
+class CalibrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1000.0))
+        self.Dir = tempfile.mkdtemp()
+        self.Profile = calibration.TimingProfile("123456", os.path.join(self.Dir, "remote_timing.json"))
+
+    def tearDown(self):
+        clock.Use(self.Real)
+        shutil.rmtree(self.Dir)
+
+    def testPollBacksOffAndGivesUp(self):
+        pump = FakePump(busy=10.0)
+        pump.Toggle()
+        (result, attempts, seconds) = calibration.Poll(pump.Ready, 1.0, 60, 2.0, 2, 4.0)
+        self.assertEqual((attempts, seconds), (5, 13.0))    #at 2, 3, 5 and 9 seconds the pump is still busy, at 13 it answers
+        pump.Busy = 1000.0
+        pump.Toggle()
+        with self.assertRaises(calibration.NotReady) as caught:
+            calibration.Poll(pump.Ready, 1.0, 30)
+        self.assertEqual(caught.exception.Seconds, 30.0)
+
+    def testCalibrateMeasuresAndLeavesThePumpAsItWas(self):
+        pump = FakePump(busy=4.0)
+        measured = calibration.Calibrate(self.Profile, pump.Toggle, pump.Ready, pump.State, rounds=2)
+        self.assertEqual(sorted(measured), ["resume", "suspend"])
+        self.assertEqual(len(measured["suspend"]), 2)
+        self.assertFalse(pump.Suspended)
+        self.assertEqual(pump.Toggles, 4)
+        profile = calibration.TimingProfile("123456", self.Profile.File)
+        self.assertEqual(profile.Settle("suspend", 15), max(calibration.MinimumSettle, 4.0*calibration.MarginFactor + calibration.MarginSeconds))
+        self.assertEqual(profile.Settle("bolus", 15), 15)
+        profile.Widen("suspend")
+        self.assertEqual(profile.Settle("suspend", 15), 4.0*calibration.MarginFactor + 2*calibration.MarginSeconds)
+
+    def testToggleWhichDidNotTakeStopsCalibration(self):
+        pump = FakePump(suspended=True, ignore=[2])     #the second resume is missed
+        self.assertRaises(calibration.Mismatch, calibration.Calibrate, self.Profile, pump.Toggle, pump.Ready, pump.State, 3)
+        self.assertEqual(pump.Toggles, 3)     #resume, suspend, the missed resume, then nothing to put back
+        self.assertTrue(pump.Suspended)
+        self.assertFalse(os.path.exists(self.Profile.File))
+
+    def testPumpIsPutBackAfterAFailure(self):
+        pump = FakePump()
+        def Toggle():
+            pump.Toggle()
+            if pump.Toggles == 3:
+                raise IOError("GPIO failed")
+        self.assertRaises(IOError, calibration.Calibrate, self.Profile, Toggle, pump.Ready, pump.State, 3)
+        self.assertFalse(pump.Suspended)
+        self.assertEqual(pump.Toggles, 4)
+
+    def testPumpWhichCannotBePutBack(self):
+        pump = FakePump(ignore=range(1, 100))
+        self.assertRaises(calibration.Mismatch, calibration.Calibrate, self.Profile, pump.Toggle, pump.Ready, pump.State, 3)
+        self.assertTrue(pump.Suspended)
+        self.assertEqual(pump.Toggles, 2 + calibration.RestoreAttempts)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#bobs/clock.py: a simulated clock moves only when slept on, and Use() switches every caller over and back.
+
+import time
+import unittest
+from bobs import clock
+
+class ClockTest(unittest.TestCase):
+
+    def testSimulatedSleepMovesTimeOnly(self):
+        simulated = clock.SimulatedClock(1000.0)
+        real = clock.Use(simulated)
+        try:
+            started = time.time()
+            clock.Sleep(900)
+            clock.Sleep(-5)
+            self.assertTrue(time.time() - started < 1)
+            self.assertEqual(clock.Time(), 1900.0)
+            self.assertEqual(clock.Monotonic(), 1900.0)
+            self.assertEqual(simulated.Slept, 900.0)
+            simulated.AdvanceTo(1500.0)
+            self.assertEqual(clock.Time(), 1900.0)
+            self.assertEqual(clock.Strftime("%Y", 0), time.strftime("%Y", time.localtime(0)))
+        finally:
+            self.assertTrue(clock.Use(real) is simulated)
+        self.assertTrue(abs(clock.Time() - time.time()) < 1)
+
+    def testRealMonotonicIsFineGrained(self):
+        first = clock.Monotonic()
+        time.sleep(0.002)
+        elapsed = clock.Monotonic() - first
+        self.assertTrue(0.001 < elapsed < 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#bobs/decisionlog.py: records are found by code and day through the index, and records written after the index was
+#last saved (a power cut, or just fewer than IndexSaveInterval of them) are still found, and a half-written last line
+#is cut off before new records are appended.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from bobs import decisionlog
+
+Day1=1454187797.0     #2016-01-30, local time
+Day2=Day1 + 86400
+
+class StructuredLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.FileName = os.path.join(self.Dir, "20160130-APSlog.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def Write(self, log, code, now, loop=1, message="Gluc=156 TgtGluc=110 Mode=closed."):
+        log.Write(decisionlog.MakeRecord("CalculateBolus()", code, "", message, loop, now))
+
+    def testParseFields(self):
+        self.assertEqual(decisionlog.ParseFields("Gluc=156 IOB=1.30, Bolus=True Mode=closed."),
+                         {"Gluc": 156, "IOB": 1.3, "Bolus": True, "Mode": "closed"})
+
+    def testQueryByCodeAndDay(self):
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 7000, Day1)
+        self.Write(log, 6002, Day1 + 60)
+        self.Write(log, 7000, Day2)
+        log.Close()
+        self.assertEqual(len(decisionlog.Query(self.FileName, code=7000)), 2)
+        records = decisionlog.Query(self.FileName, code=7000, day=decisionlog.MakeRecord("", 0, "", "", 0, Day2)["day"])
+        self.assertEqual([r["t"] for r in records], [Day2])
+        self.assertEqual(records[0]["fields"]["Gluc"], 156)
+        self.assertEqual(len(decisionlog.Query(self.FileName, since=Day1 + 30, until=Day2)), 1)
+
+    def testIndexIsNotRewrittenOnEverySync(self):
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 6002, Day1)
+        log.Flush(True)
+        self.assertFalse(os.path.exists(decisionlog.IndexFile(self.FileName)))
+        for i in range(0, decisionlog.IndexSaveInterval):
+            self.Write(log, 7000, Day1 + i)
+        log.Flush(True)
+        self.assertTrue(os.path.exists(decisionlog.IndexFile(self.FileName)))
+        log.Close()
+
+    def testRecordsAfterTheSavedIndexAreFound(self):
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 7000, Day1, loop=1)
+        log.Close()
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 7000, Day1 + 59, loop=2)
+        self.Write(log, 6002, Day1 + 60, loop=2)
+        log.Flush(True)     #synced but the index not saved, as after a power cut
+        with open(self.FileName, "ab") as logfile:
+            logfile.write(b'{"t": 1')    #half-written last line
+        self.assertEqual([r["loop"] for r in decisionlog.Query(self.FileName, code=6002)], [2])
+        pairs = decisionlog.WithInputs(decisionlog.Query(self.FileName, code=6002))
+        self.assertEqual([r["loop"] for r in pairs[0][1]], [2])
+        self.assertEqual([r["loop"] for r in decisionlog.Query(self.FileName, code=7000)], [1, 2])
+        log.File.close()
+
+    def testAppendingAfterAHalfWrittenLine(self):
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 7000, Day1, loop=1)
+        log.Flush(True)
+        log.File.close()    #a crash: the index is not saved, and the last line is half written
+        with open(self.FileName, "ab") as logfile:
+            logfile.write(b'{"t": 1')
+        log = decisionlog.StructuredLog(self.FileName)
+        self.Write(log, 6002, Day1 + 60, loop=2)
+        self.Write(log, 7000, Day1 + 61, loop=2)
+        log.Close()
+        with open(self.FileName, "rb") as logfile:
+            self.assertEqual([json.loads(line)["loop"] for line in logfile], [1, 2, 2])
+        self.assertEqual([r["loop"] for r in decisionlog.Query(self.FileName, code=6002)], [2])
+        self.assertEqual([r["loop"] for r in decisionlog.Query(self.FileName, code=7000)], [1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
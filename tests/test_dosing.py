@@ -0,0 +1,119 @@
+#bobs/dosing.py: the array kernel makes the same decisions as the scalar rules of the old CalculateBolus(), one point
+#at a time or many at once, and the answer to a bolus over MaxIOB only matters when nothing else stops the bolus.
+
+import itertools
+import unittest
+import numpy as np
+from bobs import dosing
+
+def Reference(glucose, iob, target, maxiob, sensitivity, dia, lg4p, lcf4p, lpc4p, suspended, erratic, descending, confirm):
+#the old CalculateBolus(), without the I/O: returns (units, intent, reason)
+
+    s = dosing.Settings
+    if glucose < 0:
+        return (-1, dosing.Hold, 5005)
+    correction = glucose - target
+    aggression = s["AggressionFactorBase"] - float(correction) / s["AggressionFactorWidth"]
+    adjusted = abs(sensitivity * aggression * s["ExerciseFactor"])
+    if lg4p > 0 and lcf4p > 0:
+        current = (glucose - (lg4p - (iob * lcf4p / (dia * s["LoopsPerHour"])))) * s["MealDetectReponseFactor"]
+        prediction = (current + lpc4p) / 2 if current > 0 and lpc4p > 0 else current
+    else:
+        prediction = 0
+    units = float(correction + prediction) / adjusted - iob
+    if erratic:
+        return (-1, dosing.Hold, 5012)
+    intent = dosing.Hold
+    if ((units <= -0.5 and prediction <= 0) or correction <= 0) and not suspended:
+        return (units, dosing.Suspend, 6003)
+    elif units >= 0 and suspended:
+        intent = dosing.Resume
+    if glucose < target:
+        return (-1, intent, 5011)
+    if descending:
+        return (-1, intent, 5016)
+    if iob + units < maxiob:
+        return (units, intent, 6001)
+    if confirm == 1:
+        return (units, intent, 6000)
+    if confirm == 2:
+        return (maxiob - iob, intent, 5002)
+    return (-1, intent, 5001)
+
+Points=list(itertools.product([-1, 85, 100, 140, 220, 330],    #glucose
+                              [0.0, 1.5, 4.0],                 #iob
+                              [(0, 0, 0), (150, 40.0, 5.0), (90, 50.0, -3.0)],    #lg4p, lcf4p, lpc4p
+                              [False, True],                   #suspended
+                              [False, True],                   #erratic
+                              [False, True],                   #descending
+                              [0, 1, 2]))                      #confirm
+
+Target=100
+MaxIOB=3.0
+Sensitivity=40
+DIA=3
+
+class DosingTest(unittest.TestCase):
+
+    def Columns(self):
+        columns = list(zip(*Points))
+        (lg4p, lcf4p, lpc4p) = zip(*columns[2])
+        return (np.array(columns[0], dtype=float), np.array(columns[1]), np.array(lg4p, dtype=float), np.array(lcf4p), np.array(lpc4p),
+                np.array(columns[3]), np.array(columns[4]), np.array(columns[5]), np.array(columns[6]))
+
+    def Decide(self, glucose, iob, lg4p, lcf4p, lpc4p, suspended, erratic, descending, confirm):
+        correction = dosing.Correction(glucose, iob, Target, Sensitivity, DIA, lg4p, lcf4p, lpc4p)
+        return dosing.Decide(glucose, iob, Target, MaxIOB, correction, suspended, erratic, descending, confirm)
+
+    def testMatchesTheScalarRules(self):
+        for (glucose, iob, (lg4p, lcf4p, lpc4p), suspended, erratic, descending, confirm) in Points:
+            (units, intent, reason) = self.Decide(glucose, iob, lg4p, lcf4p, lpc4p, suspended, erratic, descending, confirm)
+            expected = Reference(glucose, iob, Target, MaxIOB, Sensitivity, DIA, lg4p, lcf4p, lpc4p, suspended, erratic, descending, confirm)
+            point = (glucose, iob, lg4p, suspended, erratic, descending, confirm)
+            self.assertEqual((int(intent), int(reason)), expected[1:], point)
+            self.assertAlmostEqual(float(units), expected[0], 9, point)
+
+    def testBatchEqualsOneAtATime(self):
+        columns = self.Columns()
+        (units, intent, reason) = self.Decide(*columns)
+        self.assertEqual(units.shape, (len(Points),))
+        for i in range(len(Points)):
+            (u, n, r) = self.Decide(*[column[i] for column in columns])
+            self.assertEqual((int(intent[i]), int(reason[i])), (int(n), int(r)))
+            self.assertAlmostEqual(units[i], float(u), 12)
+
+    def testEvaluateWorksOutTheSensorChecks(self):
+        history = np.array([[150, 135, 150], [150, 170, 150], [150, 160, 170], [150, 140, 130]], dtype=float)
+        (units, intent, reason, correction) = dosing.Evaluate(150, 0.0, history, True, False, Target, Sensitivity, MaxIOB, DIA)
+        self.assertEqual(list(reason), [5012, 5012, 5016, 6001])
+        (units, intent, reason, correction) = dosing.Evaluate(150, 0.0, history, [True, False, True, True], False, Target, Sensitivity, MaxIOB, DIA,
+                                                              rate=[0.0, 0.0, 0.0, -3.0])
+        self.assertEqual(list(reason), [5012, 5012, 5016, 5016])    #a gap does not excuse erratic readings, a falling trend holds the bolus
+
+    def testGapsAndTrendsOnlyAddToDescending(self):
+        pairs = np.array([[150, 160], [160, 150], [150, 150]], dtype=float)
+        plain = pairs[:, 0] < pairs[:, 1]
+        for consecutive in (True, False):
+            for rate in (None, np.nan, 0.0, -1.0, -2.5):
+                descending = dosing.Descending(pairs, consecutive, rate)
+                self.assertTrue((descending | ~plain).all())    #lower than the reading before is always descending
+        self.assertEqual(list(dosing.Descending(pairs)), [True, False, False])
+        self.assertEqual(list(dosing.Descending(pairs, False)), [True, True, True])
+        self.assertEqual(list(dosing.Descending(pairs, True, [0.0, -2.5, -1.0])), [True, True, False])
+
+    def testConfirmOnlyMattersOverMaxIOB(self):
+        columns = self.Columns()
+        unasked = self.Decide(*(columns[:-1] + (0,)))
+        for confirm in (1, 2):
+            answered = self.Decide(*(columns[:-1] + (confirm,)))
+            asked = unasked[2] == 5001
+            self.assertTrue(asked.any())
+            np.testing.assert_array_equal(answered[2][~asked], unasked[2][~asked])
+            np.testing.assert_array_equal(answered[0][~asked], unasked[0][~asked])
+            self.assertFalse((answered[2][asked] == 5001).any())
+        #the cases which are stopped before MaxIOB is looked at never come out as 5001, whatever the IOB
+        stopped = columns[6] | columns[7] | (columns[0] < Target) | (columns[0] < 0)
+        self.assertFalse((unasked[2][stopped] == 5001).any())
+
+if __name__ == "__main__":
+    unittest.main()
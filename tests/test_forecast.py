@@ -0,0 +1,69 @@
+#bobs/forecast.py: the insulin effect adds up to what the IOB says is still to come (within a couple of mg/dl: oref0's
+#IOB polynomial is not quite the integral of its activity curve), the deviation fades out, and the deviation is measured
+#net of the insulin.
+
+import time
+import unittest
+import numpy as np
+from bobs import iob
+from bobs import forecast
+
+Now=time.mktime((2016, 1, 30, 21, 0, 0, 0, 0, -1))
+
+def Engine(*boluses):
+#an IOBEngine (DIA 3) holding (minutes ago, units) boluses
+
+    engine = iob.IOBEngine(3)
+    engine.Add([{"_type": "Bolus", "amount": units, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(Now - minago*60))} for (minago, units) in boluses])
+    return engine
+
+class ForecastTest(unittest.TestCase):
+
+    def testInsulinEffectIsTheIOBTimesSensitivity(self):
+        engine = Engine((30, 1.0), (90, 0.5))
+        prediction = forecast.Forecast(engine, 150, 40, Now, horizon=180, step=5)
+        remaining = engine.Current(Now)["iob"]
+        self.assertEqual(len(prediction), 36)
+        self.assertAlmostEqual(prediction.Eventual(), 150 - 40*remaining, delta=2)
+        self.assertTrue((np.diff(prediction.Glucose) <= 1e-9).all())
+        self.assertEqual(prediction.Minimum()[0], prediction.Eventual())
+        self.assertEqual(prediction.Curve()[0], 150)
+        self.assertAlmostEqual(prediction.At(0), 150, 6)
+
+    def testForecastStartsAtTheTimeGiven(self):
+        engine = Engine((30, 1.0))
+        later = forecast.Forecast(engine, 150, 40, Now + 3600)
+        self.assertEqual(later.Start, Now + 3600)
+        self.assertAlmostEqual(later.Eventual(), 150 - 40*engine.Current(Now + 3600)["iob"], delta=2)
+
+    def testDeviationFadesOut(self):
+        prediction = forecast.Forecast(Engine(), 100, 40, Now, deviation=2.0, horizon=120, step=5, decay=60)
+        #2 mg/dl per minute fading linearly over an hour adds about 60 mg/dl, and nothing after the hour
+        self.assertAlmostEqual(prediction.At(120), 160, 0)
+        self.assertAlmostEqual(prediction.At(120), prediction.At(65), 6)
+
+    def testDeviationIsNetOfInsulin(self):
+        engine = Engine((60, 2.0))
+        times = Now - np.arange(30, -1, -5)*60.0
+        (i, activity) = engine.Evaluate(times)
+        #glucose which fell exactly as the insulin says it should has no deviation
+        expected = 150 - 40*np.concatenate(([0.0], np.cumsum((activity[:-1] + activity[1:]) / 2.0 * 5)))
+        readings = Readings(times, expected)
+        self.assertAlmostEqual(forecast.Deviation(engine, readings, 40, Now, 30), 0.0, 6)
+        readings = Readings(times, expected + np.arange(0, 7)*5)     #and 5 mg/dl more every 5 minutes is 1 mg/dl/min
+        self.assertAlmostEqual(forecast.Deviation(engine, readings, 40, Now, 30), 1.0, 6)
+        self.assertEqual(forecast.Deviation(engine, Readings(times[:1], expected[:1]), 40, Now, 30), 0.0)
+
+class Readings(object):
+#stands in for a GlucoseRing
+
+    def __init__(self, times, values):
+        self.Times = np.asarray(times, dtype=float)
+        self.Values = np.asarray(values, dtype=float)
+
+    def Since(self, t):
+        keep = self.Times >= t
+        return (self.Times[keep][::-1], self.Values[keep][::-1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#bobs/glucosering.py: readings wrap around the ring, survive reopening it, and gaps and rates of change are measured
+#from their times.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from bobs import glucosering
+
+Now=time.mktime((2016, 1, 30, 21, 0, 0, 0, 0, -1))
+
+class GlucoseRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.File = os.path.join(self.Dir, "ring.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def testEmptyRingLooksLikeTheOldDeque(self):
+        ring = glucosering.GlucoseRing(self.File, 4)
+        self.assertEqual([ring[i] for i in range(0, 4)], [0, 0, 0, 0])
+        self.assertEqual((len(ring), ring.Time(), ring.Age(Now), ring.RateOfChange()), (0, None, None, None))
+
+    def testWrapsAroundAndSurvivesReopening(self):
+        ring = glucosering.GlucoseRing(self.File, 4)
+        for i in range(0, 6):
+            self.assertTrue(ring.Append(Now + i*300, 100 + i))
+        self.assertFalse(ring.Append(Now, 99))     #older than the newest
+        ring.Flush()
+        ring = glucosering.GlucoseRing(self.File, 4)
+        self.assertEqual(len(ring), 4)
+        self.assertEqual([ring[i] for i in range(0, 5)], [105, 104, 103, 102, 0])
+        (times, values) = ring.Latest(2)
+        self.assertEqual((times.tolist(), values.tolist()), ([Now + 1500, Now + 1200], [105.0, 104.0]))
+        self.assertEqual(len(glucosering.GlucoseRing(self.File, 8)), 0)    #another capacity starts over
+
+    def testGapsAndRateOfChange(self):
+        ring = glucosering.GlucoseRing(self.File, 12)
+        for (minute, mgdl) in [(0, 100), (5, 110), (10, 120), (25, 150), (30, 160)]:
+            ring.Append(Now + minute*60, mgdl)
+        self.assertEqual(ring.Gap(0), 300)
+        self.assertEqual(ring.Gap(1), 900)
+        self.assertTrue(ring.Consecutive(2))
+        self.assertFalse(ring.Consecutive(3))
+        self.assertAlmostEqual(ring.RateOfChange(window=1800), 2.0, 6)
+        self.assertEqual(ring.Age(Now + 31*60), 60)
+
+    def testWarmLoad(self):
+        history = os.path.join(self.Dir, "glucose_history.json")
+        with open(history, "w") as historyfile:
+            json.dump([{"name": "GlucoseSensorData", "sgv": 120, "date": "2016-01-30T21:05:00"},
+                       {"name": "SensorSync", "date": "2016-01-30T21:04:00"},
+                       {"name": "GlucoseSensorData", "sgv": 118, "date": "2016-01-30T21:00:00"}], historyfile)
+        ring = glucosering.GlucoseRing(self.File, 12)
+        self.assertEqual(ring.WarmLoad(history), 2)
+        self.assertEqual(ring.WarmLoad(history), 0)
+        self.assertEqual((ring[0], ring[1], ring.Time()), (120, 118, Now + 300))
+
+if __name__ == "__main__":
+    unittest.main()
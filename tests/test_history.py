@@ -0,0 +1,89 @@
+#bobs/history.py and iob.PumpClock(): a sync only asks for the hours since the newest stored record, records are
+#stored once, and a stale pump clock file is not trusted.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from bobs import iob
+from bobs import history
+
+Now=time.mktime((2016, 1, 30, 21, 0, 0, 0, 0, -1))
+
+def Record(minago, kind="Bolus", **fields):
+    record = {"_type": kind, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(Now - minago*60))}
+    record.update(fields)
+    return record
+
+class FakePump(object):
+
+    def __init__(self, records):
+        self.Records = records
+        self.Asked = []
+
+    def __call__(self, *args):
+        self.Asked.append(args)
+        hours = int(args[-1])
+        return json.dumps([r for r in self.Records if iob.ParseTimestamp(r["timestamp"]) >= Now - hours*3600])
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.StoreFile = os.path.join(self.Dir, "pump_history.jsonl")
+        self.ExportFile = os.path.join(self.Dir, "pump_history.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def Store(self):
+        return history.HistoryStore(self.StoreFile, self.ExportFile)
+
+    def testSyncFetchesOnlyTheNewHours(self):
+        pump = FakePump([Record(600, amount=1.0), Record(30, amount=0.5), Record(10, "TempBasal", rate=0.0)])
+        store = self.Store()
+        self.assertEqual(len(store.Sync(pump, Now)), 3)
+        self.assertEqual(pump.Asked[-1][-1], str(history.FirstSyncHours))
+        self.assertEqual(store.Sync(pump, Now), [])
+        self.assertEqual(pump.Asked[-1][-1], str(1 + history.OverlapHours))
+        pump.Records.append(Record(2, amount=0.3))
+        self.assertEqual([r["amount"] for r in store.Sync(pump, Now)], [0.3])
+        with open(self.ExportFile) as exportfile:
+            self.assertEqual([r["timestamp"] for r in json.load(exportfile)], [Record(m)["timestamp"] for m in (2, 10, 30, 600)])
+
+    def testStoreIsReloadedAndSkipsAHalfWrittenLine(self):
+        store = self.Store()
+        store.Append([Record(30, amount=0.5), Record(60, amount=1.0), Record(60, amount=1.0)])
+        with open(self.StoreFile, "a") as storefile:
+            storefile.write('{"_type": "Bol')
+        store = self.Store()
+        self.assertEqual([r["amount"] for r in store.Records], [1.0, 0.5])
+        self.assertEqual(store.Newest, Now - 30*60)
+        self.assertEqual(len(store.Recent(45*60, Now)), 1)
+
+class PumpClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.ClockFile = os.path.join(self.Dir, "clock.json")
+        with open(self.ClockFile, "w") as clockfile:
+            json.dump("2016-01-30T21:00:00", clockfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def testFreshClockFileIsUsed(self):
+        self.assertEqual(iob.PumpClock(self.ClockFile), Now)
+
+    def testStaleClockFileIsNotUsed(self):
+        old = time.time() - iob.MaxClockAge - 60
+        os.utime(self.ClockFile, (old, old))
+        self.assertTrue(abs(iob.PumpClock(self.ClockFile) - time.time()) < 5)
+
+    def testMissingClockFileIsNotUsed(self):
+        self.assertTrue(abs(iob.PumpClock(os.path.join(self.Dir, "none.json")) - time.time()) < 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#bobs/iob.py: the curve matches oref0's at DIA=3 and stretches with the DIA, activity adds up to the bolus, and the
+#engine only counts each bolus once.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from bobs import iob
+
+Now=time.mktime((2016, 1, 30, 21, 0, 0, 0, 0, -1))
+
+def Bolus(minago, amount, now=Now):
+    return {"_type": "Bolus", "amount": amount, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now - minago*60)), "_date": str(minago)}
+
+class CurveTest(unittest.TestCase):
+
+    def testSameAsOref0AtDIA3(self):
+        #oref0/lib/iob/calculate.js for a 1 unit bolus, DIA=3
+        (i, a) = iob.Curve(np.array([0.0, 30.0, 60.0, 75.0, 120.0, 179.0, 180.0]), 1.0, 3)
+        self.assertTrue(np.allclose(i, [1.0, 0.922216, 0.711088, 0.555560, 0.174626, -0.000104, 0.0], atol=1e-6))
+        self.assertAlmostEqual(a[3], 2.0/180, 6)       #peak at 75 minutes
+        self.assertEqual(a[-1], 0.0)
+
+    def testActivityAddsUpToTheBolus(self):
+        for dia in (3, 4, 5):
+            minutes = np.arange(0.0, 60*dia + 1, 0.5)
+            (i, a) = iob.Curve(minutes, 2.0, dia)
+            self.assertAlmostEqual(np.trapz(a, minutes), 2.0, 2)
+            self.assertTrue((np.diff(i) < 1e-3).all())    #oref0's polynomial dips just below 0 near the end
+
+    def testCurveStretchesWithDIA(self):
+        (i3, a3) = iob.Curve(np.array([60.0]), 1.0, 3)
+        (i4, a4) = iob.Curve(np.array([80.0]), 1.0, 4)
+        self.assertAlmostEqual(i3[0], i4[0], 6)
+        self.assertAlmostEqual(a3[0], a4[0] * 4 / 3.0, 6)
+
+    def testFutureBolusDoesNotCount(self):
+        (i, a) = iob.Curve(np.array([-5.0]), 1.0, 3)
+        self.assertEqual((i[0], a[0]), (0.0, 0.0))
+
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def testSameAsCurveForSeveralBoluses(self):
+        engine = iob.IOBEngine(3)
+        history = [Bolus(30, 1.0), Bolus(90, 0.5), Bolus(200, 2.0), {"_type": "TempBasal", "timestamp": "2016-01-30T20:00:00"}]
+        self.assertEqual(engine.Add(history), 3)
+        self.assertEqual(engine.Add(history), 0)
+        current = engine.Current(Now)
+        (i, a) = iob.Curve(np.array([30.0, 90.0]), np.array([1.0, 0.5]), 3)
+        self.assertAlmostEqual(current["iob"], i.sum(), 6)
+        self.assertAlmostEqual(current["activity"], a.sum(), 6)
+        self.assertEqual(len(engine.Times), 2)     #the 200 minute old bolus was pruned
+        self.assertEqual(engine.Add(history), 0)   #and does not come back with the next download
+
+    def testRefreshOnlyRereadsAChangedFile(self):
+        historyfile = os.path.join(self.Dir, "pump_history.json")
+        with open(historyfile, "w") as f:
+            json.dump([Bolus(10, 1.0)], f)
+        engine = iob.IOBEngine(3)
+        self.assertEqual(engine.Refresh(historyfile), 1)
+        self.assertEqual(engine.Refresh(historyfile), 0)
+        with open(historyfile, "w") as f:
+            json.dump([Bolus(5, 0.3), Bolus(10, 1.0)], f)
+        self.assertEqual(engine.Refresh(historyfile), 1)
+
+if __name__ == "__main__":
+    unittest.main()
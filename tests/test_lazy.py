@@ -0,0 +1,78 @@
+#bobs/lazy.py: a Lazy calls its factory once, on first use and not before, from one thread only, and Set() puts an
+#object in place without calling the factory.
+
+import threading
+import time
+import unittest
+from bobs import lazy
+
+class LazyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Calls = 0
+
+    def Factory(self):
+        self.Calls += 1
+        return {"pins": [17, 27]}
+
+    def testCreatedOnFirstUseOnly(self):
+        thing = lazy.Lazy(self.Factory, "pins")
+        self.assertFalse(lazy.Created(thing))
+        self.assertEqual(repr(thing), "<not yet created: pins>")
+        self.assertEqual(self.Calls, 0)
+        self.assertEqual(len(thing), 1)
+        self.assertEqual(thing["pins"], [17, 27])
+        self.assertEqual(sorted(thing.keys()), ["pins"])
+        self.assertEqual(self.Calls, 1)
+        self.assertTrue(lazy.Created(thing))
+        self.assertIs(lazy.Get(thing), lazy.Get(thing))
+
+    def testAttributesGoToTheObject(self):
+        class Thing(object):
+            Level = 0
+        thing = lazy.Lazy(Thing)
+        thing.Level = 3
+        self.assertEqual(lazy.Get(thing).Level, 3)
+        self.assertEqual(thing.Level, 3)
+
+    def testSetSkipsTheFactory(self):
+        thing = lazy.Lazy(self.Factory)
+        standin = {"pins": []}
+        self.assertIs(lazy.Set(thing, standin), standin)
+        self.assertIs(lazy.Get(thing), standin)
+        self.assertEqual(repr(thing), repr(standin))
+        self.assertEqual(self.Calls, 0)
+
+    def testPlainObjectsPassThrough(self):
+        plain = [1, 2]
+        self.assertIs(lazy.Get(plain), plain)
+        self.assertTrue(lazy.Created(plain))
+
+    def testOneFactoryCallAcrossThreads(self):
+        def Slow():
+            time.sleep(0.05)
+            return self.Factory()
+        thing = lazy.Lazy(Slow)
+        got = []
+        threads = [threading.Thread(target=lambda: got.append(lazy.Get(thing))) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.Calls, 1)
+        self.assertTrue(all(item is got[0] for item in got))
+
+    def testFailedFactoryIsTriedAgain(self):
+        answers = [IOError("no /dev/gpiomem"), "ready"]
+        def Flaky():
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        thing = lazy.Lazy(Flaky)
+        self.assertRaises(IOError, lazy.Get, thing)
+        self.assertFalse(lazy.Created(thing))
+        self.assertEqual(lazy.Get(thing), "ready")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#bobs/logger.py: lines reach the file, synced lines are on disk before Append() returns, and a writer which cannot
+#write does not leave the loop waiting.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import StringIO
+from bobs import logger
+
+class BrokenFile(object):
+#stands in for the log file on a full SD card
+
+    def write(self, text):
+        raise IOError("No space left on device")
+
+    def flush(self):
+        pass
+
+    def fileno(self):
+        raise IOError("No space left on device")
+
+    def close(self):
+        pass
+
+class LogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.LogFile = os.path.join(self.Dir, "log.txt")
+        self.CodeFile = os.path.join(self.Dir, "codes.json")
+        with open(self.CodeFile, "w") as codefile:
+            json.dump({"6002": "Bolus sent:", "7000": "Information:"}, codefile)
+        self.Echo = StringIO.StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def Lines(self):
+        with open(self.LogFile) as logfile:
+            return logfile.read().splitlines()
+
+    def testSyncedLineIsWrittenBeforeAppendReturns(self):
+        writer = logger.LogWriter(self.LogFile, self.CodeFile, echo=self.Echo)
+        writer.Append("Bolus()", 6002, "0.5 units")
+        lines = self.Lines()
+        writer.Close()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("6002 Bolus() Bolus sent: 0.5 units"))
+        self.assertEqual(self.Echo.getvalue().splitlines(), lines)
+
+    def testQueuedLinesAreWrittenInOrderOnClose(self):
+        writer = logger.LogWriter(self.LogFile, self.CodeFile, echo=self.Echo)
+        for i in range(0, 200):
+            writer.Append("Loop()", 7000, str(i))
+        writer.Close()
+        writer.Close()
+        self.assertEqual([line.split()[-1] for line in self.Lines()], [str(i) for i in range(0, 200)])
+        self.assertEqual(writer.Append("Loop()", 7000, "late"), -1)
+
+    def testNeedsSync(self):
+        self.assertTrue(logger.NeedsSync(5000))
+        self.assertTrue(logger.NeedsSync("6003"))
+        self.assertTrue(logger.NeedsSync("not a code"))
+        self.assertFalse(logger.NeedsSync(7000))
+
+    def testWriteFailureDoesNotStopTheWriter(self):
+        writer = logger.LogWriter(self.LogFile, self.CodeFile, echo=self.Echo)
+        realfile = writer.File
+        writer.File = BrokenFile()
+        started = time.time()
+        self.assertEqual(writer.Append("Bolus()", 6002, "lost"), 1)
+        self.assertTrue(time.time() - started < logger.SyncTimeout / 2.0)    #told straight away, not after the timeout
+        self.assertTrue(writer.Thread.is_alive())
+        writer.File = realfile
+        writer.Append("Bolus()", 6002, "kept")
+        writer.Close()
+        self.assertEqual([line.split()[-1] for line in self.Lines()], ["kept"])
+
+    def testAppendRacingCloseDoesNotWait(self):
+        results = []
+        for attempt in range(0, 20):
+            writer = logger.LogWriter(self.LogFile, self.CodeFile, echo=self.Echo)
+            appender = threading.Thread(target=lambda: results.append(writer.Append("Bolus()", 6002, "race")))
+            started = time.time()
+            appender.start()
+            writer.Close()
+            appender.join()
+            self.assertTrue(time.time() - started < logger.SyncTimeout / 2.0)
+        self.assertEqual(len(self.Lines()), results.count(1))    #every line taken before the close was written
+
+if __name__ == "__main__":
+    unittest.main()
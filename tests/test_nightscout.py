@@ -0,0 +1,257 @@
+#bobs/nightscout.py against a stand-in Nightscout on localhost: the outbox uploads in order, keeps what failed, is cut
+#back when it grows too big, and the host and secret come from nightscout.ini - without one nothing is queued or
+#sent anywhere. downloads fetch only what is new, without missing records stamped the same time as the high-water
+#mark or a page boundary, and a reply which is not a list of records leaves the local copies alone.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from bobs import nightscout
+from bobs import pancreas
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+#a Nightscout site which keeps what is posted to it. a thread per connection, so that a client which reconnects is
+#not left waiting behind its own kept-alive connection.
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.Posted = {}          #collection: [records]
+        self.Secrets = []
+        self.FailNext = 0         #POSTs to answer with a 500
+        self.Feeds = {"entries": [], "treatments": []}    #records served, any order. anything else is sent as it is.
+        self.Profile = {"units": "mg/dl"}
+        self.Queries = []
+        self.Thread = threading.Thread(target=self.serve_forever)
+        self.Thread.daemon = True
+        self.Thread.start()
+
+    def Host(self):
+        return "http://127.0.0.1:%i" % self.server_address[1]
+
+    def Stop(self):
+        self.shutdown()
+        self.server_close()
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"    #kept-alive connections, like the real site
+
+    def log_message(self, format, *args):
+        pass
+
+    def Reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = dict((k, v[0]) for (k, v) in urlparse.parse_qs(url.query).items())
+        self.server.Queries.append((url.path, query))
+        if url.path == nightscout.ProfilePath:
+            etag = '"%s"' % hashlib.sha1(json.dumps(self.server.Profile, sort_keys=True)).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps(self.server.Profile)
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        feed = url.path.split("/")[-1].split(".")[0]
+        field = nightscout.Feeds[feed][2]
+        compare = {"$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b, "$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b}
+        records = self.server.Feeds[feed]
+        if isinstance(records, str):
+            self.Reply(200, records)    #an error page, or whatever else a site which is not Nightscout sends
+            return
+        if not isinstance(records, list):
+            self.Reply(200, json.dumps(records))
+            return
+        for (key, value) in query.items():
+            if key.startswith("find["):
+                operator = key.split("[")[2].rstrip("]")
+                value = int(value) if field == "date" else value
+                records = [r for r in records if compare[operator](r[field], value)]
+        records = sorted(records, key=lambda r: r[field], reverse=True)[:int(query.get("count", 10))]
+        self.Reply(200, json.dumps(records))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.Secrets.append(self.headers.get("API-SECRET"))
+        if self.server.FailNext > 0:
+            self.server.FailNext -= 1
+            self.Reply(500, "{}")
+            return
+        collection = self.path.split("/")[-1].split(".")[0]
+        self.server.Posted.setdefault(collection, []).extend(body)
+        self.Reply(200, json.dumps(body))
+
+class NightscoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.Server = StandIn()
+
+    def tearDown(self):
+        self.Server.Stop()
+        shutil.rmtree(self.Dir)
+
+    def Uploader(self, **outboxargs):
+        outbox = nightscout.Outbox(os.path.join(self.Dir, "outbox"), **outboxargs)
+        return nightscout.Uploader(outbox, nightscout.Connection(self.Server.Host(), "secret"), batchsize=3)
+
+    def testOutboxIsUploadedInOrder(self):
+        uploader = self.Uploader()
+        uploader.Outbox.Put("entries", *[nightscout.Entry(100 + i, 1454187797 + i*300) for i in range(0, 7)])
+        uploader.Outbox.Put("treatments", nightscout.Treatment("Note", 1454187797, notes="Pump suspended."))
+        self.assertEqual(uploader.Outbox.Pending("entries"), 7)
+        self.assertEqual(uploader.Drain(), 8)
+        self.assertEqual([r["sgv"] for r in self.Server.Posted["entries"]], range(100, 107))
+        self.assertEqual(self.Server.Posted["treatments"][0]["notes"], "Pump suspended.")
+        self.assertEqual(set(self.Server.Secrets), set([hashlib.sha1("secret").hexdigest()]))
+        self.assertEqual(uploader.Outbox.Pending("entries"), 0)
+        self.assertEqual(os.path.getsize(uploader.Outbox.File("entries")), 0)
+        self.assertEqual(uploader.Connection.Requests, 4)
+
+    def testFailedUploadIsKeptAndRetried(self):
+        uploader = self.Uploader()
+        uploader.Outbox.Put("entries", *[nightscout.Entry(100 + i, 1454187797 + i*300) for i in range(0, 5)])
+        self.Server.FailNext = 1
+        self.assertEqual(uploader.Drain(now=1000), -1)
+        self.assertTrue(uploader.Waiting(1000 + nightscout.BackoffStart - 1))
+        self.assertEqual(uploader.Drain(now=1001), 0)
+        uploader.Outbox = nightscout.Outbox(uploader.Outbox.Dir)    #and it survives a restart
+        self.assertEqual(uploader.Drain(now=1000 + nightscout.BackoffStart), 5)
+        self.assertEqual([r["sgv"] for r in self.Server.Posted["entries"]], range(100, 105))
+
+    def testHalfWrittenLineIsSkipped(self):
+        uploader = self.Uploader()
+        uploader.Outbox.Put("entries", nightscout.Entry(100, 1454187797))
+        with open(uploader.Outbox.File("entries"), "a") as outfile:
+            outfile.write('{"sgv": 1')
+        self.assertEqual(uploader.Drain(), 1)
+        uploader.Outbox.Put("entries", nightscout.Entry(101, 1454188097))     #completes the mangled line
+        uploader.Outbox.Put("entries", nightscout.Entry(102, 1454188397))
+        self.assertEqual(uploader.Drain(), 1)
+        self.assertEqual([r["sgv"] for r in self.Server.Posted["entries"]], [100, 102])
+
+    def testFullOutboxKeepsTheNewestRecords(self):
+        uploader = self.Uploader(maxbytes=2000)
+        dropped = 0
+        for i in range(0, 40):
+            dropped += uploader.Outbox.Put("entries", nightscout.Entry(100 + i, 1454187797 + i*300))
+        self.assertTrue(dropped > 0)
+        self.assertEqual(dropped, uploader.Outbox.Dropped)
+        self.assertTrue(os.path.getsize(uploader.Outbox.File("entries")) <= 2000)
+        self.assertEqual(uploader.Drain(), 40 - dropped)
+        self.assertEqual([r["sgv"] for r in self.Server.Posted["entries"]], range(100 + dropped, 140))
+
+    def Downloader(self):
+        return nightscout.Downloader(nightscout.Connection(self.Server.Host(), "secret"), self.Dir, os.path.join(self.Dir, "download.json"))
+
+    def testDownloadFetchesOnlyWhatIsNew(self):
+        self.Server.Feeds["entries"] = [dict(nightscout.Entry(100 + i, 1454187797 + i*300), _id="e%i" % i) for i in range(0, 5)]
+        self.Server.Feeds["treatments"] = [dict(nightscout.Treatment("Note", 1454187797), _id="t0")]
+        self.assertEqual(self.Downloader().RefreshAll(), {"entries": 5, "treatments": 1, "profile": True})
+        downloader = self.Downloader()
+        self.assertEqual(downloader.RefreshAll(), {"entries": 0, "treatments": 0, "profile": False})
+        self.assertTrue(downloader.Transferred < 1000)
+        self.Server.Feeds["entries"].append(dict(nightscout.Entry(110, 1454187797 + 5*300), _id="e5"))
+        self.Server.Profile = {"units": "mmol"}
+        self.assertEqual(downloader.RefreshAll(), {"entries": 1, "treatments": 0, "profile": True})
+        self.assertEqual([r["sgv"] for r in downloader.Load("nsglucosehistory")], [110, 104, 103, 102, 101, 100])
+        self.assertEqual(downloader.Load(nightscout.ProfileFile), {"units": "mmol"})
+
+    def testRecordAtTheHighWaterMarkIsNotMissed(self):
+        t = 1454187797
+        self.Server.Feeds["entries"] = [dict(nightscout.Entry(100, t), _id="a")]
+        downloader = self.Downloader()
+        self.assertEqual(downloader.Refresh("entries"), 1)
+        self.Server.Feeds["entries"].append(dict(nightscout.Entry(101, t), _id="b"))    #uploaded late, same second
+        self.assertEqual(downloader.Refresh("entries"), 1)
+        self.assertEqual(downloader.Refresh("entries"), 0)
+        self.assertEqual(sorted(r["_id"] for r in downloader.Load("nsglucosehistory")), ["a", "b"])
+
+    def testRecordsOnAPageBoundaryAreNotMissed(self):
+        page = nightscout.PageSize
+        nightscout.PageSize = 4
+        try:
+            #two records in the same second, split across the first and second page
+            times = [1454187797 + i*300 for i in range(0, 6)]
+            times.insert(3, times[2])
+            self.Server.Feeds["entries"] = [dict(nightscout.Entry(100 + i, t), _id="e%i" % i) for (i, t) in enumerate(times)]
+            downloader = self.Downloader()
+            self.assertEqual(downloader.Refresh("entries"), 7)
+            self.assertEqual(len(downloader.Load("nsglucosehistory")), 7)
+            self.assertTrue(len([q for (path, q) in self.Server.Queries if "find[date][$lte]" in q]) >= 1)
+        finally:
+            nightscout.PageSize = page
+
+    def testRepliesWhichAreNotRecordsAreRefused(self):
+        self.Server.Feeds["entries"] = [dict(nightscout.Entry(100, 1454187797), _id="a")]
+        self.Downloader().RefreshAll()
+        with open(os.path.join(self.Dir, "nsglucosehistory")) as cachefile:
+            before = cachefile.read()
+        for reply in ({"status": 401, "message": "Unauthorized"}, [{"no": "time"}], "<html>"):
+            self.Server.Feeds["entries"] = reply
+            self.assertRaises(IOError, self.Downloader().Refresh, "entries")
+        self.Server.Profile = ["not", "a", "profile"]
+        self.assertRaises(IOError, self.Downloader().RefreshProfile)
+        with open(os.path.join(self.Dir, "nsglucosehistory")) as cachefile:
+            self.assertEqual(cachefile.read(), before)
+        self.assertEqual(self.Downloader().Load(nightscout.ProfileFile), {"units": "mg/dl"})
+
+    def testPumpHistoryRecord(self):
+        record = {"_type": "Bolus", "amount": 0.5, "timestamp": "2016-01-30T21:03:17"}
+        treatment = nightscout.PumpHistoryRecord(record)
+        self.assertEqual((treatment["type"], treatment["medtronic"], treatment["amount"]), ("medtronic", "Bolus", 0.5))
+        self.assertEqual(nightscout.ParseISOTime(treatment["dateString"]), treatment["date"] / 1000.0)
+        self.assertEqual(nightscout.RecordTime(treatment), time.mktime((2016, 1, 30, 21, 3, 17, 0, 0, -1)))
+
+    def testHostAndSecretFromTheIniFile(self):
+        inifile = os.path.join(self.Dir, "nightscout.ini")
+        self.assertEqual(nightscout.ReadConfig(inifile), (None, ""))
+        with open(inifile, "w") as config:
+            config.write("[nightscout]\nhost =\napi_secret = secret\n")
+        self.assertEqual(nightscout.ReadConfig(inifile), (None, "secret"))
+        self.assertRaises(nightscout.NotConfigured, nightscout.Connection, "", "secret")
+        with open(inifile, "w") as config:
+            config.write("[nightscout]\nhost = %s\napi_secret = secret\n" % self.Server.Host())
+        self.assertEqual(nightscout.ReadConfig(inifile), (self.Server.Host(), "secret"))
+
+    def testNothingIsQueuedWithoutAHost(self):
+        logged = []
+        saved = (pancreas.AppendLog, pancreas.NightscoutHost, pancreas.Nightscout)
+        where = os.getcwd()
+        try:
+            os.chdir(self.Dir)    #no nightscout.ini here
+            pancreas.AppendLog = lambda function, code, message=" ": logged.append((function, code))
+            (pancreas.NightscoutHost, pancreas.Nightscout) = (None, None)
+            self.assertEqual(pancreas.QueueNightscout("entries", nightscout.Entry(120, time.time())), 0)
+            self.assertEqual(pancreas.QueueNightscout("entries", nightscout.Entry(125, time.time())), 0)
+            self.assertEqual(pancreas.UpdateNightscout(), 0)
+            self.assertEqual(logged, [("QueueNightscout()", 7000)])    #said once
+            self.assertFalse(os.path.exists(os.path.join(self.Dir, "nightscout")))
+        finally:
+            os.chdir(where)
+            (pancreas.AppendLog, pancreas.NightscoutHost, pancreas.Nightscout) = saved
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#bobs/pumpstate.py: a value is read from the pump once per loop, unless it is too old or the remote was used.
+
+import unittest
+from bobs import pumpstate
+
+class Counter(object):
+
+    def __init__(self):
+        self.Calls = 0
+
+    def __call__(self):
+        self.Calls += 1
+        if self.Calls == 1:
+            raise IOError("no answer from the pump")
+        return self.Calls
+
+class PumpSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Now = 1000.0
+        self.Snapshot = pumpstate.PumpSnapshot(ttl=60, now=lambda: self.Now)
+        self.Status = Counter()
+
+    def testErrorsAreNotRemembered(self):
+        self.assertRaises(IOError, self.Snapshot.Get, "status", self.Status)
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 2)
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 2)
+        self.assertEqual(self.Status.Calls, 2)
+
+    def testValueExpiresAfterTheTTL(self):
+        self.Status.Calls = 1
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 2)
+        self.Now += 59
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 2)
+        self.Now += 1
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 3)
+
+    def testInvalidateAndNewLoop(self):
+        self.Status.Calls = 1
+        self.Snapshot.Get("status", self.Status)
+        self.Snapshot.Get("iob", lambda: 1.5)
+        self.Snapshot.Invalidate("status")
+        self.assertEqual(self.Snapshot.Get("status", self.Status), 3)
+        self.assertEqual(self.Snapshot.Get("iob", lambda: 0.0), 1.5)
+        self.assertEqual(self.Snapshot.NewLoop(), (1, 3))
+        self.assertEqual(self.Snapshot.Get("iob", lambda: 0.0), 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#bobs/pumpworker.py: the worker answers pings and serves requests through its backend, and a client whose worker is
+#gone finds out within the ping timeout instead of the request timeout.
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from bobs import pumpworker
+
+class FakeBackend(object):
+
+    def __init__(self):
+        self.Runs = []
+
+    def Run(self, args):
+        self.Runs.append(list(args))
+        if args[0] == "fail":
+            raise IOError("pump not in range")
+        return "output of " + " ".join(args)
+
+class PumpWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.Address = "ipc://" + os.path.join(self.Dir, "worker.ipc")
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def StartServer(self, backend):
+        thread = threading.Thread(target=pumpworker.Serve, args=(self.Address, backend))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def testRequestsArePassedToTheBackend(self):
+        backend = FakeBackend()
+        thread = self.StartServer(backend)
+        client = pumpworker.PumpClient(self.Address, timeout=5)
+        self.assertTrue(client.Ping())
+        self.assertEqual(client.Call("get-status"), "output of get-status")
+        self.assertRaises(IOError, client.Call, "fail")
+        self.assertEqual(client.Call("use", "pump", "iter_pump_hours", "2"), "output of use pump iter_pump_hours 2")
+        client.Stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(backend.Runs, [["get-status"], ["fail"], ["use", "pump", "iter_pump_hours", "2"]])
+
+    def testNoWorkerIsNoticedQuickly(self):
+        client = pumpworker.PumpClient(self.Address, timeout=1)
+        started = time.time()
+        self.assertFalse(client.Ping(0.5))
+        self.assertTrue(time.time() - started < 2)
+        self.assertRaises(pumpworker.NoReply, client.Call, "get-status")
+        self.assertTrue(isinstance(pumpworker.NoReply("x"), IOError))
+
+    def testClientRecoversAfterATimeout(self):
+        client = pumpworker.PumpClient(self.Address, timeout=1)
+        self.assertRaises(pumpworker.NoReply, client.Call, "get-status")
+        thread = self.StartServer(FakeBackend())
+        self.assertTrue(client.Ping())     #a new socket, not the one still waiting for the lost reply
+        client.Stop()
+        thread.join(5)
+
+if __name__ == "__main__":
+    unittest.main()
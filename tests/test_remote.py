@@ -0,0 +1,105 @@
+#bobs/remote.py: waveforms have the edges the pump expects, edges are played at their deadlines without lateness
+#adding up, and a press which starts late is still held for its full time.
+
+import unittest
+from bobs import clock
+from bobs import remote
+
+Act=17
+Bolus=27
+Suspend=22
+
+class FakeGPIO(object):
+#records (monotonic time, pin, level) for each output. Late maps an edge number to seconds that edge is held up.
+
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, late=None):
+        self.Late = late or {}
+        self.Outputs = []
+
+    def output(self, pin, level):
+        clock.Sleep(self.Late.get(len(self.Outputs), 0.0))
+        self.Outputs.append((clock.Monotonic(), pin, level))
+
+def Holds(outputs):
+#[(pin, seconds held)] in order of release
+
+    holds = []
+    rose = {}
+    for (t, pin, level) in outputs:
+        if level:
+            rose[pin] = t
+        else:
+            holds.append((pin, t - rose.pop(pin)))
+    return holds
+
+class WaveformTest(unittest.TestCase):
+
+    def testBolusWaveform(self):
+        timings = remote.NormalTimings
+        wave = remote.BolusWaveform(Act, Bolus, 3, timings)
+        pins = [pin for (offset, pin, level) in wave.Edges if level]
+        self.assertEqual(pins, [Act, Bolus, Bolus, Bolus, Bolus, Act, Act])
+        self.assertEqual([offset for (offset, pin, level) in wave.Edges], sorted(offset for (offset, pin, level) in wave.Edges))
+        countup = timings["countup"] + 3*timings["countupper"]
+        expected = timings["wake"] + 4*(timings["press"] + timings["gap"]) + timings["execute"] + countup + timings["confirm"]
+        self.assertAlmostEqual(wave.Duration(), expected, 9)
+
+    def testSuspendWaveform(self):
+        wave = remote.SuspendWaveform(Act, Suspend, remote.QuietTimings)
+        self.assertEqual([(pin, level) for (offset, pin, level) in wave.Edges], [(Act, 1), (Act, 0), (Suspend, 1), (Suspend, 0), (Act, 1), (Act, 0)])
+
+class PlayerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1000.0))
+
+    def tearDown(self):
+        clock.Use(self.Real)
+
+    def Play(self, wave, gpio):
+        player = remote.Player(gpio)
+        report = remote.PlayReport(wave)
+        player.Perform(wave, report)
+        return report
+
+    def testEdgesAreOnTime(self):
+        wave = remote.BolusWaveform(Act, Bolus, 5)
+        gpio = FakeGPIO()
+        start = clock.Monotonic()
+        report = self.Play(wave, gpio)
+        self.assertEqual(len(gpio.Outputs), len(wave.Edges))
+        for ((t, pin, level), (offset, wavepin, wavelevel)) in zip(gpio.Outputs, wave.Edges):
+            self.assertAlmostEqual(t - start, offset, 6)
+            self.assertEqual((pin, level), (wavepin, wavelevel))
+        self.assertAlmostEqual(report.Duration, wave.Duration(), 6)
+        self.assertEqual(report.Shift, 0.0)
+        self.assertTrue(report.MaxJitter() < 1e-5)
+
+    def testLateReleaseDoesNotAddUp(self):
+        wave = remote.BolusWaveform(Act, Bolus, 5)
+        start = clock.Monotonic()
+        gpio = FakeGPIO({3: 0.05})    #the second Easy Bolus release
+        report = self.Play(wave, gpio)
+        self.assertAlmostEqual(report.Lateness[3], 0.05, 6)
+        self.assertAlmostEqual(gpio.Outputs[4][0] - start, wave.Edges[4][0], 6)    #the next press is on time again
+        self.assertEqual(report.Shift, 0.0)
+
+    def testLatePressIsHeldForItsFullTime(self):
+        wave = remote.BolusWaveform(Act, Bolus, 5)
+        gpio = FakeGPIO({2: 0.15, 6: 0.3})    #two Easy Bolus presses start late, the second by more than its hold
+        start = clock.Monotonic()
+        report = self.Play(wave, gpio)
+        wanted = [(pin, wave.Edges[i+1][0] - wave.Edges[i][0]) for (i, (offset, pin, level)) in enumerate(wave.Edges) if level]
+        for ((pin, held), (wantedpin, hold)) in zip(Holds(gpio.Outputs), wanted):
+            self.assertEqual(pin, wantedpin)
+            self.assertTrue(held >= hold - 1e-6)
+        self.assertAlmostEqual(report.Shift, 0.45, 6)
+        #the gap after a pushed back release is kept too
+        self.assertAlmostEqual(gpio.Outputs[8][0] - gpio.Outputs[7][0], wave.Edges[8][0] - wave.Edges[7][0], 6)
+        self.assertAlmostEqual(report.Duration, wave.Duration() + 0.45, 6)
+
+if __name__ == "__main__":
+    unittest.main()
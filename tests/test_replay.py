@@ -0,0 +1,31 @@
+#bobs/replay.py: the recorded readings from 2016-01-29 21:00 on (the evening of the 30th) replay to the same decisions every time, from any directory, and
+#leaves the directory and the clock as they were.
+
+import os
+import unittest
+from bobs import clock
+from bobs import replay
+
+Start=replay.ParseTime("2016-01-29T21:00:00")
+
+class ReplayTest(unittest.TestCase):
+
+    def testOpenLoopReplay(self):
+        cwd = os.getcwd()
+        real = clock.Current
+        report = replay.Replay().Run(Start)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertTrue(clock.Current is real)
+        self.assertEqual(report["loops"], 53)
+        self.assertEqual(len(report["boluses"]), 8)
+        self.assertAlmostEqual(report["total_units"], 2.9, 6)
+        self.assertEqual((len(report["suspends"]), len(report["resumes"])), (4, 3))
+
+    def testSameDecisionsTwice(self):
+        first = replay.Replay().Run(Start)
+        second = replay.Replay().Run(Start)
+        self.assertEqual(first["boluses"], second["boluses"])
+        self.assertEqual(first["suspends"], second["suspends"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+#bobs/scheduler.py: the phase is learned from reading times, across the end of the 5 minute cycle too, and the next
+#poll is just after the next reading which has not been seen yet.
+
+import unittest
+from bobs import scheduler
+
+class SensorPhaseTest(unittest.TestCase):
+
+    def testPhaseWrapsAroundThePeriod(self):
+        phase = scheduler.SensorPhase()
+        self.assertFalse(phase.Ready())
+        for t in (1000*300 + 299, 1001*300 + 1, 1002*300 + 299, 1003*300 + 1):
+            phase.Observe(t)
+        phase.Observe(1003*300 + 1)
+        self.assertEqual(len(phase.Offsets), 4)
+        self.assertTrue(min(phase.Phase(), 300 - phase.Phase()) < 1e-6)
+
+    def testPollsJustAfterTheNextReading(self):
+        phase = scheduler.SensorPhase(margin=75)
+        for i in range(0, 6):
+            phase.Observe(1000*300 + i*300 + 120)
+        last = 1005*300 + 120
+        self.assertAlmostEqual(phase.NextReading(last + 10), last + 300, 6)
+        self.assertAlmostEqual(phase.PollTime(last + 10), last + 375, 6)
+        #the poll for a reading not seen yet stays ahead while it is within the margin
+        self.assertAlmostEqual(phase.NextReading(last + 300 + 30), last + 300, 6)
+        self.assertAlmostEqual(phase.NextReading(last + 300 + 80), last + 600, 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#bobs/schedules.py: the value in force follows the time of day, a changed file is parsed again, and a broken file
+#leaves the last good schedule in place.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from bobs import schedules
+
+def At(hour, minute=0):
+    return time.mktime((2016, 1, 30, hour, minute, 0, 0, 0, -1))
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.File = os.path.join(self.Dir, "insulin_sensitivities.json")
+        self.Writes = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def Write(self, sensitivities):
+        with open(self.File, "w") as settingsfile:
+            json.dump({"units": "mg/dL", "sensitivities": [{"start": start, "sensitivity": value} for (start, value) in sensitivities]}, settingsfile)
+        self.Writes += 1
+        later = time.time() + 10*self.Writes     #a new mtime for every write, even within the same second
+        os.utime(self.File, (later, later))
+
+    def testValueFollowsTheTimeOfDay(self):
+        schedule = schedules.FromEntries([{"start": "22:00:00", "sensitivity": 50}, {"start": "06:30:00", "sensitivity": 40}], "sensitivity")
+        self.assertEqual([schedule.At(At(h, m)) for (h, m) in [(0, 0), (6, 29), (6, 30), (21, 59), (22, 0)]], [50, 50, 40, 40, 50])
+        self.assertEqual(schedules.MaxIOB({"max_iob": 2.5}).At(At(12)), 2.5)
+        self.assertRaises(ValueError, schedules.Schedule, [], [])
+
+    def testChangedFileIsReloaded(self):
+        self.Write([("00:00:00", 45)])
+        settings = schedules.SettingsIndex()
+        self.assertEqual(settings.Value(self.File, schedules.Sensitivities, At(12)), 45)
+        self.assertEqual(settings.Value(self.File, schedules.Sensitivities, At(13)), 45)
+        self.assertEqual(settings.Get(self.File, schedules.Sensitivities).Loads, 1)
+        self.Write([("00:00:00", 45), ("12:30:00", 35)])
+        self.assertEqual(settings.Changed(self.File, schedules.Sensitivities, At(13)), (True, 35))
+        self.assertEqual(settings.Changed(self.File, schedules.Sensitivities, At(14)), (False, 35))
+        self.assertEqual(settings.Changed(self.File, schedules.Sensitivities, At(1)), (True, 45))
+
+    def testBrokenFileKeepsTheLastGoodSchedule(self):
+        settings = schedules.SettingsFile(self.File, schedules.Sensitivities)
+        self.assertRaises(IOError, settings.Value)
+        self.Write([("00:00:00", 45)])
+        self.assertEqual(settings.Value(At(12)), 45)
+        with open(self.File, "w") as settingsfile:
+            settingsfile.write('{"sensitivities": [')
+        self.assertEqual(settings.Value(At(12)), 45)
+        self.assertTrue(settings.Error.startswith(self.File))
+        self.Write([("00:00:00", 50)])
+        self.assertEqual(settings.Value(At(12)), 50)
+        self.assertEqual(settings.Error, None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#bobs/statefile.py: commits alternate between the two slots, a damaged slot is detected by its CRC and the other one
+#is used, and a missing or foreign file starts from the defaults.
+
+import os
+import json
+import struct
+import shutil
+import tempfile
+import unittest
+from bobs import statefile
+
+class LoopStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Dir = tempfile.mkdtemp()
+        self.File = os.path.join(self.Dir, "state.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.Dir)
+
+    def SlotOffset(self, state, slot):
+        return state.HeaderSize + slot*state.SlotSize
+
+    def testFreshStateHasTheDefaults(self):
+        state = statefile.LoopState(self.File)
+        self.assertTrue(state.Fresh)
+        self.assertEqual(state.Values, statefile.Defaults())
+        self.assertRaises(KeyError, state.Update, nosuchfield=1)
+        state.Close()
+
+    def testCommitsSurviveReopening(self):
+        state = statefile.LoopState(self.File)
+        state.Update(loop=1, lg4p=156.0, historyvalues=[100.0]*statefile.HistoryLength)
+        state.Commit()
+        state.Update(loop=2, action=statefile.Actions["bolus"], actionunits=0.5)
+        state.Commit()
+        state.Close()
+        state = statefile.LoopState(self.File)
+        self.assertFalse(state.Fresh)
+        self.assertEqual((state.Get("loop"), state.Get("lg4p"), state.Get("actionunits")), (2, 156.0, 0.5))
+        self.assertEqual(state.Get("historyvalues"), [100.0]*statefile.HistoryLength)
+        self.assertEqual(state.Sequence, 2)
+        state.Close()
+
+    def testDamagedSlotFallsBackToTheOther(self):
+        state = statefile.LoopState(self.File)
+        state.Update(loop=1)
+        state.Commit()       #slot 1
+        state.Update(loop=2)
+        state.Commit()       #slot 0
+        offset = self.SlotOffset(state, 0) + struct.calcsize(statefile.SlotFormat)
+        state.Map[offset] = chr(ord(state.Map[offset]) ^ 0xff)     #a write cut short by a power cut
+        state.Map.flush()
+        state.Close()
+        state = statefile.LoopState(self.File)
+        self.assertEqual((state.Sequence, state.Get("loop")), (1, 1))
+        state.Update(loop=3)
+        state.Commit()       #goes over the damaged slot, not the good one
+        self.assertEqual(state.ReadSlot(1)[1]["loop"], 1)
+        self.assertEqual(state.ReadSlot(0)[1]["loop"], 3)
+        state.Close()
+
+    def testForeignFileIsReplaced(self):
+        state = statefile.LoopState(self.File)
+        size = len(state.Map)
+        state.Close()
+        with open(self.File, "r+b") as f:
+            f.write("JUNK")
+        state = statefile.LoopState(self.File)
+        self.assertTrue(state.Fresh)
+        self.assertEqual(len(state.Map), size)
+        state.Close()
+
+    def testImport(self):
+        predict = os.path.join(self.Dir, "predict.json")
+        success = os.path.join(self.Dir, "loopsuccess.txt")
+        with open(predict, "w") as f:
+            json.dump({"lg4p": 140, "lcf4p": 40, "lpc4p": 1.1}, f)
+        state = statefile.LoopState(self.File)
+        self.assertEqual(state.Import(predict, success), [predict])
+        self.assertEqual((state.Get("lg4p"), state.Get("lpc4p"), state.Get("lastsuccess")), (140, 1.1, 0.0))
+        state.Close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#SuspendPump() in bobs/pancreas.py against a fake pump and remote: it returns as soon as the pump answers in the new
+#state, checking with growing gaps from the profile's first poll time, and records how long that took in the timing
+#profile. a pump which is not back by ReadyDeadline widens the profile and falls back to get-session and a status read.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import calibration
+from bobs import pancreas
+
+class FakePump(object):
+#a pump which does not answer for Busy seconds after the remote is used. with Ignore it does not change state either.
+
+    def __init__(self, suspended=False, busy=4.0, ignore=False):
+        self.Suspended = suspended
+        self.Busy = busy
+        self.Ignore = ignore
+        self.AnswersFrom = 0.0
+        self.Calls = []
+
+    def Toggle(self):
+        if not self.Ignore:
+            self.Suspended = not self.Suspended
+        self.AnswersFrom = clock.Monotonic() + self.Busy
+
+    def RunOpenaps(self, *args):
+        self.Calls.append((args[0], clock.Monotonic()))
+        if clock.Monotonic() < self.AnswersFrom:
+            raise IOError("no answer")
+        if args[0] == "get-status":
+            return json.dumps({"status": "normal", "bolusing": False, "suspended": self.Suspended})
+        return ""
+
+class FakeRemote(object):
+
+    def __init__(self, pump):
+        self.Pump = pump
+        self.Played = 0
+
+    def Play(self, waveform):
+        self.Played += 1
+        self.Pump.Toggle()
+        return self
+
+    def Summary(self):
+        return "played."
+
+class FakeSnapshot(object):
+#no caching: every status comes from the pump
+
+    def Get(self, name, read):
+        return read()
+
+    def Invalidate(self):
+        pass
+
+class SuspendPumpTest(unittest.TestCase):
+
+    Patched = ("AppendLog", "RunOpenaps", "Remote", "Snapshot", "RecordActuation", "QueueNightscout", "RemoteTiming", "UseRemoteTiming")
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1000.0))
+        self.Dir = tempfile.mkdtemp()
+        self.Saved = dict((name, getattr(pancreas, name)) for name in self.Patched)
+        self.Logged = []
+        self.Actions = []
+        self.Notes = []
+        self.Profile = calibration.TimingProfile("123456", os.path.join(self.Dir, "remote_timing.json"))
+        pancreas.AppendLog = lambda function, code, message=" ": self.Logged.append(code)
+        pancreas.Snapshot = FakeSnapshot()
+        pancreas.RecordActuation = lambda action, units=0.0: self.Actions.append(action)
+        pancreas.QueueNightscout = lambda collection, *records: self.Notes.extend(records)
+        pancreas.RemoteTiming = self.Profile
+        pancreas.UseRemoteTiming = True
+
+    def tearDown(self):
+        for (name, value) in self.Saved.items():
+            setattr(pancreas, name, value)
+        clock.Use(self.Real)
+        shutil.rmtree(self.Dir)
+
+    def Use(self, pump):
+        pancreas.RunOpenaps = pump.RunOpenaps
+        pancreas.Remote = FakeRemote(pump)
+        return pump
+
+    def Suspend(self, desiredstatus=True):
+        started = clock.Monotonic()
+        result = pancreas.SuspendPump(desiredstatus)
+        return (result, clock.Monotonic() - started)
+
+    def testReturnsAsSoonAsThePumpIsInTheNewState(self):
+        pump = self.Use(FakePump(busy=4.0))
+        (result, seconds) = self.Suspend()
+        self.assertEqual(result, 1)
+        self.assertTrue(pump.Suspended)
+        self.assertEqual(seconds, calibration.FirstPoll)    #the first check, not the old 15 seconds and a session reset
+        self.assertEqual([call for (call, t) in pump.Calls], ["get-status", "get-session", "get-status"])
+        self.assertEqual(self.Profile.Profile["observed"], {"suspend": [[1, calibration.FirstPoll]]})
+        self.assertEqual(self.Actions, ["suspend"])
+        self.assertEqual([note["notes"] for note in self.Notes], ["Pump suspended."])
+        self.assertIn(6007, self.Logged)
+        self.assertNotIn(5008, self.Logged)
+
+    def testChecksBackOffFromTheCalibratedFirstPoll(self):
+        self.Profile.Record("resume", 3.0)
+        self.Profile.Record("resume", 4.0)
+        pump = self.Use(FakePump(suspended=True, busy=9.5))
+        (result, seconds) = self.Suspend(False)
+        self.assertEqual(result, 1)
+        checks = [t - 1000.0 for (call, t) in pump.Calls if call == "get-session"]
+        self.assertEqual(checks, [3.0, 4.0, 6.0, 10.0])    #the quickest measurement, then gaps of 1, 2, 4 seconds
+        self.assertEqual(self.Profile.Profile["observed"]["resume"], [[4, 10.0]])
+        self.assertEqual(self.Profile.Profile["widened"], {})
+
+    def testAlreadyInTheStateDoesNotUseTheRemote(self):
+        pump = self.Use(FakePump(suspended=True))
+        self.assertEqual(self.Suspend()[0], 1)
+        self.assertEqual(pancreas.Remote.Played, 0)
+        self.assertEqual(self.Actions, [])
+
+    def testNotBackInTimeWidensAndFallsBack(self):
+        self.Profile.Record("suspend", 3.0)
+        settle = self.Profile.Settle("suspend", 15)
+        pump = self.Use(FakePump(busy=pancreas.ReadyDeadline + 10))
+        (result, seconds) = self.Suspend()
+        self.assertEqual(result, 1)    #the status read after the fallback finds it suspended
+        self.assertIn(5008, self.Logged)
+        self.assertEqual(self.Profile.Profile["widened"], {"suspend": 2})
+        self.assertTrue(self.Profile.Settle("suspend", 15) > settle)
+        self.assertNotIn("suspend", self.Profile.Profile["observed"])
+        self.assertEqual(self.Logged.count(5082), 2)    #get-session failed, waited, failed again and moved on
+        self.assertTrue(seconds > pancreas.ReadyDeadline + 10)
+
+    def testPumpWhichIgnoresTheRemote(self):
+        pump = self.Use(FakePump(busy=2.0, ignore=True))
+        (result, seconds) = self.Suspend()
+        self.assertEqual(result, -1)
+        self.assertIn(5008, self.Logged)
+        self.assertIn(5006, self.Logged)
+        self.assertEqual(self.Profile.Profile["widened"], {})    #not calibrated: the fixed 15 seconds were used, nothing to widen
+        self.assertEqual(self.Notes, [])
+
+if __name__ == "__main__":
+    unittest.main()
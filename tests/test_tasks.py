@@ -0,0 +1,79 @@
+#bobs/tasks.py: nothing runs in the background until Start(), pump calls are run one at a time in order, errors come
+#back to the caller, and kicks to a busy task are merged.
+
+import time
+import threading
+import unittest
+from bobs import tasks
+
+class SerialQueueTest(unittest.TestCase):
+
+    def testInLineUntilStarted(self):
+        queue = tasks.SerialQueue()
+        self.assertEqual(queue.Call(threading.current_thread), threading.current_thread())
+
+    def testCallsRunOneAtATime(self):
+        queue = tasks.SerialQueue()
+        queue.Start()
+        running = []
+        overlaps = []
+        order = []
+
+        def Job(i):
+            running.append(i)
+            if len(running) > 1:
+                overlaps.append(i)
+            time.sleep(0.01)
+            order.append(i)
+            running.remove(i)
+            return i * 2
+
+        threads = [threading.Thread(target=queue.Call, args=(Job, i)) for i in range(0, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(overlaps, [])
+        self.assertEqual(sorted(order), range(0, 5))
+        self.assertEqual(queue.Call(Job, 7), 14)
+        self.assertEqual(queue.Call(lambda: queue.Call(Job, 3)), 6)     #a call from a queued job runs in line
+        self.assertRaises(ZeroDivisionError, queue.Call, lambda: 1 / 0)
+        queue.Stop()
+
+class TaskTest(unittest.TestCase):
+
+    def testKickRunsInLineUntilStarted(self):
+        errors = []
+        group = tasks.TaskGroup(lambda name, e: errors.append(name))
+        runs = []
+        group.Add("upload", lambda: runs.append(1))
+        group.Add("broken", lambda: 1 / 0)
+        group.Kick("upload")
+        group.Kick("broken")
+        self.assertEqual(runs, [1])
+        self.assertEqual(errors, ["broken"])
+        self.assertEqual(group.Stats()["broken"][0:2], (1, 1))
+
+    def testKicksToABusyTaskAreMerged(self):
+        release = threading.Event()
+        started = threading.Event()
+        runs = []
+
+        def Slow():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+
+        task = tasks.Task("slow", Slow)
+        task.Start()
+        task.Kick()
+        started.wait(5)
+        for i in range(0, 10):
+            task.Kick()
+        release.set()
+        time.sleep(0.2)
+        task.Stop()
+        self.assertEqual(len(runs), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+#bobs/tuner.py: the grid and ranges are built as asked, scores rank safety first, and a sweep over the pool gives the
+#same results as running the sets one by one.
+
+import unittest
+from bobs import replay
+from bobs import tuner
+
+Start=replay.ParseTime("2016-01-29T21:00:00")
+
+class TunerTest(unittest.TestCase):
+
+    def testRangesAndGrid(self):
+        self.assertEqual(tuner.ParseRange("1.1:1.4:0.1", None), [1.1, 1.2, 1.3, 1.4])
+        self.assertEqual(tuner.ParseRange("200,275", None), [200.0, 275.0])
+        self.assertEqual(tuner.ParseRange(None, (0.5, 1.5, 0.25)), [0.5, 0.75, 1.0, 1.25, 1.5])
+        grid = tuner.Grid({"a": [1, 2], "b": [3, 4, 5]})
+        self.assertEqual(len(grid), 6)
+        self.assertTrue({"a": 2, "b": 5} in grid)
+        self.assertEqual(sorted(tuner.Sample({"a": [1, 2]}, 10)), sorted(tuner.Grid({"a": [1, 2]})))
+        self.assertEqual(tuner.Sample({"a": range(0, 100)}, 5, seed=1), tuner.Sample({"a": range(0, 100)}, 5, seed=1))
+
+    def testScoreRanksSafetyFirst(self):
+        def Result(values, units):
+            return {"score": tuner.Score({"simulated": [(i*300, g) for (i, g) in enumerate(values)], "total_units": units})}
+        safe = Result([100, 150, 200, 190], 1.0)       #half out of range, never low
+        low = Result([100, 120, 110, 65], 0.5)         #all but one in range, one low
+        greedy = Result([100, 150, 200, 190], 3.0)     #as safe, more insulin
+        self.assertEqual(safe["score"]["in_range"], 0.5)
+        self.assertEqual(low["score"]["below"], 0.25)
+        self.assertEqual(low["score"]["lowest"], 65.0)
+        self.assertEqual(sorted([low, greedy, safe], key=tuner.RankKey), [safe, greedy, low])
+        self.assertEqual(tuner.Score({"total_units": 0})["mean"], None)
+
+    def testSweepMatchesSerialRuns(self):
+        candidates = tuner.Grid({"AggressionFactorBase": [1.2, 1.3], "AggressionFactorWidth": [275], "MealDetectReponseFactor": [1.0]})
+        results = tuner.Sweep(candidates, start=Start, processes=2)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            report = replay.Replay(closed=True, overrides=result["params"]).Run(Start)
+            self.assertEqual(result["score"], tuner.Score(report))
+            self.assertEqual(result["boluses"], len(report["boluses"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#bobs/usbpower.py: the ports are only switched when they are not already that way, a failed hub-ctrl leaves the state
+#unknown, a wake waits for the CareLink stick (or the blind wait) and counts the ones that time out, Lead() follows
+#the slowest recent wake, and EnergySaved() follows the time the ports were off. the loop's HubCtrl() raises when
+#hub-ctrl fails, so that a failed switch is not taken as done.
+
+import os
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import calibration
+from bobs import usbpower
+from bobs import pancreas
+
+class FakeHub(object):
+#the stick shows up Latency seconds after the ports are switched on (never, if None). Fail makes the next run raise.
+
+    def __init__(self, latency=2.0):
+        self.Latency = latency
+        self.Commands = []
+        self.Fail = False
+        self.OnSince = None
+
+    def Run(self, command):
+        if self.Fail:
+            self.Fail = False
+            raise IOError("hub-ctrl exited with 1")
+        self.Commands.append(command)
+        self.OnSince = clock.Monotonic() if command == usbpower.OnCommand else None
+
+    def Present(self):
+        return self.OnSince is not None and self.Latency is not None and clock.Monotonic() - self.OnSince >= self.Latency
+
+class PowerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1000.0))
+        self.Hub = FakeHub()
+        self.Power = usbpower.PowerManager(self.Hub.Run, self.Hub.Present, blindwait=10, timeout=5, watts=1.0)
+
+    def tearDown(self):
+        clock.Use(self.Real)
+
+    def testSwitchSkipsTheSameState(self):
+        self.assertTrue(self.Power.Sleep())
+        self.assertFalse(self.Power.Sleep())
+        self.assertEqual(self.Power.Wake(wait=False), 0.0)
+        self.assertEqual(self.Power.Wake(), 0.0)    #already on: no wait
+        self.assertEqual(self.Hub.Commands, [usbpower.OffCommand, usbpower.OnCommand])
+        self.assertEqual((self.Power.Transitions, self.Power.Skipped), (2, 2))
+
+    def testFailedSwitchLeavesTheStateUnknown(self):
+        self.Power.Sleep()
+        self.Hub.Fail = True
+        self.assertRaises(IOError, self.Power.Wake)
+        self.assertIsNone(self.Power.On)
+        self.assertTrue(self.Power.Switch(True))    #tried again, not skipped
+        self.assertEqual(self.Hub.Commands, [usbpower.OffCommand, usbpower.OnCommand])
+
+    def testWakeWaitsForTheStick(self):
+        self.Power.Sleep()
+        waited = self.Power.Wake()
+        self.assertTrue(2.0 <= waited < 2.0 + 1.0)
+        self.assertEqual(self.Power.Latencies, [waited])
+        self.assertAlmostEqual(self.Power.Lead(), waited + usbpower.WakeMargin)
+
+    def testWakeTimeoutIsCounted(self):
+        self.Hub.Latency = None
+        self.Power.Sleep()
+        started = clock.Monotonic()
+        self.assertRaises(calibration.NotReady, self.Power.Wake)
+        self.assertGreaterEqual(clock.Monotonic() - started, 5)
+        self.assertEqual((self.Power.Timeouts, self.Power.Latencies, self.Power.On), (1, [], True))
+
+    def testBlindWaitWhenTheStickCannotBeSeen(self):
+        power = usbpower.PowerManager(self.Hub.Run, lambda: None, blindwait=10)
+        self.assertEqual(power.Lead(), 10.0)
+        power.Sleep()
+        self.assertEqual(power.Wake(), 10.0)
+        self.assertEqual(power.Latencies, [])
+
+    def testLeadFollowsTheSlowestRecentWake(self):
+        for latency in [1.0, 3.0] + [1.0]*usbpower.KeepLatencies:
+            self.Hub.Latency = latency
+            self.Power.Cycle(1)
+        self.assertEqual(len(self.Power.Latencies), usbpower.KeepLatencies)
+        self.assertTrue(self.Power.Lead() < 3.0 + usbpower.WakeMargin)
+
+    def testEnergySavedFollowsTheTimeOff(self):
+        self.assertEqual(self.Power.EnergySaved(), 0.0)
+        self.Power.Wake(wait=False)
+        clock.Sleep(3600)
+        self.Power.Sleep()
+        clock.Sleep(3600)
+        self.assertAlmostEqual(self.Power.EnergySaved(), 12.0)
+        report = self.Power.Report()
+        self.assertAlmostEqual(report["off_fraction"], 0.5)
+        self.assertEqual(report["on"], False)
+
+    def testHubCtrlRaisesOnAFailedRun(self):
+        pancreas.HubCtrl("true")
+        self.assertRaises(IOError, pancreas.HubCtrl, "echo no hub 9 >&2; exit 1")
+        where = os.getcwd()
+        empty = tempfile.mkdtemp()
+        try:
+            os.chdir(empty)    #no ./hub-ctrl.c/hub-ctrl here
+            power = usbpower.PowerManager(pancreas.HubCtrl)
+            self.assertRaises(IOError, power.Sleep)
+            self.assertIsNone(power.On)
+            self.assertEqual(power.Transitions, 0)
+        finally:
+            os.chdir(where)
+            shutil.rmtree(empty)
+
+if __name__ == "__main__":
+    unittest.main()
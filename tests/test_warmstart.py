@@ -0,0 +1,83 @@
+#bobs/warmstart.py: the settings fingerprint follows the files, a snapshot is only good for a warm start when the
+#loop ran recently and nothing changed, and the CareLink stick is found on a sysfs-like USB tree.
+
+import os
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import calibration
+from bobs import warmstart
+
+class WarmStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(100000.0))
+        self.Dir = tempfile.mkdtemp()
+        self.Files = [os.path.join(self.Dir, name) for name in ("bg_targets.json", "max_iob.json")]
+        for name in self.Files:
+            with open(name, "w") as settingsfile:
+                settingsfile.write("{}")
+        self.File = os.path.join(self.Dir, "warmstart.json")
+
+    def tearDown(self):
+        clock.Use(self.Real)
+        shutil.rmtree(self.Dir)
+
+    def Device(self, name, vendor, product):
+        device = os.path.join(self.Dir, "usb", name)
+        os.makedirs(device)
+        for (field, value) in (("idVendor", vendor), ("idProduct", product)):
+            with open(os.path.join(device, field), "w") as idfile:
+                idfile.write(value + "\n")
+
+    def testFingerprintFollowsTheFiles(self):
+        before = warmstart.Fingerprint(self.Files)
+        self.assertEqual(warmstart.Fingerprint(self.Files), before)
+        with open(self.Files[1], "w") as settingsfile:
+            settingsfile.write('{"max_iob": 3}')
+        changed = warmstart.Fingerprint(self.Files)
+        self.assertNotEqual(changed, before)
+        os.remove(self.Files[0])
+        self.assertNotEqual(warmstart.Fingerprint(self.Files), changed)
+
+    def testSnapshotUsableOnlyWhenRecentAndUnchanged(self):
+        fingerprint = warmstart.Fingerprint(self.Files)
+        self.assertFalse(warmstart.Snapshot(self.File).Usable(clock.Time(), fingerprint)[0])
+        warmstart.Snapshot(self.File).Save("554", fingerprint, clock.Time() - 600, loop=12)
+        snapshot = warmstart.Snapshot(self.File)
+        self.assertEqual(snapshot.Get("model"), "554")
+        self.assertEqual(snapshot.Get("loop"), 12)
+        now = clock.Time()
+        self.assertTrue(snapshot.Usable(now - 60, fingerprint)[0])
+        self.assertFalse(snapshot.Usable(0, fingerprint)[0])
+        self.assertFalse(snapshot.Usable(now - warmstart.MaxAge - 1, fingerprint)[0])
+        self.assertFalse(snapshot.Usable(now - 60, "0" * 40)[0])
+        snapshot.Forget()
+        self.assertFalse(os.path.exists(self.File))
+        self.assertIsNone(warmstart.Snapshot(self.File).Get("model"))
+
+    def testSettingsChange(self):
+        self.assertTrue(warmstart.SettingsChange({"_type": "ChangeBGTargetRange"}))
+        self.assertTrue(warmstart.SettingsChange({"_type": "SelectBasalProfile"}))
+        self.assertFalse(warmstart.SettingsChange({"_type": "Bolus"}))
+        self.assertFalse(warmstart.SettingsChange({}))
+
+    def testStickPresent(self):
+        devices = os.path.join(self.Dir, "usb")
+        self.assertIsNone(warmstart.StickPresent(devices))
+        self.Device("1-1", "0424", "9514")
+        os.makedirs(os.path.join(devices, "usb1"))    #a hub without ids
+        self.assertFalse(warmstart.StickPresent(devices))
+        self.Device("1-1.2", warmstart.StickVendor, warmstart.StickProduct)
+        self.assertTrue(warmstart.StickPresent(devices))
+        self.assertEqual(warmstart.WaitForStick(5, 0.5, devices), 0.0)
+
+    def testWaitForStickGivesUp(self):
+        self.Device("1-1", "0424", "9514")
+        started = clock.Monotonic()
+        self.assertRaises(calibration.NotReady, warmstart.WaitForStick, 5, 0.5, os.path.join(self.Dir, "usb"))
+        self.assertGreaterEqual(clock.Monotonic() - started, 5)
+
+if __name__ == "__main__":
+    unittest.main()
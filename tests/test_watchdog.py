@@ -0,0 +1,119 @@
+#bobs/watchdog.py: a stalled loop is recovered one step at a time with Grace in between, a step which does not
+#apply is passed over, recovery starts over after the last step with twice the wait each round, a successful loop
+#starts again from the first step, and a restart carries on from the step after the one in the record file.
+
+import os
+import shutil
+import tempfile
+import unittest
+from bobs import clock
+from bobs import watchdog
+
+class WatchdogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.Real = clock.Use(clock.SimulatedClock(1000.0))
+        self.Dir = tempfile.mkdtemp()
+        self.File = os.path.join(self.Dir, "watchdog.json")
+        self.Ran = []
+        self.Logged = []
+        self.Applies = {"pump worker": True, "usb power": True, "restart": True, "reboot": True}
+
+    def tearDown(self):
+        clock.Use(self.Real)
+        shutil.rmtree(self.Dir)
+
+    def Step(self, name):
+        def Run():
+            self.Ran.append(name)
+            return self.Applies[name]
+        return (name, Run)
+
+    def Watchdog(self, grace=100, maxgrace=300):
+        return watchdog.Watchdog([self.Step(name) for name in ("pump worker", "usb power", "restart", "reboot")],
+                                 lambda code, message: self.Logged.append(code), self.File, stall=50, grace=grace, maxgrace=maxgrace)
+
+    def Until(self, dog, seconds, step=10):
+    #checks every step seconds for seconds. returns the steps run, with the seconds after the start they ran at
+
+        started = clock.Monotonic()
+        ran = []
+        while clock.Monotonic() - started < seconds:
+            clock.Sleep(step)
+            name = dog.Check()
+            if name is not None:
+                ran.append((name, clock.Monotonic() - started))
+        return ran
+
+    def testStallEscalatesOneStepPerGrace(self):
+        dog = self.Watchdog()
+        dog.Beat("treat", 30)
+        self.assertEqual(self.Until(dog, 30), [])
+        ran = self.Until(dog, 370)
+        self.assertEqual(ran, [("pump worker", 10), ("usb power", 110), ("restart", 210), ("reboot", 310)])
+        self.assertIn("stage 'treat'", dog.Records[0]["why"])
+        self.assertEqual([record["result"] for record in dog.Records], ["escalated"]*3 + [None])
+
+    def testStepWhichDoesNotApplyIsPassedOver(self):
+        self.Applies["pump worker"] = False
+        dog = self.Watchdog()
+        dog.Trip("no successful loop for 20 minutes")
+        self.assertEqual(dog.Check(), "usb power")
+        self.assertEqual(self.Ran, ["pump worker", "usb power"])
+        self.assertEqual([record["step"] for record in dog.Records], ["usb power"])
+
+    def testStartsOverAfterTheRebootWaitingLonger(self):
+        dog = self.Watchdog()
+        dog.Trip("stuck")
+        ran = self.Until(dog, 3000)
+        self.assertEqual([name for (name, at) in ran[:9]], ["pump worker", "usb power", "restart", "reboot"]*2 + ["pump worker"])
+        gaps = [later - earlier for ((n, earlier), (m, later)) in zip(ran, ran[1:])]
+        self.assertEqual(gaps[:4], [100]*4)     #the reboot gets the same Grace as the steps before it
+        self.assertEqual(gaps[4:8], [200]*4)    #round 2
+        self.assertEqual(gaps[8:11], [300]*3)   #round 3: 400, capped
+        self.assertEqual(dog.Records[4]["round"], 1)
+        self.assertIn(7000, self.Logged)
+
+    def testNoStepAppliesDoesNotSpin(self):
+        for name in self.Applies:
+            self.Applies[name] = False
+        dog = self.Watchdog()
+        dog.Trip("stuck")
+        self.assertIsNone(dog.Check())
+        self.assertEqual(len(self.Ran), 4)
+        self.assertEqual(dog.Records, [])
+
+    def testSuccessStartsAgainFromTheFirstStep(self):
+        dog = self.Watchdog()
+        dog.Trip("stuck")
+        self.Until(dog, 250)
+        self.assertEqual(dog.Level, 3)
+        dog.Success()
+        self.assertEqual(dog.Records[-1]["result"], "recovered")
+        self.assertIn(6017, self.Logged)
+        self.assertEqual((dog.Level, dog.Round, dog.Wait()), (0, 0, 100))
+        dog.Beat("wait")
+        self.assertIsNone(dog.Check())
+        dog.Trip("stuck again")
+        self.assertEqual(dog.Check(), "pump worker")
+        self.assertEqual(dog.Summary()["pump worker"], (2, 0.0, 0))
+
+    def testRestartCarriesOnFromTheRecord(self):
+        dog = self.Watchdog()
+        dog.Trip("stuck")
+        self.Until(dog, 250)
+        self.assertEqual(dog.Records[-1]["step"], "restart")
+        after = self.Watchdog()    #the process which comes after the restart
+        self.assertEqual(after.Level, 3)
+        after.Trip("still stuck")
+        self.assertIsNone(after.Check())    #the restart gets its Grace first
+        self.assertEqual([name for (name, at) in self.Until(after, 100)], ["reboot"])
+        again = self.Watchdog()    #after the reboot: the next round, with twice the wait
+        self.assertEqual((again.Level, again.Round), (4, 0))
+        again.Trip("still stuck")
+        self.assertEqual(self.Until(again, 210), [("pump worker", 100)])
+        self.assertEqual((again.Round, again.Wait()), (1, 200))
+        self.assertEqual([(record["step"], record["result"], record["round"]) for record in again.Records[-2:]], [("reboot", "escalated", 0), ("pump worker", None, 1)])
+
+if __name__ == "__main__":
+    unittest.main()